@@ -1,7 +1,13 @@
 import firebase_admin
 from firebase_admin import credentials, auth
+import asyncio
+import hashlib
 import os
 import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 if not firebase_admin._apps:
     json_cred = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
@@ -11,10 +17,119 @@ if not firebase_admin._apps:
     cred_dict = json.loads(json_cred)
     cred = credentials.Certificate(cred_dict)
     firebase_admin.initialize_app(cred)
-    
-def verify_token(id_token: str):
+
+# ────────────────────────────────────────────────
+# 🔐 Caché de ID tokens verificados
+# ────────────────────────────────────────────────
+# verify_id_token hace verificación RSA (y a veces baja los certs de Google):
+# se cachea el token decodificado por hash del token hasta su `exp`
+# (acotado por AUTH_CACHE_TTL_S) en un LRU de AUTH_CACHE_SIZE entradas.
+# Los fallos de caché se verifican en un pool de hilos, fuera del event loop.
+#
+# ENV:
+#   AUTH_CACHE_SIZE      tokens en caché (default 10000, 0 = sin caché)
+#   AUTH_CACHE_TTL_S     vida máxima de una entrada, en segundos (default 300)
+#   AUTH_VERIFY_WORKERS  hilos para verificar tokens (default 4)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL_S = float(os.getenv("AUTH_CACHE_TTL_S", "300"))
+AUTH_VERIFY_WORKERS = int(os.getenv("AUTH_VERIFY_WORKERS", "4"))
+
+# margen para no servir un token que expira mientras se procesa la petición
+_EXP_SKEW_S = 5
+
+
+class TokenCache:
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL_S):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def key(id_token: str) -> str:
+        return hashlib.sha256(id_token.encode()).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            decoded, expires_at = item
+            if expires_at <= time.time():
+                del self._items[key]
+                self.stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return decoded
+
+    def put(self, key: str, decoded: dict):
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        exp = decoded.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp - _EXP_SKEW_S)
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._items[key] = (decoded, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+token_cache = TokenCache()
+_verify_executor = ThreadPoolExecutor(max_workers=max(1, AUTH_VERIFY_WORKERS), thread_name_prefix="auth-verify")
+_inflight: dict[str, asyncio.Future] = {}
+
+
+def _verify_uncached(id_token: str):
     try:
         decoded_token = auth.verify_id_token(id_token)
         return decoded_token
     except Exception as e:
         return None
+
+
+def verify_token(id_token: str):
+    key = TokenCache.key(id_token)
+    decoded_token = token_cache.get(key)
+    if decoded_token is not None:
+        return decoded_token
+    decoded_token = _verify_uncached(id_token)
+    if decoded_token:
+        token_cache.put(key, decoded_token)
+    return decoded_token
+
+
+async def verify_token_async(id_token: str):
+    """Igual que verify_token, pero la verificación criptográfica corre en el pool de hilos."""
+    key = TokenCache.key(id_token)
+    decoded_token = token_cache.get(key)
+    if decoded_token is not None:
+        return decoded_token
+
+    # Peticiones simultáneas con el mismo token comparten una sola verificación
+    fut = _inflight.get(key)
+    if fut is None:
+        fut = asyncio.get_running_loop().run_in_executor(_verify_executor, _verify_uncached, id_token)
+        _inflight[key] = fut
+        fut.add_done_callback(lambda f: _verified(key, f))
+    return await asyncio.shield(fut)
+
+
+def _verified(key: str, fut: asyncio.Future):
+    _inflight.pop(key, None)
+    if not fut.cancelled() and fut.exception() is None and fut.result():
+        token_cache.put(key, fut.result())
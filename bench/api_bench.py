@@ -0,0 +1,329 @@
+# bench/api_bench.py
+# Benchmark end-to-end del API (iotaas.app) en proceso:
+#
+#   httpx.AsyncClient ──ASGI──▶ iotaas.app (lifespan real, middleware, sidecars)
+#                                   ├─▶ Mongo: mongomock-motor (default) o --mongo-uri local
+#                                   └─▶ ChirpStack: fake_chirpstack (proceso hijo)
+#
+# Escenarios (--scenarios, en este orden):
+#   tenant_create    POST /tenants               (Mongo + gRPC Tenant/Application)
+#   device_register  POST /devices               (count/find + profile por nombre + gRPC Device.Create)
+#   gateway_create   POST /gateways              (gw_sidecar create)
+#   gateway_list     GET  /gateways
+#   gateway_delete   DELETE /gateways/{id}       (gw_sidecar delete)
+#   device_list      GET  /devices/{tenant_id}
+#   telemetry_read   GET  /devices/{eui}/data
+#   alert_list       GET  /alerts/{tenant_id}
+# Cada escenario: --warmup peticiones sin medir y --requests medidas con
+# --concurrency en vuelo; reporta p50/p95/p99/max y req/s.
+#
+# Baselines (bench/baselines/api.json): --update-baseline guarda los resultados;
+# sin esa opción, sale con código 1 si algún escenario empeora más de
+# --tolerance o supera --max-error-rate (ver bench/common.compare).
+#
+# Uso:
+#   python -m bench.api_bench
+#   python -m bench.api_bench --concurrency 32 --requests 500 --cs-latency-ms 15
+#   python -m bench.api_bench --scenarios device_list,telemetry_read --update-baseline
+import argparse, asyncio, json, os, sys, time
+from datetime import datetime, timedelta, timezone
+
+from bench.common import (
+    use_mongomock, use_local_mongo, offline_firebase_credentials, seed_token,
+    run_load, load_baseline, save_baseline, compare, config_mismatch, print_table,
+)
+
+SCENARIOS = [
+    "tenant_create", "device_register", "gateway_create", "gateway_list",
+    "gateway_delete", "device_list", "telemetry_read", "alert_list",
+]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "api.json")
+
+BENCH_TOKEN = "bench-token"
+BENCH_CLAIMS = {"uid": "bench-user", "email": "bench@example.com", "email_verified": True}
+AUTH = {"Authorization": f"Bearer {BENCH_TOKEN}"}
+
+# prefijos hex para que devices y gateways de distintos escenarios no choquen
+_DEVICE_EUI = 0xBE00000000000000
+_GATEWAY_EUI = 0xCA00000000000000
+_TELEMETRY_EUI = 0xDA00000000000000
+
+
+def _eui(base: int, n: int) -> str:
+    return f"{base + n:016X}"
+
+
+class BenchContext:
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.tenants: list[str] = []
+        self.telemetry_euis: list[str] = []
+        self.gateways: list[tuple[str, str]] = []  # (tenant_id, gateway_id) creados y aún vivos
+        self._seq: dict[str, int] = {}
+
+    def seq(self, name: str) -> int:
+        n = self._seq.get(name, 0)
+        self._seq[name] = n + 1
+        return n
+
+    def tenant(self, i: int) -> str:
+        return self.tenants[i % len(self.tenants)]
+
+
+def _ok(resp, expected=(200,)):
+    if resp.status_code in expected:
+        return True
+    return False, f"{resp.request.method} {resp.request.url.path} → {resp.status_code}: {resp.text[:200]}"
+
+
+# ────────────────────────────────────────────────
+# 🧱 Escenarios
+# ────────────────────────────────────────────────
+async def op_tenant_create(ctx: BenchContext, i: int):
+    r = await ctx.client.post("/tenants", json={"name": f"bench-tenant-{ctx.seq('tenant')}"}, headers=AUTH)
+    return _ok(r)
+
+
+async def op_device_register(ctx: BenchContext, i: int):
+    r = await ctx.client.post("/devices", headers=AUTH, json={
+        "tenant_id": ctx.tenant(i), "dev_eui": _eui(_DEVICE_EUI, ctx.seq("device")),
+        "name": f"bench-dev-{i}", "type": "gateway", "location": "bench",
+    })
+    return _ok(r)
+
+
+async def op_gateway_create(ctx: BenchContext, i: int):
+    tenant_id = ctx.tenant(i)
+    gateway_id = _eui(_GATEWAY_EUI, ctx.seq("gateway"))
+    r = await ctx.client.post("/gateways", headers=AUTH, json={
+        "tenant_id": tenant_id, "gateway_id": gateway_id, "name": f"bench-gw-{gateway_id[-6:]}",
+    })
+    if r.status_code == 200:
+        ctx.gateways.append((tenant_id, gateway_id))
+    return _ok(r)
+
+
+async def op_gateway_list(ctx: BenchContext, i: int):
+    r = await ctx.client.get("/gateways", params={"tenant_id": ctx.tenant(i)}, headers=AUTH)
+    return _ok(r)
+
+
+async def op_gateway_delete(ctx: BenchContext, i: int):
+    if not ctx.gateways:
+        return False, "sin gateways para borrar"
+    tenant_id, gateway_id = ctx.gateways.pop()
+    r = await ctx.client.delete(f"/gateways/{gateway_id}", params={"tenant_id": tenant_id, "confirm": "true"},
+                                headers=AUTH)
+    return _ok(r)
+
+
+async def op_device_list(ctx: BenchContext, i: int):
+    r = await ctx.client.get(f"/devices/{ctx.tenant(i)}", headers=AUTH)
+    return _ok(r)
+
+
+async def op_telemetry_read(ctx: BenchContext, i: int):
+    eui = ctx.telemetry_euis[i % len(ctx.telemetry_euis)]
+    r = await ctx.client.get(f"/devices/{eui}/data", params={"limit": 100, "order": "desc"}, headers=AUTH)
+    return _ok(r)
+
+
+async def op_alert_list(ctx: BenchContext, i: int):
+    r = await ctx.client.get(f"/alerts/{ctx.tenant(i)}", headers=AUTH)
+    return _ok(r)
+
+
+OPS = {name: globals()[f"op_{name}"] for name in SCENARIOS}
+
+
+# ────────────────────────────────────────────────
+# 🌱 Datos iniciales (no se miden)
+# ────────────────────────────────────────────────
+async def _setup(ctx: BenchContext):
+    from bson import ObjectId
+    from db import tenants_collection, alerts_collection, mqtt_data_collection, devices_collection
+    from crud import upsert_device_profile_from_template_name
+    from telemetry import to_document
+
+    args = ctx.args
+    r = await ctx.client.post("/usuarios", json={"full_name": "Bench"}, headers=AUTH)
+    if r.status_code != 200:
+        raise SystemExit(f"setup /usuarios: {r.status_code} {r.text}")
+
+    for n in range(args.tenants):
+        r = await ctx.client.post("/tenants", json={"name": f"bench-base-{n}"}, headers=AUTH)
+        if r.status_code != 200:
+            raise SystemExit(f"setup /tenants: {r.status_code} {r.text}")
+        ctx.tenants.append(r.json()["tenant_id"])
+
+    # sin límite de plan y con el profile "gateway" (type de DeviceModel) en cada tenant
+    await tenants_collection.update_many(
+        {"_id": {"$in": [ObjectId(t) for t in ctx.tenants]}}, {"$set": {"max_devices": 10**9}}
+    )
+    for t in ctx.tenants:
+        res = await upsert_device_profile_from_template_name(
+            tenant_id=t, model="BENCH-GATEWAY", template_name=args.template, profile_name="gateway",
+        )
+        if not res.get("ok"):
+            raise SystemExit(f"setup device profile: {res}")
+
+    # dispositivos con telemetría, telemetría y alertas sembrados directo en Mongo
+    # (/devices/{eui}/data exige que el device esté registrado en un tenant del usuario)
+    now = datetime.now(timezone.utc)
+    docs, devices = [], []
+    for n in range(args.telemetry_devices):
+        eui = _eui(_TELEMETRY_EUI, n)
+        ctx.telemetry_euis.append(eui)
+        tenant_id = ctx.tenant(n)
+        devices.append({"tenant_id": tenant_id, "dev_eui": eui, "name": f"bench-telemetry-{n}",
+                        "type": "sensor", "status": "active", "created_at": now})
+        for k in range(args.telemetry_points):
+            docs.append(to_document({
+                "device_eui": eui, "timestamp": now - timedelta(minutes=k),
+                "temperature": 20 + (k % 10) * 0.5, "battery": 3.6, "rssi": -70 - k % 30,
+            }, tenant_id=tenant_id))
+    if devices:
+        await devices_collection.insert_many(devices)
+    for i in range(0, len(docs), 5000):
+        await mqtt_data_collection.insert_many(docs[i:i + 5000], ordered=False)
+
+    alerts = [{
+        "device_id": _eui(_TELEMETRY_EUI, n % max(1, args.telemetry_devices)), "tenant_id": t,
+        "timestamp": now - timedelta(minutes=n), "status": "open" if n % 3 else "closed",
+        "location": {"lat": 4.65, "lng": -74.1}, "message": f"bench alert {n}", "assigned_to": BENCH_CLAIMS["uid"],
+    } for t in ctx.tenants for n in range(args.alerts_per_tenant)]
+    if alerts:
+        await alerts_collection.insert_many(alerts)
+
+
+async def _ensure_gateways(ctx: BenchContext, needed: int):
+    """gateway_delete sin gateway_create previo: crea (sin medir) los que falten."""
+    while len(ctx.gateways) < needed:
+        ok = await op_gateway_create(ctx, len(ctx.gateways))
+        if ok is not True:
+            raise SystemExit(f"setup gateways: {ok}")
+
+
+# ────────────────────────────────────────────────
+# 🚀 Ejecución
+# ────────────────────────────────────────────────
+async def _run(args, scenarios: list[str]) -> dict:
+    import httpx
+    import iotaas
+
+    results = {}
+    async with iotaas.app.router.lifespan_context(iotaas.app):
+        transport = httpx.ASGITransport(app=iotaas.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            ctx = BenchContext(client, args)
+            t0 = time.perf_counter()
+            await _setup(ctx)
+            print(f"🌱 Setup: {len(ctx.tenants)} tenants, {len(ctx.telemetry_euis)} devices con telemetría "
+                  f"({time.perf_counter() - t0:.1f}s)")
+
+            for name in scenarios:
+                op = OPS[name]
+                if name == "gateway_delete":
+                    await _ensure_gateways(ctx, args.warmup + args.requests)
+                if args.warmup:
+                    await run_load(lambda i: op(ctx, i), args.warmup, args.concurrency)
+                summary, samples = await run_load(lambda i: op(ctx, i), args.requests, args.concurrency)
+                results[name] = summary
+                print(f"  {name:<16} p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms "
+                      f"p99={summary['p99_ms']:.1f}ms {summary['rps']:.1f} req/s errores={summary['errors']}")
+                for s in samples:
+                    print(f"    ⚠️  {s}")
+    return results
+
+
+def _config(args, scenarios) -> dict:
+    return {
+        "mongo": "local" if args.mongo_uri else "mongomock",
+        "concurrency": args.concurrency, "requests": args.requests,
+        "tenants": args.tenants, "telemetry_points": args.telemetry_points,
+        "cs_latency_ms": args.cs_latency_ms, "cs_jitter_ms": args.cs_jitter_ms,
+        "cs_error_rate": args.cs_error_rate,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(prog="bench.api_bench", description="Benchmark end-to-end del API en proceso")
+    p.add_argument("--scenarios", default=",".join(SCENARIOS), help="lista separada por comas")
+    p.add_argument("--requests", type=int, default=200, help="peticiones medidas por escenario")
+    p.add_argument("--warmup", type=int, default=10)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--tenants", type=int, default=4)
+    p.add_argument("--telemetry-devices", type=int, default=20)
+    p.add_argument("--telemetry-points", type=int, default=200, help="docs por device en mqtt_data")
+    p.add_argument("--alerts-per-tenant", type=int, default=100)
+    p.add_argument("--template", default="LBM01", help="template del fake para el profile 'gateway'")
+    p.add_argument("--mongo-uri", default="", help="Mongo local en vez de mongomock-motor")
+    p.add_argument("--allow-remote-mongo", action="store_true")
+    p.add_argument("--cs-latency-ms", type=float, default=2.0)
+    p.add_argument("--cs-jitter-ms", type=float, default=2.0)
+    p.add_argument("--cs-error-rate", type=float, default=0.0)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--baseline", default=DEFAULT_BASELINE)
+    p.add_argument("--update-baseline", action="store_true")
+    p.add_argument("--tolerance", type=float, default=0.5, help="holgura relativa vs baseline (0.5 = ±50%%)")
+    p.add_argument("--min-delta-ms", type=float, default=5.0, help="holgura absoluta mínima en p95/p99")
+    p.add_argument("--max-error-rate", type=float, default=0.01)
+    p.add_argument("--json", default="", help="escribe los resultados en este archivo")
+    args = p.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in OPS]
+    if unknown:
+        p.error(f"escenarios desconocidos: {', '.join(unknown)} (válidos: {', '.join(SCENARIOS)})")
+
+    # entorno antes de importar iotaas (db.py, auth.py y chirpstack_grpc leen ENV al importarse)
+    if args.mongo_uri:
+        use_local_mongo(args.mongo_uri, args.allow_remote_mongo)
+    else:
+        use_mongomock()
+    offline_firebase_credentials()
+    os.environ["JOBS_WORKER_ENABLED"] = "0"
+    os.environ["INDEX_BOOTSTRAP"] = "sync"
+    os.environ.setdefault("CHIRPSTACK_API_KEY", "bench")
+
+    from fake_chirpstack import FakeChirpstackServer, FaultConfig
+    faults = FaultConfig(latency_ms=args.cs_latency_ms, jitter_ms=args.cs_jitter_ms, error_rate=args.cs_error_rate)
+    with FakeChirpstackServer(faults, seed=args.seed, templates=[args.template]) as cs:
+        os.environ["CHIRPSTACK_GRPC_ADDRESS"] = cs.address
+        seed_token(BENCH_TOKEN, BENCH_CLAIMS)
+        print(f"🏁 API bench: {', '.join(scenarios)} | {args.requests} req × {args.concurrency} en vuelo | "
+              f"ChirpStack falso en {cs.address}")
+        results = asyncio.run(_run(args, scenarios))
+
+    print()
+    print_table(results)
+    config = _config(args, scenarios)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": config, "results": results, "chirpstack": cs.final_stats}, f, indent=2)
+
+    if args.update_baseline:
+        base = load_baseline(args.baseline) or {"results": {}}
+        merged = {**base.get("results", {}), **results}
+        save_baseline(args.baseline, config, merged)
+        print(f"💾 Baseline actualizado: {args.baseline}")
+        return
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"ℹ️  Sin baseline en {args.baseline} (usa --update-baseline)")
+        sys.exit(1 if compare(results, None, args.tolerance, args.max_error_rate, args.min_delta_ms) else 0)
+    for m in config_mismatch(config, baseline):
+        print(f"⚠️  Config distinta al baseline: {m}")
+    problems = compare(results, baseline, args.tolerance, args.max_error_rate, args.min_delta_ms)
+    if problems:
+        print("🔴 Regresiones:")
+        for m in problems:
+            print(f"   - {m}")
+        sys.exit(1)
+    print("🟢 Dentro del baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# bench/common.py
+# Utilidades compartidas por los benchmarks (bench/*.py): entorno offline,
+# medición de latencia, percentiles y comparación contra baselines guardados.
+#
+# Baseline (JSON):
+#   {"config": {...}, "results": {"<escenario>": {"p50_ms", "p95_ms", "p99_ms", "rps", ...}}}
+# Se considera regresión si, para un escenario:
+#   p95/p99 > max(baseline × (1 + tolerance), baseline + min_delta_ms)
+#   o rps < baseline × (1 - tolerance)   o   error_rate > max_error_rate
+# (min_delta_ms evita falsos positivos en rutas de pocos ms, donde p99 es ruido)
+import asyncio, json, os, time
+
+
+# ────────────────────────────────────────────────
+# 🧪 Entorno offline (antes de importar db/auth/iotaas)
+# ────────────────────────────────────────────────
+def use_mongomock():
+    """Motor → mongomock-motor en memoria (solo para benchmarks; db.py no se toca)."""
+    try:
+        import mongomock_motor
+    except ImportError:
+        raise SystemExit("mongomock-motor no instalado: pip install mongomock-motor (o usa --mongo-uri)")
+    import motor.motor_asyncio
+    motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+
+
+def use_local_mongo(uri: str, allow_remote: bool = False):
+    """db.py usa la base PLATAFORMA_IOT: solo se permite un Mongo local salvo allow_remote."""
+    if not allow_remote and not any(h in uri for h in ("localhost", "127.0.0.1", "[::1]")):
+        raise SystemExit(f"--mongo-uri {uri!r} no es local; usa --allow-remote-mongo si es intencional")
+    os.environ["MONGODB_URI"] = uri
+
+
+def offline_firebase_credentials():
+    """
+    auth.py exige GOOGLE_APPLICATION_CREDENTIALS_JSON al importarse. Si no hay, se
+    genera una cuenta de servicio descartable: los tokens del benchmark se siembran
+    en auth.token_cache, así que nunca se verifica nada contra Google.
+    """
+    if os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON"):
+        return
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption()).decode()
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS_JSON"] = json.dumps({
+        "type": "service_account", "project_id": "bench", "private_key_id": "bench",
+        "private_key": pem, "client_email": "bench@bench.iam.gserviceaccount.com",
+        "client_id": "0", "token_uri": "https://oauth2.googleapis.com/token",
+    })
+
+
+def seed_token(token: str, claims: dict, ttl_s: float = 86400):
+    """Registra un ID token ya 'verificado' en la caché de auth.py."""
+    from auth import token_cache, TokenCache
+    token_cache.ttl = max(token_cache.ttl, ttl_s)
+    token_cache.put(TokenCache.key(token), {**claims, "exp": time.time() + ttl_s})
+
+
+# ────────────────────────────────────────────────
+# ⏱️ Medición
+# ────────────────────────────────────────────────
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies_ms: list[float], errors: int, wall_s: float) -> dict:
+    lat = sorted(latencies_ms)
+    n = len(lat)
+    return {
+        "requests": n,
+        "errors": errors,
+        "error_rate": round(errors / n, 4) if n else 0.0,
+        "p50_ms": round(percentile(lat, 50), 3),
+        "p95_ms": round(percentile(lat, 95), 3),
+        "p99_ms": round(percentile(lat, 99), 3),
+        "max_ms": round(lat[-1], 3) if lat else 0.0,
+        "rps": round(n / wall_s, 2) if wall_s > 0 else 0.0,
+    }
+
+
+async def run_load(op, total: int, concurrency: int) -> tuple[dict, list[str]]:
+    """
+    Ejecuta op(i) para i in range(total) con `concurrency` workers.
+    op devuelve True/False (ok) o lanza. Devuelve (summary, primeros errores).
+    """
+    latencies: list[float] = []
+    errors = 0
+    samples: list[str] = []
+    next_i = 0
+
+    async def _worker():
+        nonlocal next_i, errors
+        while next_i < total:
+            i = next_i
+            next_i += 1
+            t0 = time.perf_counter()
+            try:
+                ok, detail = await op(i), None
+                if isinstance(ok, tuple):
+                    ok, detail = ok
+            except Exception as e:
+                ok, detail = False, f"{type(e).__name__}: {e}"
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if not ok:
+                errors += 1
+                if detail and len(samples) < 5:
+                    samples.append(str(detail)[:300])
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(max(1, min(concurrency, total)))))
+    return summarize(latencies, errors, time.perf_counter() - t0), samples
+
+
+# ────────────────────────────────────────────────
+# 📏 Baselines
+# ────────────────────────────────────────────────
+def load_baseline(path: str) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path: str, config: dict, results: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    keep = ("p50_ms", "p95_ms", "p99_ms", "rps", "error_rate")
+    with open(path, "w") as f:
+        json.dump({"config": config, "results": {
+            name: {k: r[k] for k in keep} for name, r in results.items()
+        }}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results: dict, baseline: dict, tolerance: float, max_error_rate: float,
+            min_delta_ms: float = 0.0) -> list[str]:
+    """Lista de regresiones (vacía = OK)."""
+    problems = []
+    base_results = (baseline or {}).get("results", {})
+    for name, r in results.items():
+        if r["error_rate"] > max_error_rate:
+            problems.append(f"{name}: error_rate {r['error_rate']:.2%} > {max_error_rate:.2%}")
+        b = base_results.get(name)
+        if not b:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            limit = max(b[key] * (1 + tolerance), b[key] + min_delta_ms)
+            if b[key] and r[key] > limit:
+                problems.append(f"{name}: {key} {r[key]:.1f} > {limit:.1f} (baseline {b[key]:.1f})")
+        floor = b["rps"] * (1 - tolerance)
+        if b["rps"] and r["rps"] < floor:
+            problems.append(f"{name}: rps {r['rps']:.1f} < {floor:.1f} (baseline {b['rps']:.1f})")
+    return problems
+
+
+def config_mismatch(config: dict, baseline: dict | None) -> list[str]:
+    base = (baseline or {}).get("config", {})
+    return [f"{k}: baseline={base[k]!r} actual={config.get(k)!r}"
+            for k in sorted(base) if base[k] != config.get(k)]
+
+
+def print_table(results: dict):
+    cols = ("requests", "errors", "p50_ms", "p95_ms", "p99_ms", "max_ms", "rps")
+    print(f"{'escenario':<18}" + "".join(f"{c:>10}" for c in cols))
+    for name, r in results.items():
+        print(f"{name:<18}" + "".join(f"{r[c]:>10}" for c in cols))
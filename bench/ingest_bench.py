@@ -0,0 +1,281 @@
+# bench/ingest_bench.py
+# Benchmark de la ingesta MQTT (mismo camino que mqtt_client.mqtt_handler):
+#
+#   bench.uplink_gen ──MQTT──▶ broker ──▶ IngestPipeline ──▶ BatchWriter ──▶ mqtt_data
+#    (proceso hijo)                        (este proceso: registry + rollups reales)
+#
+# Transportes (--transport):
+#   mqtt    el generador corre como proceso aparte y publica en --mqtt-host/--mqtt-port
+#           (p.ej. mosquitto local); la CPU medida es solo la de la ingesta.
+#   memory  sin broker: el generador alimenta pipeline.receive() en este mismo proceso.
+#           Mide pipeline + Mongo; la CPU incluye la generación de los uplinks.
+#
+# Métricas:
+#   latencia publish → visible: bench.sent_at del uplink vs. el momento en que su
+#     insert_many confirmó (hook after_flush del BatchWriter) → p50/p95/p99/max
+#   drop rate: uplinks de dispositivos registrados que no llegaron a mqtt_data
+#     (los --unknown-rate se descartan a propósito y se reportan aparte)
+#   CPU por mensaje: time.process_time() de este proceso / uplinks guardados
+#
+# Los dispositivos (bench.uplink_gen.device_eui) se siembran en devices antes de
+# arrancar el registry; con --mongo-uri los datos del run se borran al terminar
+# (salvo --keep-data).
+#
+# Uso:
+#   python -m bench.ingest_bench --transport memory --count 20000 --rate 0
+#   python -m bench.ingest_bench --mqtt-port 1883 --tenants 10 --devices 100 --rate 1000 --duration 30
+# Sale con código 1 si drop_rate > --max-drop-rate.
+import argparse, asyncio, json, os, sys, time
+from collections import namedtuple
+
+from bench.common import use_mongomock, use_local_mongo, percentile
+from bench.uplink_gen import UplinkFactory, fleet, paced
+
+UPLINK_TOPIC = "application/+/device/+/event/up"
+
+_Message = namedtuple("_Message", "topic payload")
+
+
+class _MemoryFeed:
+    """Iterador async con la forma de aiomqtt client.messages (.topic/.payload)."""
+
+    def __init__(self):
+        self._q: asyncio.Queue = asyncio.Queue()
+        self._done = object()
+
+    def put(self, topic: str, payload: bytes):
+        self._q.put_nowait(_Message(topic, payload))
+
+    def close(self):
+        self._q.put_nowait(self._done)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._q.get()
+        if item is self._done:
+            raise StopAsyncIteration
+        return item
+
+
+class VisibilityProbe:
+    """Hook after_flush: latencia publish → insert confirmado de los uplinks de este run."""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.latencies_ms: list[float] = []
+        self.last_flush = time.monotonic()
+
+    async def __call__(self, docs: list[dict]):
+        now = time.time()
+        for doc in docs:
+            b = doc.get("bench")
+            if b and b.get("run") == self.run_id:
+                self.latencies_ms.append((now - b["sent_at"]) * 1000)
+        self.last_flush = time.monotonic()
+
+    @property
+    def stored(self) -> int:
+        return len(self.latencies_ms)
+
+
+# ────────────────────────────────────────────────
+# 🌱 Datos iniciales
+# ────────────────────────────────────────────────
+async def _seed_devices(devices_collection, args) -> list[str]:
+    from bson import ObjectId
+
+    tenant_ids = [str(ObjectId()) for _ in range(args.tenants)]
+    docs = [{
+        "tenant_id": tenant_ids[t], "dev_eui": eui, "name": f"bench-{t}-{d}", "type": "sensor",
+        "location": "bench", "created_at": time.time(),
+    } for t, d, eui in fleet(args.tenants, args.devices)]
+    await devices_collection.delete_many({"dev_eui": {"$in": [d["dev_eui"] for d in docs]}})
+    for i in range(0, len(docs), 5000):
+        await devices_collection.insert_many(docs[i:i + 5000], ordered=False)
+    return [d["dev_eui"] for d in docs]
+
+
+async def _cleanup(devices_collection, mqtt_data_collection, euis: list[str]):
+    from pymongo.errors import PyMongoError
+    from telemetry import META_FIELD
+    try:
+        await devices_collection.delete_many({"dev_eui": {"$in": euis}})
+        # time-series: los deletes solo pueden filtrar por metaField
+        await mqtt_data_collection.delete_many({f"{META_FIELD}.device_eui": {"$in": euis}})
+    except PyMongoError as e:
+        print(f"⚠️  Limpieza incompleta: {e}")
+
+
+# ────────────────────────────────────────────────
+# 🚀 Ejecución
+# ────────────────────────────────────────────────
+async def _generate_mqtt(args, run_id: str) -> dict:
+    """Lanza bench.uplink_gen como proceso aparte y devuelve su resumen (última línea JSON)."""
+    argv = [sys.executable, "-m", "bench.uplink_gen", "--host", args.mqtt_host, "--port", str(args.mqtt_port),
+            "--tenants", str(args.tenants), "--devices", str(args.devices), "--rate", str(args.rate),
+            "--duration", str(args.duration), "--count", str(args.count), "--qos", str(args.qos),
+            "--unknown-rate", str(args.unknown_rate), "--run-id", run_id, "--seed", str(args.seed)]
+    proc = await asyncio.create_subprocess_exec(
+        *argv, stdout=asyncio.subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    out, _ = await proc.communicate()
+    for line in reversed(out.decode().strip().splitlines()):
+        try:
+            return json.loads(line)
+        except ValueError:
+            continue
+    raise SystemExit(f"uplink_gen terminó con código {proc.returncode} sin resumen")
+
+
+async def _settle(probe: VisibilityProbe, pipeline, sent: int, idle_s: float):
+    """Espera a que lo publicado sea visible (o descartado) o a que no haya flushes durante idle_s."""
+    probe.last_flush = time.monotonic()
+
+    def _accounted():
+        st = pipeline.stages
+        return probe.stored + st["decode"].dropped + st["decode"].errors + st["enrich"].dropped + st["enrich"].errors
+
+    while _accounted() < sent and time.monotonic() - probe.last_flush < idle_s:
+        await asyncio.sleep(0.05)
+
+
+async def _run(args) -> dict:
+    from db import db, devices_collection, mqtt_data_collection
+    from device_registry import DeviceRegistry
+    from telemetry_writer import BatchWriter
+    from ingest_pipeline import IngestPipeline
+    from telemetry import ensure_telemetry_collection
+    from rollups import RollupMaterializer, ROLLUPS_ENABLED
+
+    await ensure_telemetry_collection(db)
+    euis = await _seed_devices(devices_collection, args)
+
+    factory = UplinkFactory(args.tenants, args.devices, seed=args.seed, unknown_rate=args.unknown_rate)
+    probe = VisibilityProbe(factory.run_id)
+    after_flush = [probe]
+    if ROLLUPS_ENABLED and not args.no_rollups and not args.mongo_uri:
+        # los bulk_write de rollups usan UpdateOne(sort=...), que mongomock no soporta
+        print("ℹ️  Rollups desactivados con mongomock-motor (usa --mongo-uri para incluirlos)")
+    elif ROLLUPS_ENABLED and not args.no_rollups:
+        rollups = RollupMaterializer(db)
+        await rollups.ensure_indexes()
+        after_flush.append(rollups.apply)
+
+    registry = DeviceRegistry(devices_collection)
+    await registry.start()
+    writer = BatchWriter(mqtt_data_collection, max_batch=args.batch_size, max_delay=args.batch_ms / 1000,
+                         after_flush=after_flush)
+    await writer.start()
+    pipeline = IngestPipeline(registry, writer)
+    pipeline.start()
+
+    print(f"🏁 Ingest bench {factory.run_id}: {args.transport}, {len(euis)} dispositivos, "
+          f"{args.rate or '∞'} msg/s, lote {args.batch_size}/{args.batch_ms}ms")
+    cpu0, wall0 = time.process_time(), time.monotonic()
+    try:
+        if args.transport == "memory":
+            feed = _MemoryFeed()
+            receiver = asyncio.create_task(pipeline.receive(feed))
+
+            async def _emit():
+                feed.put(*factory.next())
+                return True
+
+            gen = await paced(args.count, args.rate, args.duration, _emit)
+            feed.close()
+            await _settle(probe, pipeline, gen["sent"], args.settle_s)
+            await receiver
+        else:
+            from aiomqtt import Client
+            async with Client(args.mqtt_host, port=args.mqtt_port, identifier=f"ingest-bench-{factory.run_id}") as client:
+                await client.subscribe(UPLINK_TOPIC, qos=args.qos)
+                receiver = asyncio.create_task(pipeline.receive(client.messages))
+                gen = await _generate_mqtt(args, factory.run_id)
+                await _settle(probe, pipeline, gen["sent"], args.settle_s)
+                receiver.cancel()
+                await asyncio.gather(receiver, return_exceptions=True)
+        await pipeline.drain()
+        await writer.close()
+        cpu_s, wall_s = time.process_time() - cpu0, time.monotonic() - wall0
+    finally:
+        await registry.stop()
+
+    stats = pipeline.stats()
+    if args.mongo_uri and not args.keep_data:
+        await _cleanup(devices_collection, mqtt_data_collection, euis)
+    return _summary(args, gen, probe, stats, cpu_s, wall_s)
+
+
+def _summary(args, gen: dict, probe: VisibilityProbe, stats: dict, cpu_s: float, wall_s: float) -> dict:
+    lat = sorted(probe.latencies_ms)
+    unknown = stats["enrich"]["dropped"]
+    expected = max(0, gen["sent"] - unknown)
+    lost = max(0, expected - probe.stored)
+    return {
+        "transport": args.transport,
+        "sent": gen["sent"], "publish_errors": gen["errors"], "publish_rate": gen["rate"], "late": gen["late"],
+        "stored": probe.stored, "unknown_dropped": unknown,
+        "lost": lost, "drop_rate": round(lost / expected, 5) if expected else 0.0,
+        "p50_ms": round(percentile(lat, 50), 3), "p95_ms": round(percentile(lat, 95), 3),
+        "p99_ms": round(percentile(lat, 99), 3), "max_ms": round(lat[-1], 3) if lat else 0.0,
+        "ingest_rate": round(probe.stored / wall_s, 1) if wall_s > 0 else 0.0,
+        "cpu_s": round(cpu_s, 3),
+        "cpu_us_per_msg": round(cpu_s / probe.stored * 1e6, 1) if probe.stored else 0.0,
+        "cpu_util": round(cpu_s / wall_s, 3) if wall_s > 0 else 0.0,
+        "pipeline": stats,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(prog="bench.ingest_bench", description="Benchmark de la ingesta MQTT → mqtt_data")
+    p.add_argument("--transport", choices=("mqtt", "memory"), default="mqtt")
+    p.add_argument("--mqtt-host", default="127.0.0.1")
+    p.add_argument("--mqtt-port", type=int, default=1883)
+    p.add_argument("--qos", type=int, default=0, choices=(0, 1, 2))
+    p.add_argument("--tenants", type=int, default=4)
+    p.add_argument("--devices", type=int, default=50, help="dispositivos por tenant")
+    p.add_argument("--rate", type=float, default=500, help="uplinks/s en total (0 = sin límite)")
+    p.add_argument("--duration", type=float, default=0, help="segundos de carga (0 = hasta --count)")
+    p.add_argument("--count", type=int, default=5000, help="uplinks en total (0 = hasta --duration)")
+    p.add_argument("--unknown-rate", type=float, default=0.0, help="fracción de uplinks con dev_eui no registrado")
+    p.add_argument("--batch-size", type=int, default=int(os.getenv("MQTT_BATCH_SIZE", "500")))
+    p.add_argument("--batch-ms", type=int, default=int(os.getenv("MQTT_BATCH_MS", "200")))
+    p.add_argument("--no-rollups", action="store_true", help="sin RollupMaterializer tras cada lote")
+    p.add_argument("--settle-s", type=float, default=5.0, help="espera máxima sin flushes antes de cortar")
+    p.add_argument("--mongo-uri", default="", help="Mongo local en vez de mongomock-motor")
+    p.add_argument("--allow-remote-mongo", action="store_true")
+    p.add_argument("--keep-data", action="store_true", help="no borrar devices/mqtt_data del run")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--max-drop-rate", type=float, default=0.001)
+    p.add_argument("--json", default="", help="escribe el resultado en este archivo")
+    args = p.parse_args()
+    if not args.count and not args.duration:
+        p.error("indica --count o --duration")
+
+    # entorno antes de importar db.py
+    if args.mongo_uri:
+        use_local_mongo(args.mongo_uri, args.allow_remote_mongo)
+    else:
+        use_mongomock()
+    os.environ.setdefault("INGEST_STATS_INTERVAL_S", "0")
+
+    result = asyncio.run(_run(args))
+
+    print()
+    for key in ("sent", "stored", "unknown_dropped", "lost", "drop_rate", "p50_ms", "p95_ms", "p99_ms",
+                "max_ms", "publish_rate", "ingest_rate", "cpu_us_per_msg", "cpu_util"):
+        print(f"  {key:<16}{result[key]:>12}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "result": result}, f, indent=2)
+
+    if result["drop_rate"] > args.max_drop_rate:
+        print(f"🔴 drop_rate {result['drop_rate']:.3%} > {args.max_drop_rate:.3%}")
+        sys.exit(1)
+    print("🟢 Ingesta sin pérdidas por encima del umbral")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# bench/uplink_gen.py
+# Generador sintético de uplinks estilo ChirpStack v4 para cargar la ingesta MQTT.
+#
+# Publica en un broker (local) uplinks de N tenants × M dispositivos, en round-robin
+# y a una tasa objetivo (mensajes/s), en el topic de la integración MQTT de ChirpStack:
+#   application/<application_id>/device/<dev_eui>/event/up
+#
+# Payload: evento "up" de ChirpStack (deduplicationId, time, deviceInfo, devAddr,
+# fCnt, fPort, dr, data, rxInfo, txInfo) + los campos planos que espera
+# ingest_pipeline (device_eui, timestamp y las medidas decodificadas), más
+#   "bench": {"run": <run_id>, "seq": n, "sent_at": epoch}
+# para que el harness (bench/ingest_bench.py) mida publish → visible en mqtt_data.
+#
+# Los dev_eui son deterministas (device_eui(t, d)), así el harness puede sembrar
+# los mismos dispositivos en Mongo sin coordinarse con este proceso.
+#
+# Uso:
+#   python -m bench.uplink_gen --tenants 10 --devices 100 --rate 500 --duration 60
+#   python -m bench.uplink_gen --count 10000 --rate 0          # sin límite de tasa
+# Al terminar imprime una línea JSON con {sent, errors, late, wall_s, rate}.
+import argparse, asyncio, base64, json, random, struct, time, uuid
+from datetime import datetime, timezone
+
+# prefijo propio: no choca con los EUIs de bench/api_bench.py
+_EUI_PREFIX = 0x5E00000000000000
+_NS = uuid.UUID("6f1c3b9e-2d57-4c1a-9a0e-5b3f0c7d8e21")
+
+
+def device_eui(tenant_idx: int, dev_idx: int) -> str:
+    return f"{_EUI_PREFIX | (tenant_idx << 24) | dev_idx:016X}"
+
+
+def tenant_uuid(tenant_idx: int) -> str:
+    return str(uuid.uuid5(_NS, f"tenant-{tenant_idx}"))
+
+
+def application_uuid(tenant_idx: int) -> str:
+    return str(uuid.uuid5(_NS, f"application-{tenant_idx}"))
+
+
+def fleet(tenants: int, devices: int) -> list[tuple[int, int, str]]:
+    """[(tenant_idx, dev_idx, dev_eui)] en el orden en que se publican."""
+    return [(t, d, device_eui(t, d)) for d in range(devices) for t in range(tenants)]
+
+
+class UplinkFactory:
+    """Construye uplinks realistas: fCnt por dispositivo y medidas con random walk."""
+
+    def __init__(self, tenants: int, devices: int, run_id: str = "", seed: int | None = None,
+                 unknown_rate: float = 0.0):
+        self.fleet = fleet(tenants, devices)
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.unknown_rate = unknown_rate
+        self._rng = random.Random(seed)
+        self._fcnt = [0] * len(self.fleet)
+        self._state = [
+            {"temperature": self._rng.uniform(15, 30), "humidity": self._rng.uniform(30, 80),
+             "battery": self._rng.uniform(3.3, 3.7)}
+            for _ in self.fleet
+        ]
+        self._gateways = [f"{0xAA55000000000000 | t:016x}" for t in range(tenants)]
+        self.seq = 0
+
+    def next(self) -> tuple[str, bytes]:
+        i = self.seq % len(self.fleet)
+        t, d, eui = self.fleet[i]
+        if self.unknown_rate and self._rng.random() < self.unknown_rate:
+            # dev_eui no registrado: la ingesta debe descartarlo (enrich.dropped)
+            eui = f"{0xDEAD000000000000 | self.seq:016X}"
+        self.seq += 1
+
+        rng, st = self._rng, self._state[i]
+        st["temperature"] = min(45.0, max(-10.0, st["temperature"] + rng.gauss(0, 0.2)))
+        st["humidity"] = min(100.0, max(0.0, st["humidity"] + rng.gauss(0, 0.5)))
+        st["battery"] = max(2.9, st["battery"] - rng.random() * 0.0005)
+        self._fcnt[i] += 1
+        rssi = int(rng.gauss(-95, 12))
+        snr = round(rng.gauss(5, 4), 1)
+        temperature = round(st["temperature"], 2)
+        humidity = round(st["humidity"], 1)
+        battery = round(st["battery"], 3)
+
+        now = time.time()
+        iso = datetime.fromtimestamp(now, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+        raw = struct.pack(">hBH", int(temperature * 100), int(humidity), int(battery * 1000))
+        app_id = application_uuid(t)
+        payload = {
+            "deduplicationId": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "time": iso,
+            "deviceInfo": {
+                "tenantId": tenant_uuid(t), "tenantName": f"bench-tenant-{t}",
+                "applicationId": app_id, "applicationName": f"bench-app-{t}",
+                "deviceProfileName": "bench-sensor", "deviceName": f"bench-{t}-{d}",
+                "devEui": eui.lower(),
+            },
+            "devAddr": f"{(t << 16 | d) & 0xFFFFFFFF:08x}",
+            "adr": True, "dr": 5, "fCnt": self._fcnt[i], "fPort": 2, "confirmed": False,
+            "data": base64.b64encode(raw).decode(),
+            "rxInfo": [{
+                "gatewayId": self._gateways[t], "uplinkId": rng.getrandbits(31),
+                "rssi": rssi, "snr": snr, "context": "AAAAAA==",
+            }],
+            "txInfo": {"frequency": 868100000 + 200000 * (d % 3),
+                       "modulation": {"lora": {"bandwidth": 125000, "spreadingFactor": 7, "codeRate": "CR_4_5"}}},
+            # lo que ingest_pipeline/telemetry leen (payload decodificado, JSON plano)
+            "device_eui": eui,
+            "timestamp": iso,
+            "temperature": temperature, "humidity": humidity, "battery": battery,
+            "rssi": rssi, "snr": snr,
+            "bench": {"run": self.run_id, "seq": self.seq - 1, "sent_at": now},
+        }
+        return f"application/{app_id}/device/{eui.lower()}/event/up", json.dumps(payload).encode()
+
+
+async def paced(total: int, rate: float, duration: float, emit) -> dict:
+    """
+    Llama a `await emit()` hasta `total` veces (0 = sin límite) o hasta `duration` s,
+    a `rate` mensajes/s (0 = lo más rápido posible). Horario absoluto: si se atrasa,
+    publica sin dormir para recuperar y cuenta el mensaje como "late".
+    emit() devuelve False si el envío falló.
+    """
+    sent = errors = late = 0
+    interval = 1 / rate if rate > 0 else 0.0
+    t0 = time.monotonic()
+    deadline = t0 + duration if duration > 0 else float("inf")
+    n = 0
+    while (not total or n < total) and time.monotonic() < deadline:
+        if interval:
+            delay = t0 + n * interval - time.monotonic()
+            if delay > 0.001:
+                await asyncio.sleep(delay)
+            elif delay < -interval:
+                late += 1
+        n += 1
+        if await emit():
+            sent += 1
+        else:
+            errors += 1
+        if not interval and n % 1000 == 0:
+            await asyncio.sleep(0)  # ceder el loop a los consumidores en proceso
+    wall = time.monotonic() - t0
+    return {"sent": sent, "errors": errors, "late": late, "wall_s": round(wall, 3),
+            "rate": round(sent / wall, 1) if wall > 0 else 0.0}
+
+
+async def publish_mqtt(factory: UplinkFactory, host: str, port: int, total: int, rate: float,
+                       duration: float, qos: int = 0) -> dict:
+    from aiomqtt import Client, MqttError
+
+    async with Client(host, port=port, identifier=f"uplink-gen-{factory.run_id}",
+                      max_queued_outgoing_messages=100000) as client:
+        async def _emit():
+            topic, payload = factory.next()
+            try:
+                await client.publish(topic, payload, qos=qos)
+                return True
+            except MqttError:
+                return False
+
+        return await paced(total, rate, duration, _emit)
+
+
+def main():
+    p = argparse.ArgumentParser(prog="bench.uplink_gen", description="Generador de uplinks ChirpStack sintéticos (MQTT)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=1883)
+    p.add_argument("--tenants", type=int, default=4)
+    p.add_argument("--devices", type=int, default=50, help="dispositivos por tenant")
+    p.add_argument("--rate", type=float, default=200, help="mensajes/s en total (0 = sin límite)")
+    p.add_argument("--duration", type=float, default=0, help="segundos (0 = hasta --count)")
+    p.add_argument("--count", type=int, default=0, help="mensajes en total (0 = hasta --duration)")
+    p.add_argument("--qos", type=int, default=0, choices=(0, 1, 2))
+    p.add_argument("--unknown-rate", type=float, default=0.0, help="fracción de uplinks con dev_eui no registrado")
+    p.add_argument("--run-id", default="")
+    p.add_argument("--seed", type=int, default=None)
+    args = p.parse_args()
+    if not args.count and not args.duration:
+        p.error("indica --count o --duration")
+
+    factory = UplinkFactory(args.tenants, args.devices, args.run_id, args.seed, args.unknown_rate)
+    print(f"📤 uplink_gen {factory.run_id}: {args.tenants}×{args.devices} dispositivos → "
+          f"{args.host}:{args.port} a {args.rate or '∞'} msg/s", flush=True)
+    result = asyncio.run(publish_mqtt(factory, args.host, args.port, args.count, args.rate, args.duration, args.qos))
+    print(json.dumps({"run": factory.run_id, **result}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 import os
 import grpc
 import re
-from grpc_auth_interceptor import ApiKeyAuthInterceptor
+from grpc_auth_interceptor import ApiKeyAuthInterceptor, AsyncApiKeyAuthInterceptor
+from metrics import rpc_interceptors, aio_rpc_interceptors
+from tracing import rpc_trace_interceptors, aio_rpc_trace_interceptors, trace_methods
+from profile_index import profile_index
 from chirpstack_proto.api.device import device_pb2, device_pb2_grpc
 from chirpstack_proto.api.device_profile import device_profile_pb2, device_profile_pb2_grpc
 from chirpstack_proto.api.tenant import tenant_pb2, tenant_pb2_grpc
@@ -29,9 +32,12 @@ auth_interceptor = ApiKeyAuthInterceptor(CHIRPSTACK_API_KEY)
 # Crear canal seguro si usas TLS (aquí va con canal inseguro para simplificar)
 channel = grpc.intercept_channel(
     grpc.insecure_channel(CHIRPSTACK_GRPC_ADDRESS),
-    auth_interceptor
+    auth_interceptor,
+    *rpc_interceptors(),  # latencia/errores por método → /metrics
+    *rpc_trace_interceptors(),  # span por RPC + traceparent en la metadata
 )
 
+@trace_methods("ChirpstackGRPCClient")
 class ChirpstackGRPCClient:
     def __init__(self):
         self.channel = channel
@@ -63,13 +69,15 @@ class ChirpstackGRPCClient:
         return self.device_stub.Delete(request)
     
     def get_device_profile_id_by_name(self, profile_name: str, tenant_id: str) -> str:
-        request = device_profile_pb2.ListDeviceProfilesRequest(limit=50, tenant_id=tenant_id)
-        response = self.device_profile_stub.List(request)
-        
-        for profile in response.result:
-            if profile.name == profile_name:
-                return profile.id
-        
+        # Índice en memoria (List paginado solo si el tenant caducó o el nombre no está)
+        def list_page(limit, offset):
+            return self.device_profile_stub.List(device_profile_pb2.ListDeviceProfilesRequest(
+                tenant_id=tenant_id, limit=limit, offset=offset))
+
+        profile_id = profile_index.resolve(tenant_id, profile_name, list_page)
+        if profile_id:
+            return profile_id
+
         raise ValueError(f"Perfil de dispositivo '{profile_name}' no encontrado para tenant {tenant_id}")
     
     # --- TENANT ---
@@ -143,4 +151,116 @@ class ChirpstackGRPCClient:
             )
         )
         cresp = app_stub.Create(creq)
-        return getattr(cresp, "id", "") or getattr(cresp, "application_id", "")
\ No newline at end of file
+        return getattr(cresp, "id", "") or getattr(cresp, "application_id", "")
+
+
+# ────────────────────────────────────────────────
+# ⚡ Cliente async (grpc.aio) para código que corre en el event loop
+# ────────────────────────────────────────────────
+# Un solo canal aio por proceso; se crea perezosamente porque queda ligado
+# al event loop activo (el de uvicorn).
+_aio_channel = None
+
+def get_aio_channel():
+    global _aio_channel
+    if _aio_channel is None:
+        _aio_channel = grpc.aio.insecure_channel(
+            CHIRPSTACK_GRPC_ADDRESS,
+            interceptors=[AsyncApiKeyAuthInterceptor(CHIRPSTACK_API_KEY), *aio_rpc_interceptors(),
+                          *aio_rpc_trace_interceptors()],
+        )
+    return _aio_channel
+
+async def close_aio_channel():
+    global _aio_channel
+    if _aio_channel is not None:
+        await _aio_channel.close()
+        _aio_channel = None
+
+@trace_methods("AsyncChirpstackGRPCClient")
+class AsyncChirpstackGRPCClient:
+    """Mismos métodos que ChirpstackGRPCClient, pero awaitables (no bloquean el loop)."""
+
+    def __init__(self):
+        self.channel = get_aio_channel()
+
+        self.device_stub = device_pb2_grpc.DeviceServiceStub(self.channel)
+        self.device_profile_stub = device_profile_pb2_grpc.DeviceProfileServiceStub(self.channel)
+        self.tenant_stub = tenant_pb2_grpc.TenantServiceStub(self.channel)
+        self.application_stub = app_pb2_grpc.ApplicationServiceStub(self.channel)
+
+    # --- DEVICE ---
+    async def get_device(self, dev_eui: str):
+        request = device_pb2.GetDeviceRequest(dev_eui=dev_eui)
+        return await self.device_stub.Get(request)
+
+    async def create_device(self, dev_eui, name, description, application_id, device_profile_id):
+        request = device_pb2.CreateDeviceRequest(
+            device=device_pb2.Device(
+                dev_eui=dev_eui,
+                name=name,
+                description=description,
+                application_id=application_id,
+                device_profile_id=device_profile_id,
+            )
+        )
+        return await self.device_stub.Create(request)
+
+    async def delete_device(self, dev_eui: str):
+        request = device_pb2.DeleteDeviceRequest(dev_eui=dev_eui)
+        return await self.device_stub.Delete(request)
+
+    async def get_device_profile_id_by_name(self, profile_name: str, tenant_id: str) -> str:
+        async def list_page(limit, offset):
+            return await self.device_profile_stub.List(device_profile_pb2.ListDeviceProfilesRequest(
+                tenant_id=tenant_id, limit=limit, offset=offset))
+
+        profile_id = await profile_index.resolve_async(tenant_id, profile_name, list_page)
+        if profile_id:
+            return profile_id
+
+        raise ValueError(f"Perfil de dispositivo '{profile_name}' no encontrado para tenant {tenant_id}")
+
+    # --- TENANT ---
+    async def get_tenant(self, tenant_id: str):
+        req = tenant_pb2.GetTenantRequest(id=tenant_id)
+        return await self.tenant_stub.Get(req)
+
+    async def list_tenants(self, limit: int = 50, offset: int = 0, search: str = ""):
+        req = tenant_pb2.ListTenantsRequest(limit=limit, offset=offset, search=search)
+        return await self.tenant_stub.List(req)
+
+    async def create_tenant(self, name: str, description: str = "", can_have_gateways: bool = True):
+        req = tenant_pb2.CreateTenantRequest(
+            tenant=tenant_pb2.Tenant(
+               name=name,
+               description=description,
+               can_have_gateways=can_have_gateways,
+            )
+        )
+        return await self.tenant_stub.Create(req)
+
+    async def delete_tenant(self, tenant_id: str):
+        req = tenant_pb2.DeleteTenantRequest(id=tenant_id)
+        return await self.tenant_stub.Delete(req)
+
+    async def list_device_profiles(self, tenant_id: str, limit: int = 100, offset: int = 0):
+        req = device_profile_pb2.ListDeviceProfilesRequest(tenant_id=tenant_id, limit=limit, offset=offset)
+        return await self.device_profile_stub.List(req)
+
+    async def ensure_application_same_as_tenant(self, tenant_id: str, tenant_name: str) -> str:
+        """Idempotente: devuelve el application_id existente o lo crea con el nombre del tenant."""
+        resp = await self.application_stub.List(app_pb2.ListApplicationsRequest(limit=200, tenant_id=tenant_id))
+        for a in resp.result:
+            if a.name == tenant_name:
+                return a.id
+
+        creq = app_pb2.CreateApplicationRequest(
+            application=app_pb2.Application(
+                name=tenant_name,
+                description=f"App {tenant_name}",
+                tenant_id=tenant_id,
+            )
+        )
+        cresp = await self.application_stub.Create(creq)
+        return getattr(cresp, "id", "") or getattr(cresp, "application_id", "")
@@ -1,15 +1,20 @@
 # 🔄 AVISO: Este archivo usa gRPC como vía principal para ChirpStack.
 # Métodos REST solo se usan para funciones aún no migradas a gRPC (ej. AppKey, profiles).
 
-import asyncio, sys, json, re
+import asyncio, os, sys, json, re
 from datetime import datetime, timezone
 from bson import ObjectId
 from db import tenants_collection, users_collection, devices_collection, devicekeys_collection, device_profiles_collection, dp_templates_cache_collection
 from models import TenantModel, UserModel, DeviceModel, AlertModel, LogModel
 from grpc import RpcError
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, PyMongoError
 
 # from chirpstack_gprc import client.get_device_profile_id_by_name
-from chirpstack_grpc import ChirpstackGRPCClient, compose_tenant_name
+from chirpstack_grpc import AsyncChirpstackGRPCClient, compose_tenant_name
+from sidecar_runner import run_sidecar, DP_SIDECAR, DEV_SIDECAR, GW_SIDECAR
+from tenant_access import invalidate_tenant
+from profile_index import profile_index
 
 # ────────────────────────────────────────────────
 # 🧱 BLOQUE: TENANTS
@@ -29,11 +34,11 @@ async def create_tenant(data: TenantModel, owner_uid: str):
 
     # 2) Intentar en ChirpStack (gRPC)
     try:
-        cs = ChirpstackGRPCClient()
+        cs = AsyncChirpstackGRPCClient()
         user_doc = await users_collection.find_one({"uid": owner_uid})
         user_email = (user_doc.get("email") if user_doc else "") or owner_uid
         composed_name = compose_tenant_name(user_email, tenant.get("name", ""))
-        cs_resp = cs.create_tenant(
+        cs_resp = await cs.create_tenant(
             name=composed_name,
             description=tenant.get("description", ""),
             can_have_gateways=tenant.get("can_have_gateways", True),
@@ -41,7 +46,7 @@ async def create_tenant(data: TenantModel, owner_uid: str):
         chirp_tenant_id = cs_resp.id
 
         # NUEVO: asegurar/crear la Application con el mismo nombre del tenant
-        chirp_app_id = cs.ensure_application_same_as_tenant(chirp_tenant_id, composed_name)
+        chirp_app_id = await cs.ensure_application_same_as_tenant(chirp_tenant_id, composed_name)
 
         # 3) Si gRPC OK, persistimos el id de ChirpStack en Mongo
         await tenants_collection.update_one(
@@ -52,6 +57,7 @@ async def create_tenant(data: TenantModel, owner_uid: str):
                 "chirpstack_app_id": chirp_app_id,
             }},
         )
+        invalidate_tenant(inserted_id)
 
         return str(inserted_id)
 
@@ -67,60 +73,108 @@ async def create_tenant(data: TenantModel, owner_uid: str):
         await tenants_collection.delete_one({"_id": inserted_id})
         raise ValueError(f"Error al crear tenant: {str(e)}")
 
-async def delete_tenant_by_id(tenant_id: str, purge_devices: bool = True):
+# ────────────────────────────────────────────────
+# 🧹 BLOQUE: TENANTS – borrado en segundo plano (job tenant_teardown, ver jobs.py)
+# ────────────────────────────────────────────────
+# ENV:
+#   TEARDOWN_CHUNK_SIZE   docs borrados por delete_many (default 1000)
+#   TEARDOWN_PAUSE_MS     pausa entre bloques para no saturar Mongo (default 50)
+TEARDOWN_CHUNK_SIZE = int(os.getenv("TEARDOWN_CHUNK_SIZE", "1000"))
+TEARDOWN_PAUSE_MS = int(os.getenv("TEARDOWN_PAUSE_MS", "50"))
+
+async def _delete_in_chunks(collection, query: dict, on_chunk=None) -> int:
+    """delete_many por bloques de _id, con pausa entre bloques (throughput acotado)."""
+    total = 0
+    while True:
+        ids = [d["_id"] async for d in collection.find(query, {"_id": 1}).limit(TEARDOWN_CHUNK_SIZE)]
+        if not ids:
+            return total
+        res = await collection.delete_many({"_id": {"$in": ids}})
+        total += res.deleted_count
+        if on_chunk:
+            await on_chunk(total)
+        await asyncio.sleep(TEARDOWN_PAUSE_MS / 1000)
+
+async def teardown_tenant(ctx) -> dict:
     """
-    Elimina un tenant por su _id de Mongo.
-    - Si existe chirpstack_tenant_id, intenta eliminarlo en ChirpStack vía gRPC.
-    - Luego elimina los dispositivos del tenant en Mongo (opcional).
-    - Finalmente elimina el documento del tenant en Mongo.
-    Lanza ValueError con mensaje claro si algo falla.
+    Handler del job tenant_teardown (params: tenant_id, purge_devices).
+    Idempotente: cada reintento repite los pasos y los ya hechos no borran nada.
+      1) marcar el tenant como "deleting"
+      2) ChirpStack: DeleteTenant (en ChirpStack cascada a apps, devices, gateways, profiles)
+      3) Mongo por bloques: telemetría, rollups, alertas, device profiles, devices/gateways
+      4) documento del tenant
     """
-    # 1) Buscar tenant en Mongo
-    try:
-        oid = ObjectId(tenant_id)
-    except Exception:
-        raise ValueError("tenant_id inválido")
-
-    tenant = await tenants_collection.find_one({"_id": oid})
-    if not tenant:
-        raise ValueError("Tenant no encontrado")
-
-    chirp_tenant_id = tenant.get("chirpstack_tenant_id")
+    from db import db, alerts_collection
+    from telemetry import TELEMETRY_COLLECTION
+    from rollups import rollup_collection_name, ROLLUP_SECONDS
+
+    tenant_id = ctx.params["tenant_id"]
+    purge_devices = ctx.params.get("purge_devices", True)
+    oid = ObjectId(tenant_id)
+    result: dict = {"tenant_id": tenant_id}
+
+    # 1) tenant
+    tenant = await tenants_collection.find_one_and_update(
+        {"_id": oid}, {"$set": {"status": "deleting"}}, return_document=ReturnDocument.AFTER,
+    )
+    cs_tenant_id = (tenant or {}).get("chirpstack_tenant_id") or ctx.params.get("chirpstack_tenant_id")
+    invalidate_tenant(tenant_id)
 
-    # 2) Intentar eliminar en ChirpStack (si hay id)
+    # 2) ChirpStack (NOT_FOUND = ya borrado en un intento previo)
+    await ctx.progress("chirpstack")
     chirpstack_deleted = False
-    if chirp_tenant_id:
+    if cs_tenant_id:
         try:
-            cs = ChirpstackGRPCClient()
-            # Ajusta el nombre del método si en tu cliente es distinto.
-            # Se asume un método delete_tenant(chirp_tenant_id: str) -> None
-            cs.delete_tenant(chirp_tenant_id)
+            await AsyncChirpstackGRPCClient().delete_tenant(cs_tenant_id)
             chirpstack_deleted = True
         except RpcError as e:
-            # No detiene el borrado en Mongo si decides seguir; si prefieres abortar, lanza el error.
-            msg = e.details() or "Error gRPC al eliminar tenant en ChirpStack."
-            raise ValueError(msg)
-        except AttributeError:
-            # Tu cliente no tiene el método esperado
-            raise ValueError("El cliente gRPC no implementa delete_tenant(). Revísalo en chirpstack_grpc.py")
-
-    # 3) Borrar dispositivos del tenant en Mongo (opcional)
-    mongo_devices_deleted = 0
+            code = e.code().name if hasattr(e, "code") else ""
+            if code != "NOT_FOUND":
+                raise ValueError(f"gRPC {code}: {e.details() or 'Error al eliminar tenant en ChirpStack'}")
+        profile_index.invalidate(cs_tenant_id)
+    await ctx.progress("chirpstack", "done", deleted=chirpstack_deleted)
+    result["chirpstack_deleted"] = chirpstack_deleted
+
+    # 3) Mongo en cascada, por bloques
+    async def _step(name, collection, query):
+        await ctx.progress(name, deleted=0)
+        n = await _delete_in_chunks(collection, query, lambda total: ctx.progress(name, deleted=total))
+        await ctx.progress(name, "done", deleted=n)
+        result[f"{name}_deleted"] = n
+
+    # telemetría (time-series): borrado por metaField, un dispositivo a la vez
+    await ctx.progress("telemetry", deleted=0)
+    telemetry = db[TELEMETRY_COLLECTION]
+    deleted = 0
+    for eui in await telemetry.distinct("meta.device_eui", {"meta.tenant_id": tenant_id}):
+        res = await telemetry.delete_many({"meta.tenant_id": tenant_id, "meta.device_eui": eui})
+        deleted += res.deleted_count
+        await ctx.progress("telemetry", deleted=deleted)
+        await asyncio.sleep(TEARDOWN_PAUSE_MS / 1000)
+    await ctx.progress("telemetry", "done", deleted=deleted)
+    result["telemetry_deleted"] = deleted
+
+    rollups_deleted = 0
+    for interval in ROLLUP_SECONDS:
+        rollups_deleted += await _delete_in_chunks(db[rollup_collection_name(interval)], {"tenant_id": tenant_id})
+    await ctx.progress("rollups", "done", deleted=rollups_deleted)
+    result["rollups_deleted"] = rollups_deleted
+
+    await _step("alerts", alerts_collection, {"tenant_id": tenant_id})
+    # device_profiles guarda tenant_id de Mongo o de ChirpStack (ver upsert_device_profile_from_template_name)
+    dp_ids = [tenant_id] + ([cs_tenant_id] if cs_tenant_id else [])
+    await _step("device_profiles", device_profiles_collection, {"tenant_id": {"$in": dp_ids}})
     if purge_devices:
-        res_dev = await devices_collection.delete_many({"tenant_id": tenant_id})
-        mongo_devices_deleted = res_dev.deleted_count
+        await _step("gateways", devices_collection, {"tenant_id": tenant_id, "type": "gateway"})
+        await _step("devices", devices_collection, {"tenant_id": tenant_id})
 
-    # 4) Borrar tenant en Mongo
+    # 4) tenant
+    await ctx.progress("tenant")
     res_tenant = await tenants_collection.delete_one({"_id": oid})
-    if res_tenant.deleted_count != 1:
-        raise ValueError("No se pudo eliminar el tenant en Mongo")
-
-    return {
-        "ok": True,
-        "chirpstack_deleted": chirpstack_deleted,
-        "mongo_devices_deleted": mongo_devices_deleted,
-        "tenant_id": tenant_id,
-    }
+    invalidate_tenant(tenant_id)
+    await ctx.progress("tenant", "done", deleted=res_tenant.deleted_count)
+    result["ok"] = True
+    return result
 
 # ────────────────────────────────────────────────
 # 📦 BLOQUE: DEVICES
@@ -158,29 +212,29 @@ async def register_device(data: DeviceModel):
         application_id = tenant.get("chirpstack_app_id") or "1"
         tenant_chirpstack_id = tenant.get("chirpstack_tenant_id")
 
-        # a. Crear cliente gRPC
-        client = ChirpstackGRPCClient()
+        # a. Crear cliente gRPC (async, canal compartido)
+        client = AsyncChirpstackGRPCClient()
 
         # b. Obtener Device Profile ID (por gRPC)
-        profile_id = client.get_device_profile_id_by_name(device_type, tenant_chirpstack_id)
-
-        # c. Crear dispositivo vía gRPC
-        client = ChirpstackGRPCClient()
-        client.create_device(
-            dev_eui=dev_eui,
-            name=name,
-            description=description,
-            application_id=application_id,
-            device_profile_id=profile_id,
-        )
+        profile_id = await client.get_device_profile_id_by_name(device_type, tenant_chirpstack_id)
 
-        # d. Obtener AppKey desde Mongo
+        # c. AppKey del tipo desde Mongo (sin doc → device sin claves OTAA)
         key_doc = await devicekeys_collection.find_one({"type": device_type})
-        app_key = key_doc["app_key"] if key_doc else "00000000000000000000000000000000"
-
-        # e. Asignar claves OTAA (solo posible vía REST de momento)
-        #from chirpstack_api_com import set_device_keys
-        #set_device_keys(dev_eui, app_key)
+        key_args = ["--app-key", key_doc["app_key"]] if key_doc and key_doc.get("app_key") else ["--no-keys"]
+
+        # d. Crear dispositivo (+ keys) vía sidecar: los stubs locales de
+        #    chirpstack_proto no traen CreateDeviceRequest
+        out = await run_sidecar(DEV_SIDECAR, [
+            "create",
+            "--application-id", application_id,
+            "--device-profile-id", profile_id,
+            "--dev-eui", dev_eui,
+            "--name", name or dev_eui,
+            "--description", description or "",
+            *key_args,
+        ])
+        if not out.get("ok"):
+            raise RuntimeError(out.get("error") or "sidecar error")
 
     except Exception as e:
         print("⚠️ Error al sincronizar con ChirpStack:", str(e))
@@ -195,6 +249,388 @@ async def list_devices_by_tenant(tenant_id: str):
     cursor = devices_collection.find({"tenant_id": tenant_id})
     return [doc async for doc in cursor]
 
+# ────────────────────────────────────────────────
+# 📦 BLOQUE: DEVICES – alta masiva
+# ────────────────────────────────────────────────
+# ENV:
+#   BULK_MAX_DEVICES        items máximos por petición (default 1000)
+#   BULK_CHUNK_SIZE         devices por llamada al sidecar (default 100)
+#   BULK_SIDECAR_PARALLEL   RPCs simultáneos dentro de cada llamada al sidecar (default 8)
+BULK_MAX_DEVICES = int(os.getenv("BULK_MAX_DEVICES", "1000"))
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "100"))
+BULK_SIDECAR_PARALLEL = int(os.getenv("BULK_SIDECAR_PARALLEL", "8"))
+
+HEX16 = re.compile(r"^[0-9A-F]{16}$")
+HEX32 = re.compile(r"^[0-9A-F]{32}$")
+
+def _validate_bulk_item(raw: dict, default_app_key: str | None, no_keys: bool) -> dict:
+    """Normaliza un item; lanza ValueError con el motivo si no es válido."""
+    if not isinstance(raw, dict):
+        raise ValueError("item debe ser un objeto")
+    dev_eui = str(raw.get("dev_eui") or "").strip().upper()
+    if not HEX16.match(dev_eui):
+        raise ValueError("dev_eui debe ser 16 hex")
+    tags = raw.get("tags") or {}
+    if isinstance(tags, str):
+        tags = dict(p.split("=", 1) for p in tags.split(",") if "=" in p)
+    if not isinstance(tags, dict):
+        raise ValueError("tags debe ser un objeto o 'k=v,k2=v2'")
+    item = {
+        "dev_eui": dev_eui,
+        "name": str(raw.get("name") or "").strip() or dev_eui,
+        "description": str(raw.get("description") or ""),
+        "location": str(raw.get("location") or ""),
+        "tags": tags,
+        "no_keys": no_keys or str(raw.get("no_keys") or "").lower() in {"1", "true", "yes"},
+    }
+    if not item["no_keys"]:
+        app_key = str(raw.get("app_key") or default_app_key or "").strip().upper()
+        if not HEX32.match(app_key):
+            raise ValueError("app_key requerido (32 hex) si no usas no_keys")
+        nwk_key = str(raw.get("nwk_key") or "").strip().upper()
+        if nwk_key and not HEX32.match(nwk_key):
+            raise ValueError("nwk_key inválido (32 hex)")
+        join_eui = str(raw.get("join_eui") or "").strip().upper()
+        if join_eui and not HEX16.match(join_eui):
+            raise ValueError("join_eui inválido (16 hex)")
+        item.update(app_key=app_key, nwk_key=nwk_key, join_eui=join_eui)
+    gateway_id = raw.get("gateway_id")
+    if gateway_id:
+        try:
+            item["gateway_id"] = ObjectId(gateway_id)
+        except Exception:
+            raise ValueError("gateway_id inválido")
+    return item
+
+async def _insert_bulk_docs(tenant_id: str, created_docs: list[tuple[int, dict]], results: list[dict],
+                            id_key: str, rollback) -> None:
+    """
+    insert_many (ordered=False: un duplicado no frena el resto) de lo ya creado en ChirpStack.
+    Los que no llegan a Mongo se borran de ChirpStack con rollback(euis) para no dejar
+    huérfanos; salvo los duplicate key (el doc existente ya apunta a ese device).
+    """
+    created_docs.sort(key=lambda x: x[0])
+    failed: dict[int, str] = {}
+    keep: set[int] = set()  # fallos que no se compensan
+    try:
+        await devices_collection.insert_many([d for _, d in created_docs], ordered=False)
+    except BulkWriteError as e:
+        for err in (e.details or {}).get("writeErrors", []):
+            failed[err["index"]] = err.get("errmsg", "error de escritura")
+            if err.get("code") == 11000:
+                keep.add(err["index"])
+    except PyMongoError as e:
+        # error de red/servidor: parte del lote pudo escribirse; se comprueba qué quedó
+        euis = [d["dev_eui"] for _, d in created_docs]
+        try:
+            cursor = devices_collection.find({"tenant_id": tenant_id, "dev_eui": {"$in": euis}}, {"dev_eui": 1})
+            stored = {d["dev_eui"]: d["_id"] async for d in cursor}
+        except PyMongoError:
+            # sin saber qué se escribió no se borra nada: lo arregla POST /tenants/{id}/reconcile
+            print(f"🔴 Bulk {tenant_id}: insert_many falló y no se pudo verificar ({e}); pendiente de reconciliar")
+            stored = None
+        for pos, (_, doc) in enumerate(created_docs):
+            if stored is None:
+                failed[pos] = f"{e} (pendiente de reconciliar)"
+                keep.add(pos)
+            elif doc["dev_eui"] in stored:
+                doc["_id"] = stored[doc["dev_eui"]]
+            else:
+                failed[pos] = str(e)
+
+    to_undo = [created_docs[pos][1]["dev_eui"] for pos in failed if pos not in keep]
+    undo_errors: dict[str, str] = {}
+    if to_undo:
+        out = await rollback(to_undo)
+        if not out.get("ok"):
+            undo_errors = {eui: out.get("error") or "sidecar error" for eui in to_undo}
+        else:
+            undo_errors = {r.get("dev_eui") or r.get("gateway_id"): r.get("error")
+                           for r in out.get("results", []) if not r.get("ok")}
+        if undo_errors:
+            print(f"🔴 Bulk {tenant_id}: {len(undo_errors)} creados en ChirpStack sin revertir: {list(undo_errors)[:10]}")
+
+    for pos, (i, doc) in enumerate(created_docs):
+        if pos not in failed:
+            results[i].update(ok=True, status="created", **{id_key: str(doc["_id"])})
+            continue
+        error = failed[pos]
+        eui = doc["dev_eui"]
+        if eui in undo_errors:
+            error += f" (no se pudo revertir en ChirpStack: {undo_errors[eui]})"
+        elif pos not in keep:
+            error += " (revertido en ChirpStack)"
+        results[i].update(status="mongo_error", error=error)
+
+async def provision_devices_bulk(
+    tenant_id: str,
+    tenant: dict,
+    profile_name: str,
+    rows: list[dict],
+    device_type: str | None = None,
+    no_keys: bool = False,
+) -> dict:
+    """
+    Alta masiva de devices de un tenant con el mismo Device Profile.
+      1) Valida todos los items (formato, duplicados en el lote y en Mongo con un $in, límite del plan).
+      2) Resuelve application y device profile una sola vez.
+      3) Crea Device + DeviceKeys en ChirpStack vía sidecar, por bloques en paralelo.
+      4) Un insert_many con los creados; los que no entran en Mongo se borran de ChirpStack.
+    Devuelve un reporte por item: status created | invalid | duplicate | exists | chirpstack_error | mongo_error.
+    Lanza ValueError si el lote completo no se puede procesar (tenant/profile/límite).
+    """
+    if len(rows) > BULK_MAX_DEVICES:
+        raise ValueError(f"Máximo {BULK_MAX_DEVICES} devices por petición")
+    device_type = device_type or profile_name
+
+    results: list[dict] = [{"index": i, "ok": False} for i in range(len(rows))]
+    key_doc = await devicekeys_collection.find_one({"type": device_type})
+    default_app_key = key_doc.get("app_key") if key_doc else None
+
+    # 1) validación local
+    valid: dict[str, tuple[int, dict]] = {}
+    for i, raw in enumerate(rows):
+        try:
+            item = _validate_bulk_item(raw, default_app_key, no_keys)
+        except ValueError as e:
+            results[i].update(status="invalid", error=str(e), dev_eui=(raw or {}).get("dev_eui") if isinstance(raw, dict) else None)
+            continue
+        results[i]["dev_eui"] = item["dev_eui"]
+        if item["dev_eui"] in valid:
+            results[i].update(status="duplicate", error=f"dev_eui repetido (item {valid[item['dev_eui']][0]})")
+            continue
+        valid[item["dev_eui"]] = (i, item)
+
+    # ... y contra Mongo con una sola consulta
+    if valid:
+        cursor = devices_collection.find(
+            {"tenant_id": tenant_id, "dev_eui": {"$in": list(valid)}}, {"dev_eui": 1}
+        )
+        async for d in cursor:
+            i, _ = valid.pop(d["dev_eui"])
+            results[i].update(status="exists", error="dev_eui ya registrado en este tenant")
+
+    # límite del plan, contado una vez para todo el lote
+    if valid:
+        device_count = await devices_collection.count_documents({"tenant_id": tenant_id})
+        max_allowed = tenant.get("max_devices", 5)
+        if device_count + len(valid) > max_allowed:
+            raise ValueError(
+                f"Límite de dispositivos alcanzado para este plan ({device_count}/{max_allowed}, "
+                f"el lote agrega {len(valid)})"
+            )
+
+    # 2) tenant/app/profile una sola vez
+    created_docs: list[tuple[int, dict]] = []
+    if valid:
+        cs_tenant_id = tenant.get("chirpstack_tenant_id")
+        if not cs_tenant_id:
+            raise ValueError("Tenant sin chirpstack_tenant_id")
+        cs = AsyncChirpstackGRPCClient()
+        app_id = tenant.get("chirpstack_app_id")
+        if not app_id:
+            composed = tenant.get("chirpstack_tenant_name") or tenant.get("name") or "default-app"
+            app_id = await cs.ensure_application_same_as_tenant(cs_tenant_id, composed)
+            await tenants_collection.update_one({"_id": tenant["_id"]}, {"$set": {"chirpstack_app_id": app_id}})
+            invalidate_tenant(tenant_id)
+        try:
+            profile_id = await cs.get_device_profile_id_by_name(profile_name, cs_tenant_id)
+        except ValueError:
+            raise ValueError(f"Device Profile '{profile_name}' no existe en tenant {cs_tenant_id}")
+
+        # 3) ChirpStack por bloques (cada bloque = 1 llamada al sidecar con RPCs en paralelo)
+        ordered = list(valid.values())
+        chunks = [ordered[i:i + BULK_CHUNK_SIZE] for i in range(0, len(ordered), BULK_CHUNK_SIZE)]
+
+        async def _create_chunk(chunk):
+            payload = [
+                {k: v for k, v in item.items() if k not in {"location", "gateway_id"}}
+                for _, item in chunk
+            ]
+            out = await run_sidecar(DEV_SIDECAR, [
+                "create-batch",
+                "--application-id", app_id,
+                "--device-profile-id", profile_id,
+                "--items-json", json.dumps(payload),
+                "--concurrency", str(BULK_SIDECAR_PARALLEL),
+            ], timeout=max(30.0, len(chunk) * 2.0))
+            if not out.get("ok"):
+                for i, _ in chunk:
+                    results[i].update(status="chirpstack_error", error=out.get("error") or "sidecar error")
+                return
+            by_eui = {r.get("dev_eui"): r for r in out.get("results", [])}
+            now = datetime.now(timezone.utc)
+            for i, item in chunk:
+                r = by_eui.get(item["dev_eui"]) or {"ok": False, "error": "sin respuesta del sidecar"}
+                if not r.get("ok"):
+                    results[i].update(status="chirpstack_error", error=r.get("error"))
+                    continue
+                doc = {
+                    "tenant_id": tenant_id,
+                    "dev_eui": item["dev_eui"],
+                    "name": item["name"],
+                    "type": device_type,
+                    "status": "active",
+                    "location": item["location"],
+                    "created_at": now,
+                    "meta": {
+                        "chirpstack_tenant_id": cs_tenant_id,
+                        "chirpstack_app_id": app_id,
+                        "device_profile_name": profile_name,
+                        "device_profile_id": profile_id,
+                        "keys": bool(r.get("keys")),
+                        "bulk": True,
+                    },
+                }
+                if item.get("gateway_id"):
+                    doc["gateway_id"] = item["gateway_id"]
+                created_docs.append((i, doc))
+
+        await asyncio.gather(*(_create_chunk(c) for c in chunks))
+
+    # 4) Mongo: un solo insert_many; lo que no entra se borra de ChirpStack
+    if created_docs:
+        async def _rollback(dev_euis):
+            return await run_sidecar(DEV_SIDECAR, [
+                "delete-batch",
+                "--dev-euis-json", json.dumps(dev_euis),
+                "--concurrency", str(BULK_SIDECAR_PARALLEL),
+            ], timeout=max(30.0, len(dev_euis) * 1.0))
+
+        await _insert_bulk_docs(tenant_id, created_docs, results, "device_id", _rollback)
+
+    created = sum(1 for r in results if r["ok"])
+    return {
+        "ok": created == len(rows),
+        "total": len(rows),
+        "created": created,
+        "failed": len(rows) - created,
+        "results": results,
+    }
+
+# ────────────────────────────────────────────────
+# 📡 BLOQUE: GATEWAYS – alta masiva
+# ────────────────────────────────────────────────
+def _validate_bulk_gateway(raw: dict) -> dict:
+    if not isinstance(raw, dict):
+        raise ValueError("item debe ser un objeto")
+    gw_eui = str(raw.get("gateway_id") or "").strip().upper()
+    if not HEX16.match(gw_eui):
+        raise ValueError("gateway_id debe ser 16 hex")
+    name = str(raw.get("name") or "").strip()
+    if not name:
+        raise ValueError("name es obligatorio")
+    tags = raw.get("tags") or {}
+    if isinstance(tags, str):
+        tags = dict(p.split("=", 1) for p in tags.split(",") if "=" in p)
+    if not isinstance(tags, dict):
+        raise ValueError("tags debe ser un objeto o 'k=v,k2=v2'")
+    return {
+        "gateway_id": gw_eui,
+        "name": name,
+        "description": str(raw.get("description") or ""),
+        "location": str(raw.get("location") or ""),
+        "tags": tags,
+    }
+
+async def import_gateways_bulk(tenant_id: str, tenant: dict, rows: list[dict]) -> dict:
+    """
+    Alta masiva de gateways de un tenant:
+      1) valida todo, descarta duplicados del lote y los ya registrados (un solo $in);
+      2) crea en ChirpStack vía gw_sidecar create-batch (un canal, RPCs en paralelo);
+      3) refleja los creados en Mongo con un insert_many (los que fallan se borran de ChirpStack).
+    Reporte por item: status created | invalid | duplicate | exists | chirpstack_error | mongo_error.
+    """
+    if len(rows) > BULK_MAX_DEVICES:
+        raise ValueError(f"Máximo {BULK_MAX_DEVICES} gateways por petición")
+    chirp_tenant_id = tenant.get("chirpstack_tenant_id")
+    if not chirp_tenant_id:
+        raise ValueError("Tenant sin chirpstack_tenant_id")
+
+    results: list[dict] = [{"index": i, "ok": False} for i in range(len(rows))]
+    valid: dict[str, tuple[int, dict]] = {}
+    for i, raw in enumerate(rows):
+        try:
+            item = _validate_bulk_gateway(raw)
+        except ValueError as e:
+            results[i].update(status="invalid", error=str(e), gateway_id=(raw or {}).get("gateway_id") if isinstance(raw, dict) else None)
+            continue
+        results[i]["gateway_id"] = item["gateway_id"]
+        if item["gateway_id"] in valid:
+            results[i].update(status="duplicate", error=f"gateway_id repetido (item {valid[item['gateway_id']][0]})")
+            continue
+        valid[item["gateway_id"]] = (i, item)
+
+    if valid:
+        cursor = devices_collection.find(
+            {"tenant_id": tenant_id, "type": "gateway", "dev_eui": {"$in": list(valid)}}, {"dev_eui": 1}
+        )
+        async for d in cursor:
+            i, _ = valid.pop(d["dev_eui"])
+            results[i].update(status="exists", error="Gateway ya existe en Mongo para este tenant")
+
+    created_docs: list[tuple[int, dict]] = []
+    ordered = list(valid.values())
+    chunks = [ordered[i:i + BULK_CHUNK_SIZE] for i in range(0, len(ordered), BULK_CHUNK_SIZE)]
+
+    async def _create_chunk(chunk):
+        payload = [
+            {k: item[k] for k in ("gateway_id", "name", "description", "tags")}
+            for _, item in chunk
+        ]
+        out = await run_sidecar(GW_SIDECAR, [
+            "create-batch",
+            "--tenant-id", chirp_tenant_id,
+            "--items-json", json.dumps(payload),
+            "--concurrency", str(BULK_SIDECAR_PARALLEL),
+        ], timeout=max(30.0, len(chunk) * 1.0))
+        if not out.get("ok"):
+            for i, _ in chunk:
+                results[i].update(status="chirpstack_error", error=out.get("error") or "sidecar error")
+            return
+        by_id = {r.get("gateway_id"): r for r in out.get("results", [])}
+        now = datetime.now(timezone.utc)
+        for i, item in chunk:
+            r = by_id.get(item["gateway_id"]) or {"ok": False, "error": "sin respuesta del sidecar"}
+            if not r.get("ok"):
+                results[i].update(status="chirpstack_error", error=r.get("error"))
+                continue
+            created_docs.append((i, {
+                "tenant_id": tenant_id,
+                "dev_eui": item["gateway_id"],
+                "name": item["name"],
+                "type": "gateway",
+                "status": "active",
+                "location": item["location"],
+                "created_at": now,
+                "meta": {
+                    "chirpstack_tenant_id": chirp_tenant_id,
+                    "description": item["description"],
+                    "tags": item["tags"],
+                },
+            }))
+
+    await asyncio.gather(*(_create_chunk(c) for c in chunks))
+
+    if created_docs:
+        async def _rollback(gateway_ids):
+            return await run_sidecar(GW_SIDECAR, [
+                "delete-batch",
+                "--gateway-ids-json", json.dumps(gateway_ids),
+                "--concurrency", str(BULK_SIDECAR_PARALLEL),
+            ], timeout=max(30.0, len(gateway_ids) * 1.0))
+
+        await _insert_bulk_docs(tenant_id, created_docs, results, "id", _rollback)
+
+    created = sum(1 for r in results if r["ok"])
+    return {
+        "ok": created == len(rows),
+        "total": len(rows),
+        "created": created,
+        "failed": len(rows) - created,
+        "results": results,
+    }
+
 # ────────────────────────────────────────────────
 # 👤 BLOQUE: USERS
 # ────────────────────────────────────────────────
@@ -242,35 +678,17 @@ async def _resolve_cs_tenant_id(tenant_id: str) -> str:
     return tenant_id
 
 async def _dp_sidecar_get(name: str) -> dict:
-    """Ejecuta: python -m dp_sidecar get --name <template>"""
-    proc = await asyncio.create_subprocess_exec(
-        sys.executable, "-m", "dp_sidecar", "get", "--name", name,
-        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    out, err = await proc.communicate()
-    if proc.returncode != 0:
-        return {"ok": False, "error": (err.decode() or out.decode() or "dp_sidecar get error")}
-    try:
-        return json.loads(out or b"{}")
-    except Exception:
-        return {"ok": False, "error": "dp_sidecar get: bad JSON"}
+    """dp_sidecar get --name <template> (vía sidecar_runner, no bloquea el loop)"""
+    return await run_sidecar(DP_SIDECAR, ["get", "--name", name])
 
 async def _dp_sidecar_create_from_template(cs_tenant_id: str, profile_name: str, template: dict) -> dict:
-    """Ejecuta: python -m dp_sidecar create-from-template --tenant-id ... --profile-name ... --template-json ..."""
-    proc = await asyncio.create_subprocess_exec(
-        sys.executable, "-m", "dp_sidecar", "create-from-template",
+    """dp_sidecar create-from-template --tenant-id ... --profile-name ... --template-json ... (vía sidecar_runner)"""
+    return await run_sidecar(DP_SIDECAR, [
+        "create-from-template",
         "--tenant-id", cs_tenant_id,
         "--profile-name", profile_name,
         "--template-json", json.dumps(template),
-        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    out, err = await proc.communicate()
-    if proc.returncode != 0:
-        return {"ok": False, "error": (err.decode() or out.decode() or "dp_sidecar create error")}
-    try:
-        return json.loads(out or b"{}")
-    except Exception:
-        return {"ok": False, "error": "dp_sidecar create: bad JSON"}
+    ])
 
 async def upsert_device_profile_from_template_name(
     tenant_id: str,            # MongoId o tenant_id de ChirpStack
@@ -325,6 +743,11 @@ async def upsert_device_profile_from_template_name(
     if not created.get("ok"):
         return {"ok": False, "code": "chirpstack_error", "error": created.get("error")}
     dp_id = created.get("device_profile_id")
+    # el índice nombre→id del tenant ya no está completo: se registra el nuevo y
+    # el siguiente nombre desconocido vuelve a listar
+    profile_index.invalidate(cs_tenant_id)
+    if dp_id:
+        profile_index.put(cs_tenant_id, profile_name, dp_id)
 
     # 5) persistir snapshot en Mongo
     now = datetime.now(timezone.utc)
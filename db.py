@@ -2,6 +2,9 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 
+from metrics import mongo_listeners
+from tracing import mongo_trace_listeners
+
 # Solo carga .env si estás en local (Railway ya provee las variables de entorno)
 if os.getenv("RAILWAY_STATIC_URL") is None:
     from dotenv import load_dotenv
@@ -9,7 +12,8 @@ if os.getenv("RAILWAY_STATIC_URL") is None:
 
 MONGODB_URI = os.getenv("MONGODB_URI")
 
-client = AsyncIOMotorClient(MONGODB_URI)
+# latencia por colección/comando → /metrics (metrics.MongoCommandMetrics) y spans (tracing)
+client = AsyncIOMotorClient(MONGODB_URI, event_listeners=[*mongo_listeners(), *mongo_trace_listeners()])
 db = client["PLATAFORMA_IOT"]  # Asegúrate de usar el nombre correcto de la base
 
 # Colecciones accesibles
@@ -20,4 +24,6 @@ alerts_collection = db["alerts"]
 logs_collection = db["logs"]
 devicekeys_collection = db["devicekeys"]
 dp_templates_cache_collection = db["dp_templates_cache"]
-device_profiles_collection = db["device_profiles"]
\ No newline at end of file
+device_profiles_collection = db["device_profiles"]
+mqtt_data_collection = db["mqtt_data"]
+jobs_collection = db["jobs"]
@@ -0,0 +1,155 @@
+# device_registry.py
+# Registro en memoria dev_eui → dispositivo, para validar uplinks MQTT sin ir a Mongo.
+#
+# - Snapshot inicial de la colección devices (solo los campos necesarios).
+# - Se mantiene fresco con un change stream sobre devices; si Mongo no lo soporta
+#   (standalone, sin replica set) cae a polling con re-snapshot periódico.
+# - Re-snapshot cada REGISTRY_TTL_S también en modo change stream, como red de seguridad.
+# - Caché negativa: un dev_eui desconocido se consulta a Mongo una vez y luego se
+#   descarta en memoria durante REGISTRY_NEGATIVE_TTL_S.
+#
+# ENV:
+#   REGISTRY_TTL_S            periodo de re-snapshot / polling (default 300)
+#   REGISTRY_NEGATIVE_TTL_S   tiempo que se recuerda un dev_eui no registrado (default 60)
+import asyncio, os, time
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+REGISTRY_TTL_S = float(os.getenv("REGISTRY_TTL_S", "300"))
+REGISTRY_NEGATIVE_TTL_S = float(os.getenv("REGISTRY_NEGATIVE_TTL_S", "60"))
+
+_PROJECTION = {"dev_eui": 1, "tenant_id": 1, "type": 1, "name": 1}
+
+
+class DeviceRegistry:
+    def __init__(self, collection, ttl: float = REGISTRY_TTL_S, negative_ttl: float = REGISTRY_NEGATIVE_TTL_S):
+        self.collection = collection
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._by_eui: dict[str, dict] = {}
+        self._eui_by_id: dict = {}
+        self._negative: dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+        self.mode = "idle"  # "change_stream" | "polling"
+        self.stats = {"hits": 0, "negative_hits": 0, "db_lookups": 0, "snapshots": 0, "stream_events": 0}
+
+    # ── lecturas ──────────────────────────────────
+    async def resolve(self, dev_eui: str) -> dict | None:
+        """Devuelve el doc del dispositivo o None si no está registrado."""
+        doc = self._by_eui.get(dev_eui)
+        if doc is not None:
+            self.stats["hits"] += 1
+            return doc
+
+        exp = self._negative.get(dev_eui)
+        if exp is not None and exp > time.monotonic():
+            self.stats["negative_hits"] += 1
+            return None
+
+        # Fallo de caché: una sola lectura y se recuerda el resultado
+        self.stats["db_lookups"] += 1
+        doc = await self.collection.find_one({"dev_eui": dev_eui}, _PROJECTION)
+        if doc:
+            self._put(doc)
+            return self._by_eui[dev_eui]
+        self._negative[dev_eui] = time.monotonic() + self.negative_ttl
+        return None
+
+    def __len__(self):
+        return len(self._by_eui)
+
+    # ── mantenimiento ─────────────────────────────
+    def _put(self, doc: dict):
+        eui = doc.get("dev_eui")
+        if not eui:
+            return
+        old = self._eui_by_id.get(doc["_id"])
+        if old and old != eui:
+            self._by_eui.pop(old, None)
+        self._by_eui[eui] = {k: doc.get(k) for k in ("_id", "dev_eui", "tenant_id", "type", "name")}
+        self._eui_by_id[doc["_id"]] = eui
+        self._negative.pop(eui, None)
+
+    def _drop(self, _id):
+        eui = self._eui_by_id.pop(_id, None)
+        if eui:
+            self._by_eui.pop(eui, None)
+
+    async def snapshot(self):
+        by_eui, by_id = {}, {}
+        async for doc in self.collection.find({}, _PROJECTION):
+            eui = doc.get("dev_eui")
+            if eui:
+                by_eui[eui] = {k: doc.get(k) for k in ("_id", "dev_eui", "tenant_id", "type", "name")}
+                by_id[doc["_id"]] = eui
+        self._by_eui, self._eui_by_id = by_eui, by_id
+        self._negative.clear()
+        self.stats["snapshots"] += 1
+
+    async def _watch(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        deadline = time.monotonic() + self.ttl
+        async with self.collection.watch(pipeline, full_document="updateLookup") as stream:
+            self.mode = "change_stream"
+            while True:
+                change = await stream.try_next()
+                if change is not None:
+                    self.stats["stream_events"] += 1
+                    op = change["operationType"]
+                    if op == "delete":
+                        self._drop(change["documentKey"]["_id"])
+                    elif change.get("fullDocument"):
+                        self._put(change["fullDocument"])
+                    else:
+                        # el doc se borró antes del lookup
+                        self._drop(change["documentKey"]["_id"])
+                if time.monotonic() >= deadline:
+                    await self.snapshot()
+                    deadline = time.monotonic() + self.ttl
+                if change is None:
+                    await asyncio.sleep(0.5)
+
+    async def _poll(self):
+        self.mode = "polling"
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self.snapshot()
+            except PyMongoError as e:
+                print(f"⚠️  Registry: error en polling: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await self._watch()
+            except OperationFailure as e:
+                # 40573: change streams solo en replica sets / sharded
+                print(f"⚠️  Registry: change stream no disponible ({e.code}), usando polling cada {self.ttl:g}s")
+                await self._poll()
+                return
+            except PyMongoError as e:
+                print(f"⚠️  Registry: change stream interrumpido: {e}; reintentando")
+                await asyncio.sleep(2)
+                try:
+                    await self.snapshot()
+                except PyMongoError:
+                    pass
+            except Exception as e:
+                # driver/cliente sin soporte de change streams (p.ej. mongomock)
+                print(f"⚠️  Registry: change stream no soportado ({e}), usando polling cada {self.ttl:g}s")
+                await self._poll()
+                return
+
+    async def start(self):
+        await self.snapshot()
+        self._task = asyncio.create_task(self._run())
+        print(f"🟢 Registry: {len(self)} dispositivos en memoria")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
@@ -1,7 +1,8 @@
 # dp_sidecar.py
-import os, json, argparse, grpc
+import os, sys, json, argparse, grpc
 from google.protobuf.json_format import MessageToDict, ParseDict
 from grpc_auth_interceptor import ApiKeyAuthInterceptor
+from tracing import rpc_trace_interceptors
 
 # Paquete oficial solo aquí (como hiciste con gateways)
 from chirpstack_api.api import device_profile_template_pb2 as dpt_pb2
@@ -9,15 +10,23 @@ from chirpstack_api.api import device_profile_template_pb2_grpc as dpt_grpc
 from chirpstack_api.api import device_profile_pb2 as dp_pb2
 from chirpstack_api.api import device_profile_pb2_grpc as dp_grpc
 
+_CHANNEL = None
+
 def _channel():
+    # Memoizado: en modo serve el canal se reutiliza entre comandos
+    global _CHANNEL
+    if _CHANNEL is not None:
+        return _CHANNEL
     addr = os.getenv("CHIRPSTACK_GRPC_ADDRESS", "localhost:8080")
     apikey = os.getenv("CHIRPSTACK_API_KEY")
     if not apikey:
         raise RuntimeError("CHIRPSTACK_API_KEY missing")
-    return grpc.intercept_channel(
+    _CHANNEL = grpc.intercept_channel(
         grpc.insecure_channel(addr),
         ApiKeyAuthInterceptor(apikey),
+        *rpc_trace_interceptors(),  # spans gRPC hijos del traceparent del API
     )
+    return _CHANNEL
 
 def list_templates(limit=50, search=""):
     ch = _channel()
@@ -129,7 +138,7 @@ def create_dp_from_template(tenant_id: str, profile_name: str, template: dict):
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
-def main():
+def run(argv: list[str]) -> dict:
     p = argparse.ArgumentParser(prog="dp_sidecar", description="Device Profile Template sidecar")
     sub = p.add_subparsers(dest="cmd", required=True)
 
@@ -145,7 +154,7 @@ def main():
     p_create.add_argument("--profile-name", required=True)
     p_create.add_argument("--template-json", required=True, help="JSON del template (usar caché)")
 
-    args = p.parse_args()
+    args = p.parse_args(argv)
     try:
         if args.cmd == "list":
             out = list_templates(limit=args.limit, search=args.search)
@@ -159,7 +168,16 @@ def main():
     except Exception as e:
         out = {"ok": False, "error": str(e)}
 
-    print(json.dumps(out))
+    return out
+
+def main():
+    # python -m dp_sidecar serve → worker persistente (JSON-lines por stdin/stdout)
+    if sys.argv[1:2] == ["serve"]:
+        from sidecars.serve import serve_forever
+        serve_forever(run)
+        return
+    from sidecars.serve import run_cli
+    run_cli(run, sys.argv[1:])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,171 @@
+# fake_chirpstack.py
+# ChirpStack v4 falso, en memoria, para pruebas de carga offline.
+#
+# Implementa sobre grpc.aio (mismos nombres de servicio "api.*" que el ChirpStack
+# real, así que sirve tanto a chirpstack_grpc.py como a los sidecars):
+#   TenantService, ApplicationService, DeviceService (incl. CreateKeys/GetKeys/
+#   UpdateKeys/DeleteKeys: en v4 las DeviceKeys viven en DeviceService),
+#   DeviceProfileService, DeviceProfileTemplateService, GatewayService
+#   → Create / Get / Update / Delete / List con paginado, search y total_count.
+# Lo no implementado responde UNIMPLEMENTED (servicer base).
+# Estado y servicers en fake_chirpstack_services.py; este módulo solo lanza el
+# proceso, así se puede importar junto a chirpstack_grpc.
+#
+# Inyección de fallas (FaultConfig), global y por método ("DeviceService/Create"):
+#   latency_ms + jitter_ms (uniforme), slow_rate/slow_ms (cola de latencia),
+#   error_rate/error_code. Con seed fijo la secuencia es repetible.
+#
+# Desde benchmarks/scripts (proceso hijo, ver FakeChirpstackServer):
+#   with FakeChirpstackServer(FaultConfig(latency_ms=20), seed=1) as srv:
+#       os.environ["CHIRPSTACK_GRPC_ADDRESS"] = srv.address
+#   srv.final_stats → llamadas/errores/latencia por método
+#
+# CLI:
+#   python -m fake_chirpstack --port 8080 --latency-ms 20 --jitter-ms 10 \
+#       --error-rate 0.01 --override DeviceService/Create=latency_ms:80,error_rate:0.05
+#
+# ENV:
+#   FAKE_CS_API_KEY     si se define, exige "authorization: Bearer <key>" (default: acepta cualquiera)
+#   FAKE_CS_TEMPLATES   templates precargados, separados por coma (default "LBM01,GENERIC_EU868")
+import argparse, asyncio, atexit, json, os, re, signal, subprocess, sys, time
+from dataclasses import dataclass
+
+import grpc
+
+FAKE_CS_API_KEY = os.getenv("FAKE_CS_API_KEY", "")
+FAKE_CS_TEMPLATES = os.getenv("FAKE_CS_TEMPLATES", "LBM01,GENERIC_EU868")
+
+_LISTENING_RE = re.compile(r"escuchando en (\S+)")
+
+
+@dataclass
+class FaultConfig:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    slow_rate: float = 0.0
+    slow_ms: float = 0.0
+    error_rate: float = 0.0
+    error_code: str = "UNAVAILABLE"
+
+
+class FakeChirpstackServer:
+    """Levanta el fake en un proceso hijo (python -m fake_chirpstack) y espera a que escuche.
+
+    Proceso aparte por el mismo motivo que los sidecars: chirpstack_api y los stubs
+    locales de chirpstack_proto registran los mismos símbolos "api.*" en el pool de
+    descriptores de protobuf y no pueden convivir en un mismo intérprete.
+    """
+
+    def __init__(self, faults: FaultConfig | None = None, overrides: dict | None = None,
+                 seed: int | None = None, host: str = "127.0.0.1", port: int = 0,
+                 api_key: str = "", templates: list[str] | None = None, startup_timeout: float = 15):
+        self.faults = faults or FaultConfig()
+        self.overrides = overrides or {}
+        self.seed = seed
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self.templates = templates
+        self.startup_timeout = startup_timeout
+        self.address = ""
+        self.final_stats: dict | None = None
+        self._proc: subprocess.Popen | None = None
+
+    def _argv(self) -> list[str]:
+        f = self.faults
+        argv = [sys.executable, "-m", "fake_chirpstack", "--host", self.host, "--port", str(self.port),
+                "--latency-ms", str(f.latency_ms), "--jitter-ms", str(f.jitter_ms),
+                "--slow-rate", str(f.slow_rate), "--slow-ms", str(f.slow_ms),
+                "--error-rate", str(f.error_rate), "--error-code", f.error_code]
+        for method, fields in self.overrides.items():
+            argv += ["--override", f"{method}=" + ",".join(f"{k}:{v}" for k, v in fields.items())]
+        if self.seed is not None:
+            argv += ["--seed", str(self.seed)]
+        return argv
+
+    def start(self) -> str:
+        env = dict(os.environ, FAKE_CS_API_KEY=self.api_key)
+        if self.templates is not None:
+            env["FAKE_CS_TEMPLATES"] = ",".join(self.templates)
+        self._proc = subprocess.Popen(
+            self._argv(), stdout=subprocess.PIPE, text=True, env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            line = self._proc.stdout.readline()
+            if not line:
+                break
+            m = _LISTENING_RE.search(line)
+            if m:
+                self.address = m.group(1)
+                atexit.register(self.stop)  # no dejar el hijo huérfano si el script revienta
+                return self.address
+        self._proc.kill()
+        raise RuntimeError("fake_chirpstack no arrancó")
+
+    def stop(self, timeout: float = 10) -> dict | None:
+        """Detiene el proceso y devuelve sus stats finales (última línea JSON)."""
+        if self._proc is None:
+            return self.final_stats
+        self._proc.send_signal(signal.SIGTERM)
+        try:
+            out, _ = self._proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            out, _ = self._proc.communicate()
+        self._proc = None
+        for line in reversed((out or "").strip().splitlines()):
+            try:
+                self.final_stats = json.loads(line)
+                break
+            except ValueError:
+                continue
+        return self.final_stats
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _parse_override(text: str) -> tuple[str, dict]:
+    """'DeviceService/Create=latency_ms:80,error_rate:0.05' → (método, {campo: valor})."""
+    method, _, spec = text.partition("=")
+    fields = {}
+    for part in filter(None, spec.split(",")):
+        key, _, value = part.partition(":")
+        fields[key] = value if key == "error_code" else float(value)
+    return method.strip(), fields
+
+
+def main():
+    p = argparse.ArgumentParser(prog="fake_chirpstack", description="ChirpStack v4 falso en memoria (pruebas de carga)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--latency-ms", type=float, default=0.0)
+    p.add_argument("--jitter-ms", type=float, default=0.0)
+    p.add_argument("--slow-rate", type=float, default=0.0, help="fracción de llamadas con +slow-ms")
+    p.add_argument("--slow-ms", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--error-code", default="UNAVAILABLE", choices=[c.name for c in grpc.StatusCode])
+    p.add_argument("--override", action="append", default=[],
+                   help="Servicio/Método=campo:valor,... (p.ej. DeviceService/Create=latency_ms:80)")
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--stats-interval", type=float, default=0.0, help="segundos entre reportes (0 = solo al salir)")
+    args = p.parse_args()
+
+    from fake_chirpstack_services import FakeChirpstack, serve_forever
+    fake = FakeChirpstack(
+        FaultConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, slow_rate=args.slow_rate,
+                    slow_ms=args.slow_ms, error_rate=args.error_rate, error_code=args.error_code),
+        overrides=dict(_parse_override(o) for o in args.override),
+        seed=args.seed,
+    )
+    asyncio.run(serve_forever(fake, f"{args.host}:{args.port}", args.stats_interval))
+
+
+if __name__ == "__main__":
+    main()
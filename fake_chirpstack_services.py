@@ -0,0 +1,559 @@
+# fake_chirpstack_services.py
+# Estado en memoria y servicers grpc.aio del ChirpStack falso (ver fake_chirpstack.py).
+#
+# Usa los stubs de chirpstack_api (PyPI), igual que los sidecars: NO importar este
+# módulo en un proceso que ya cargó chirpstack_proto (símbolos "api.*" duplicados en
+# el pool de protobuf). fake_chirpstack.FakeChirpstackServer lo corre en un proceso hijo.
+import asyncio, functools, json, random, re, signal, time, uuid
+from dataclasses import replace
+
+import grpc
+from google.protobuf import empty_pb2
+from google.protobuf.timestamp_pb2 import Timestamp
+from chirpstack_api import api, common
+
+from fake_chirpstack import FaultConfig, FAKE_CS_API_KEY, FAKE_CS_TEMPLATES
+
+
+class _RpcError(Exception):
+    def __init__(self, code: grpc.StatusCode, details: str):
+        super().__init__(details)
+        self.code = code
+        self.details = details
+
+
+def _not_found(what: str, key: str):
+    return _RpcError(grpc.StatusCode.NOT_FOUND, f"Object does not exist ({what}={key})")
+
+
+def _now() -> Timestamp:
+    ts = Timestamp()
+    ts.GetCurrentTime()
+    return ts
+
+
+def _eui(value: str) -> str:
+    value = (value or "").strip().lower()
+    if not re.fullmatch(r"[0-9a-f]{16}", value):
+        raise _RpcError(grpc.StatusCode.INVALID_ARGUMENT, f"Invalid EUI64: {value!r}")
+    return value
+
+
+def _page(items: list, request, key=lambda x: x.name):
+    """search (substring en name), orden por name, limit/offset → (total, page)."""
+    search = (getattr(request, "search", "") or "").lower()
+    if search:
+        items = [x for x in items if search in key(x).lower()]
+    items = sorted(items, key=key)
+    offset = max(0, request.offset)
+    return len(items), items[offset:offset + request.limit]
+
+
+class _Record:
+    __slots__ = ("obj", "created_at", "updated_at")
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.created_at = _now()
+        self.updated_at = self.created_at
+
+    @property
+    def name(self):
+        return self.obj.name
+
+    def touch(self, obj):
+        self.obj = obj
+        self.updated_at = _now()
+
+
+class FakeChirpstack:
+    """Estado en memoria + inyección de fallas + contadores por método."""
+
+    def __init__(self, faults: FaultConfig | None = None, overrides: dict | None = None,
+                 api_key: str = FAKE_CS_API_KEY, seed: int | None = None,
+                 templates: list[str] | None = None):
+        self.faults = faults or FaultConfig()
+        self.overrides = overrides or {}
+        self.api_key = api_key
+        self.rng = random.Random(seed)
+        self.tenants: dict[str, _Record] = {}
+        self.applications: dict[str, _Record] = {}
+        self.devices: dict[str, _Record] = {}
+        self.device_keys: dict[str, _Record] = {}
+        self.device_profiles: dict[str, _Record] = {}
+        self.templates: dict[str, _Record] = {}
+        self.gateways: dict[str, _Record] = {}
+        self._stats: dict[str, dict] = {}
+        names = templates if templates is not None else [t for t in FAKE_CS_TEMPLATES.split(",") if t.strip()]
+        for name in names:
+            self.add_template(name.strip())
+
+    # ── seed ──────────────────────────────────────
+    def add_template(self, name: str, **fields) -> str:
+        tpl_id = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or str(uuid.uuid4())
+        tpl = api.DeviceProfileTemplate(
+            id=tpl_id, name=name, vendor=fields.pop("vendor", "fake"), firmware=fields.pop("firmware", "1.0"),
+            region=common.Region.EU868, mac_version=common.MacVersion.LORAWAN_1_0_3,
+            reg_params_revision=common.RegParamsRevision.A, supports_otaa=True,
+            uplink_interval=fields.pop("uplink_interval", 3600), **fields,
+        )
+        self.templates[tpl_id] = _Record(tpl)
+        return tpl_id
+
+    # ── fallas y métricas ─────────────────────────
+    def fault_for(self, method: str) -> FaultConfig:
+        over = self.overrides.get(method)
+        return replace(self.faults, **over) if over else self.faults
+
+    async def handle(self, method: str, impl, request, context):
+        st = self._stats.setdefault(method, {"calls": 0, "errors": 0, "injected": 0, "total_ms": 0.0, "max_ms": 0.0})
+        st["calls"] += 1
+        t0 = time.monotonic()
+        try:
+            if self.api_key:
+                md = dict(context.invocation_metadata() or ())
+                if md.get("authorization") != f"Bearer {self.api_key}":
+                    raise _RpcError(grpc.StatusCode.UNAUTHENTICATED, "Invalid API key")
+
+            f = self.fault_for(method)
+            delay = f.latency_ms + (self.rng.uniform(0, f.jitter_ms) if f.jitter_ms else 0.0)
+            if f.slow_rate and self.rng.random() < f.slow_rate:
+                delay += f.slow_ms
+            if delay > 0:
+                await asyncio.sleep(delay / 1000)
+            if f.error_rate and self.rng.random() < f.error_rate:
+                st["injected"] += 1
+                raise _RpcError(getattr(grpc.StatusCode, f.error_code), f"injected fault ({method})")
+
+            return impl(request)
+        except _RpcError as e:
+            st["errors"] += 1
+            await context.abort(e.code, e.details)
+        finally:
+            ms = (time.monotonic() - t0) * 1000
+            st["total_ms"] += ms
+            st["max_ms"] = max(st["max_ms"], ms)
+
+    def stats(self) -> dict:
+        out = {}
+        for method, st in sorted(self._stats.items()):
+            out[method] = {
+                "calls": st["calls"], "errors": st["errors"], "injected": st["injected"],
+                "avg_ms": round(st["total_ms"] / st["calls"], 3) if st["calls"] else 0.0,
+                "max_ms": round(st["max_ms"], 3),
+            }
+        out["_objects"] = {
+            "tenants": len(self.tenants), "applications": len(self.applications),
+            "devices": len(self.devices), "device_profiles": len(self.device_profiles),
+            "templates": len(self.templates), "gateways": len(self.gateways),
+        }
+        return out
+
+    def reset_stats(self):
+        self._stats.clear()
+
+    # ── helpers de estado ─────────────────────────
+    def _get(self, table: dict, key: str, what: str) -> _Record:
+        rec = table.get(key)
+        if rec is None:
+            raise _not_found(what, key)
+        return rec
+
+    def _delete_tenant(self, tenant_id: str):
+        for app_id in [k for k, r in self.applications.items() if r.obj.tenant_id == tenant_id]:
+            self._delete_application(app_id)
+        for table in (self.device_profiles, self.gateways):
+            for key in [k for k, r in table.items() if r.obj.tenant_id == tenant_id]:
+                del table[key]
+        del self.tenants[tenant_id]
+
+    def _delete_application(self, app_id: str):
+        for dev_eui in [k for k, r in self.devices.items() if r.obj.application_id == app_id]:
+            self.devices.pop(dev_eui, None)
+            self.device_keys.pop(dev_eui, None)
+        del self.applications[app_id]
+
+
+def _rpc(fn):
+    """Envuelve la implementación síncrona con latencia/errores/contadores."""
+    @functools.wraps(fn)
+    async def wrapper(self, request, context):
+        return await self.fake.handle(f"{self.SERVICE}/{fn.__name__}", functools.partial(fn, self), request, context)
+    return wrapper
+
+
+class _Servicer:
+    SERVICE = ""
+
+    def __init__(self, fake: FakeChirpstack):
+        self.fake = fake
+
+
+# ────────────────────────────────────────────────
+# 🏢 Tenants / Applications
+# ────────────────────────────────────────────────
+class TenantServicer(_Servicer, api.TenantServiceServicer):
+    SERVICE = "TenantService"
+
+    @_rpc
+    def Create(self, request):
+        tenant = api.Tenant()
+        tenant.CopyFrom(request.tenant)
+        tenant.id = str(uuid.uuid4())
+        self.fake.tenants[tenant.id] = _Record(tenant)
+        return api.CreateTenantResponse(id=tenant.id)
+
+    @_rpc
+    def Get(self, request):
+        rec = self.fake._get(self.fake.tenants, request.id, "tenant")
+        return api.GetTenantResponse(tenant=rec.obj, created_at=rec.created_at, updated_at=rec.updated_at)
+
+    @_rpc
+    def Update(self, request):
+        rec = self.fake._get(self.fake.tenants, request.tenant.id, "tenant")
+        rec.touch(request.tenant)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def Delete(self, request):
+        self.fake._get(self.fake.tenants, request.id, "tenant")
+        self.fake._delete_tenant(request.id)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def List(self, request):
+        total, page = _page(list(self.fake.tenants.values()), request)
+        return api.ListTenantsResponse(total_count=total, result=[
+            api.TenantListItem(
+                id=r.obj.id, name=r.obj.name, created_at=r.created_at, updated_at=r.updated_at,
+                can_have_gateways=r.obj.can_have_gateways, max_gateway_count=r.obj.max_gateway_count,
+                max_device_count=r.obj.max_device_count,
+            ) for r in page
+        ])
+
+
+class ApplicationServicer(_Servicer, api.ApplicationServiceServicer):
+    SERVICE = "ApplicationService"
+
+    @_rpc
+    def Create(self, request):
+        self.fake._get(self.fake.tenants, request.application.tenant_id, "tenant")
+        app = api.Application()
+        app.CopyFrom(request.application)
+        app.id = str(uuid.uuid4())
+        self.fake.applications[app.id] = _Record(app)
+        return api.CreateApplicationResponse(id=app.id)
+
+    @_rpc
+    def Get(self, request):
+        rec = self.fake._get(self.fake.applications, request.id, "application")
+        return api.GetApplicationResponse(application=rec.obj, created_at=rec.created_at, updated_at=rec.updated_at)
+
+    @_rpc
+    def Update(self, request):
+        rec = self.fake._get(self.fake.applications, request.application.id, "application")
+        rec.touch(request.application)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def Delete(self, request):
+        self.fake._get(self.fake.applications, request.id, "application")
+        self.fake._delete_application(request.id)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def List(self, request):
+        apps = [r for r in self.fake.applications.values()
+                if not request.tenant_id or r.obj.tenant_id == request.tenant_id]
+        total, page = _page(apps, request)
+        return api.ListApplicationsResponse(total_count=total, result=[
+            api.ApplicationListItem(id=r.obj.id, name=r.obj.name, description=r.obj.description,
+                                    created_at=r.created_at, updated_at=r.updated_at)
+            for r in page
+        ])
+
+
+# ────────────────────────────────────────────────
+# 📟 Devices (+ keys)
+# ────────────────────────────────────────────────
+class DeviceServicer(_Servicer, api.DeviceServiceServicer):
+    SERVICE = "DeviceService"
+
+    @_rpc
+    def Create(self, request):
+        dev = api.Device()
+        dev.CopyFrom(request.device)
+        dev.dev_eui = _eui(dev.dev_eui)
+        self.fake._get(self.fake.applications, dev.application_id, "application")
+        self.fake._get(self.fake.device_profiles, dev.device_profile_id, "device_profile")
+        if dev.dev_eui in self.fake.devices:
+            raise _RpcError(grpc.StatusCode.ALREADY_EXISTS, f"Object already exists (dev_eui={dev.dev_eui})")
+        self.fake.devices[dev.dev_eui] = _Record(dev)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def Get(self, request):
+        rec = self.fake._get(self.fake.devices, _eui(request.dev_eui), "device")
+        return api.GetDeviceResponse(device=rec.obj, created_at=rec.created_at, updated_at=rec.updated_at)
+
+    @_rpc
+    def Update(self, request):
+        rec = self.fake._get(self.fake.devices, _eui(request.device.dev_eui), "device")
+        dev = api.Device()
+        dev.CopyFrom(request.device)
+        dev.dev_eui = rec.obj.dev_eui
+        rec.touch(dev)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def Delete(self, request):
+        dev_eui = _eui(request.dev_eui)
+        self.fake._get(self.fake.devices, dev_eui, "device")
+        del self.fake.devices[dev_eui]
+        self.fake.device_keys.pop(dev_eui, None)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def List(self, request):
+        self.fake._get(self.fake.applications, request.application_id, "application")
+        devs = [r for r in self.fake.devices.values()
+                if r.obj.application_id == request.application_id
+                and (not request.device_profile_id or r.obj.device_profile_id == request.device_profile_id)]
+        total, page = _page(devs, request)
+        profiles = self.fake.device_profiles
+        return api.ListDevicesResponse(total_count=total, result=[
+            api.DeviceListItem(
+                dev_eui=r.obj.dev_eui, name=r.obj.name, description=r.obj.description,
+                device_profile_id=r.obj.device_profile_id,
+                device_profile_name=profiles[r.obj.device_profile_id].name if r.obj.device_profile_id in profiles else "",
+                created_at=r.created_at, updated_at=r.updated_at, tags=dict(r.obj.tags),
+            ) for r in page
+        ])
+
+    @_rpc
+    def CreateKeys(self, request):
+        dev_eui = _eui(request.device_keys.dev_eui)
+        self.fake._get(self.fake.devices, dev_eui, "device")
+        if dev_eui in self.fake.device_keys:
+            raise _RpcError(grpc.StatusCode.ALREADY_EXISTS, f"Object already exists (device_keys={dev_eui})")
+        keys = api.DeviceKeys()
+        keys.CopyFrom(request.device_keys)
+        keys.dev_eui = dev_eui
+        self.fake.device_keys[dev_eui] = _Record(keys)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def GetKeys(self, request):
+        rec = self.fake._get(self.fake.device_keys, _eui(request.dev_eui), "device_keys")
+        return api.GetDeviceKeysResponse(device_keys=rec.obj, created_at=rec.created_at, updated_at=rec.updated_at)
+
+    @_rpc
+    def UpdateKeys(self, request):
+        dev_eui = _eui(request.device_keys.dev_eui)
+        rec = self.fake._get(self.fake.device_keys, dev_eui, "device_keys")
+        rec.touch(request.device_keys)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def DeleteKeys(self, request):
+        dev_eui = _eui(request.dev_eui)
+        self.fake._get(self.fake.device_keys, dev_eui, "device_keys")
+        del self.fake.device_keys[dev_eui]
+        return empty_pb2.Empty()
+
+
+# ────────────────────────────────────────────────
+# 🧬 Device profiles / templates
+# ────────────────────────────────────────────────
+class DeviceProfileServicer(_Servicer, api.DeviceProfileServiceServicer):
+    SERVICE = "DeviceProfileService"
+
+    @_rpc
+    def Create(self, request):
+        self.fake._get(self.fake.tenants, request.device_profile.tenant_id, "tenant")
+        dp = api.DeviceProfile()
+        dp.CopyFrom(request.device_profile)
+        dp.id = str(uuid.uuid4())
+        self.fake.device_profiles[dp.id] = _Record(dp)
+        return api.CreateDeviceProfileResponse(id=dp.id)
+
+    @_rpc
+    def Get(self, request):
+        rec = self.fake._get(self.fake.device_profiles, request.id, "device_profile")
+        return api.GetDeviceProfileResponse(device_profile=rec.obj, created_at=rec.created_at, updated_at=rec.updated_at)
+
+    @_rpc
+    def Update(self, request):
+        rec = self.fake._get(self.fake.device_profiles, request.device_profile.id, "device_profile")
+        rec.touch(request.device_profile)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def Delete(self, request):
+        self.fake._get(self.fake.device_profiles, request.id, "device_profile")
+        if any(r.obj.device_profile_id == request.id for r in self.fake.devices.values()):
+            raise _RpcError(grpc.StatusCode.FAILED_PRECONDITION, "Device profile still in use by devices")
+        del self.fake.device_profiles[request.id]
+        return empty_pb2.Empty()
+
+    @_rpc
+    def List(self, request):
+        dps = [r for r in self.fake.device_profiles.values()
+               if not request.tenant_id or r.obj.tenant_id == request.tenant_id]
+        total, page = _page(dps, request)
+        return api.ListDeviceProfilesResponse(total_count=total, result=[
+            api.DeviceProfileListItem(
+                id=r.obj.id, name=r.obj.name, region=r.obj.region, mac_version=r.obj.mac_version,
+                reg_params_revision=r.obj.reg_params_revision, supports_otaa=r.obj.supports_otaa,
+                supports_class_b=r.obj.supports_class_b, supports_class_c=r.obj.supports_class_c,
+                created_at=r.created_at, updated_at=r.updated_at,
+            ) for r in page
+        ])
+
+
+class DeviceProfileTemplateServicer(_Servicer, api.DeviceProfileTemplateServiceServicer):
+    SERVICE = "DeviceProfileTemplateService"
+
+    @_rpc
+    def Create(self, request):
+        tpl = request.device_profile_template
+        if not tpl.id:
+            raise _RpcError(grpc.StatusCode.INVALID_ARGUMENT, "template id is required")
+        if tpl.id in self.fake.templates:
+            raise _RpcError(grpc.StatusCode.ALREADY_EXISTS, f"Object already exists (template={tpl.id})")
+        self.fake.templates[tpl.id] = _Record(tpl)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def Get(self, request):
+        rec = self.fake._get(self.fake.templates, request.id, "device_profile_template")
+        return api.GetDeviceProfileTemplateResponse(
+            device_profile_template=rec.obj, created_at=rec.created_at, updated_at=rec.updated_at)
+
+    @_rpc
+    def Update(self, request):
+        rec = self.fake._get(self.fake.templates, request.device_profile_template.id, "device_profile_template")
+        rec.touch(request.device_profile_template)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def Delete(self, request):
+        self.fake._get(self.fake.templates, request.id, "device_profile_template")
+        del self.fake.templates[request.id]
+        return empty_pb2.Empty()
+
+    @_rpc
+    def List(self, request):
+        total, page = _page(list(self.fake.templates.values()), request)
+        return api.ListDeviceProfileTemplatesResponse(total_count=total, result=[
+            api.DeviceProfileTemplateListItem(
+                id=r.obj.id, name=r.obj.name, vendor=r.obj.vendor, firmware=r.obj.firmware,
+                region=r.obj.region, mac_version=r.obj.mac_version, reg_params_revision=r.obj.reg_params_revision,
+                supports_otaa=r.obj.supports_otaa, supports_class_b=r.obj.supports_class_b,
+                supports_class_c=r.obj.supports_class_c, created_at=r.created_at, updated_at=r.updated_at,
+            ) for r in page
+        ])
+
+
+# ────────────────────────────────────────────────
+# 📡 Gateways
+# ────────────────────────────────────────────────
+class GatewayServicer(_Servicer, api.GatewayServiceServicer):
+    SERVICE = "GatewayService"
+
+    @_rpc
+    def Create(self, request):
+        gw = api.Gateway()
+        gw.CopyFrom(request.gateway)
+        gw.gateway_id = _eui(gw.gateway_id)
+        tenant = self.fake._get(self.fake.tenants, gw.tenant_id, "tenant")
+        if not tenant.obj.can_have_gateways:
+            raise _RpcError(grpc.StatusCode.FAILED_PRECONDITION, "Tenant can not have gateways")
+        if gw.gateway_id in self.fake.gateways:
+            raise _RpcError(grpc.StatusCode.ALREADY_EXISTS, f"Object already exists (gateway_id={gw.gateway_id})")
+        self.fake.gateways[gw.gateway_id] = _Record(gw)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def Get(self, request):
+        rec = self.fake._get(self.fake.gateways, _eui(request.gateway_id), "gateway")
+        return api.GetGatewayResponse(gateway=rec.obj, created_at=rec.created_at, updated_at=rec.updated_at)
+
+    @_rpc
+    def Update(self, request):
+        rec = self.fake._get(self.fake.gateways, _eui(request.gateway.gateway_id), "gateway")
+        gw = api.Gateway()
+        gw.CopyFrom(request.gateway)
+        gw.gateway_id = rec.obj.gateway_id
+        rec.touch(gw)
+        return empty_pb2.Empty()
+
+    @_rpc
+    def Delete(self, request):
+        gateway_id = _eui(request.gateway_id)
+        self.fake._get(self.fake.gateways, gateway_id, "gateway")
+        del self.fake.gateways[gateway_id]
+        return empty_pb2.Empty()
+
+    @_rpc
+    def List(self, request):
+        gws = [r for r in self.fake.gateways.values()
+               if not request.tenant_id or r.obj.tenant_id == request.tenant_id]
+        total, page = _page(gws, request)
+        return api.ListGatewaysResponse(total_count=total, result=[
+            api.GatewayListItem(
+                tenant_id=r.obj.tenant_id, gateway_id=r.obj.gateway_id, name=r.obj.name,
+                description=r.obj.description, location=r.obj.location,
+                created_at=r.created_at, updated_at=r.updated_at,
+            ) for r in page
+        ])
+
+
+_SERVICERS = [
+    (TenantServicer, api.add_TenantServiceServicer_to_server),
+    (ApplicationServicer, api.add_ApplicationServiceServicer_to_server),
+    (DeviceServicer, api.add_DeviceServiceServicer_to_server),
+    (DeviceProfileServicer, api.add_DeviceProfileServiceServicer_to_server),
+    (DeviceProfileTemplateServicer, api.add_DeviceProfileTemplateServiceServicer_to_server),
+    (GatewayServicer, api.add_GatewayServiceServicer_to_server),
+]
+
+
+def build_server(fake: FakeChirpstack, address: str) -> tuple[grpc.aio.Server, int]:
+    """Servidor grpc.aio con todos los servicers; devuelve (server, puerto real)."""
+    server = grpc.aio.server()
+    for servicer_cls, add in _SERVICERS:
+        add(servicer_cls(fake), server)
+    port = server.add_insecure_port(address)
+    return server, port
+
+
+async def serve_forever(fake: FakeChirpstack, address: str, stats_interval: float):
+    # handlers antes de anunciar el puerto: quien nos lanzó puede mandar SIGTERM enseguida
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    server, port = build_server(fake, address)
+    await server.start()
+    print(f"🟢 Fake ChirpStack escuchando en {address.rsplit(':', 1)[0]}:{port}", flush=True)
+
+    async def _report():
+        while True:
+            await asyncio.sleep(stats_interval)
+            print(f"📊 Fake ChirpStack: {json.dumps(fake.stats())}", flush=True)
+
+    reporter = asyncio.create_task(_report()) if stats_interval > 0 else None
+    await stop.wait()
+    if reporter:
+        reporter.cancel()
+    await server.stop(1)
+    # última línea = stats en JSON (la lee FakeChirpstackServer.stop)
+    try:
+        print(json.dumps(fake.stats()), flush=True)
+    except BrokenPipeError:
+        pass
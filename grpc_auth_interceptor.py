@@ -12,3 +12,20 @@ class ApiKeyAuthInterceptor(grpc.UnaryUnaryClientInterceptor):
 
         client_call_details = client_call_details._replace(metadata=metadata)
         return continuation(client_call_details, request)
+
+
+class AsyncApiKeyAuthInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    """Versión grpc.aio: agrega el Bearer a cada llamada unaria."""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        metadata = grpc.aio.Metadata()
+        if client_call_details.metadata is not None:
+            for key, value in client_call_details.metadata:
+                metadata.add(key, value)
+        metadata.add("authorization", f"Bearer {self.api_key}")
+
+        client_call_details = client_call_details._replace(metadata=metadata)
+        return await continuation(client_call_details, request)
@@ -1,29 +1,43 @@
 # gw_sidecar.py
-import os, json, argparse, grpc
+import os, sys, json, argparse, grpc
+from concurrent.futures import ThreadPoolExecutor
 from grpc_auth_interceptor import ApiKeyAuthInterceptor
+from tracing import rpc_trace_interceptors
 
 # Usamos el paquete oficial SOLO aquí
 from chirpstack_api.api import gateway_pb2 as gw_pb2
 from chirpstack_api.api import gateway_pb2_grpc as gw_pb2_grpc
 
+_CHANNEL = None
+
 def _channel():
+    # Memoizado: en modo serve el canal se reutiliza entre comandos
+    global _CHANNEL
+    if _CHANNEL is not None:
+        return _CHANNEL
     addr = os.getenv("CHIRPSTACK_GRPC_ADDRESS", "localhost:8080")
     apikey = os.getenv("CHIRPSTACK_API_KEY")
     if not apikey:
         raise RuntimeError("CHIRPSTACK_API_KEY missing")
-    return grpc.intercept_channel(
+    _CHANNEL = grpc.intercept_channel(
         grpc.insecure_channel(addr),
         ApiKeyAuthInterceptor(apikey),
+        *rpc_trace_interceptors(),  # spans gRPC hijos del traceparent del API
     )
+    return _CHANNEL
 
-def list_gateways(limit=1, tenant_id=""):
+def list_gateways(limit=1, tenant_id="", offset=0):
     ch = _channel()
     stub = gw_pb2_grpc.GatewayServiceStub(ch)
-    req = gw_pb2.ListGatewaysRequest(limit=limit)
+    req = gw_pb2.ListGatewaysRequest(limit=limit, offset=offset)
     if tenant_id:
         req.tenant_id = tenant_id
     resp = stub.List(req)
-    return {"ok": True, "total_count": getattr(resp, "total_count", None)}
+    items = [{
+        "gateway_id": (g.gateway_id or "").upper(), "name": g.name,
+        "description": g.description, "tenant_id": g.tenant_id,
+    } for g in resp.result]
+    return {"ok": True, "total_count": getattr(resp, "total_count", None), "items": items}
 
 def _parse_tags(tags_str: str | None) -> dict:
     if not tags_str:
@@ -61,6 +75,43 @@ def create_gateway(gateway_id: str, name: str, tenant_id: str, description: str
     stub.Create(req)
     return {"ok": True, "gateway_id": gateway_id.upper(), "tenant_id": tenant_id}
 
+def create_gateways_batch(tenant_id: str, items: list[dict], concurrency: int = 8):
+    """
+    Crea varios gateways del mismo tenant sobre un solo canal, con `concurrency`
+    RPCs en paralelo. Devuelve un resultado por item (no corta en el primer error).
+    """
+    if not tenant_id:
+        return {"ok": False, "error": "tenant_id es obligatorio"}
+    if not isinstance(items, list) or not all(isinstance(i, dict) and i.get("gateway_id") for i in items):
+        return {"ok": False, "error": "items debe ser una lista de objetos con gateway_id"}
+
+    stub = gw_pb2_grpc.GatewayServiceStub(_channel())
+
+    def _one(item):
+        gateway_id = item["gateway_id"].upper()
+        try:
+            stub.Create(gw_pb2.CreateGatewayRequest(
+                gateway=gw_pb2.Gateway(
+                    gateway_id=gateway_id,
+                    name=item.get("name") or gateway_id,
+                    description=item.get("description") or "",
+                    tenant_id=tenant_id,
+                    tags={str(k): str(v) for k, v in (item.get("tags") or {}).items()},
+                )
+            ))
+            return {"gateway_id": gateway_id, "ok": True}
+        except grpc.RpcError as e:
+            return {"gateway_id": gateway_id, "ok": False, "error": f"gRPC {e.code().name}: {e.details()}"}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        results = list(ex.map(_one, items))
+    return {
+        "ok": True,
+        "tenant_id": tenant_id,
+        "created": sum(1 for r in results if r["ok"]),
+        "results": results,
+    }
+
 def delete_gateway(gateway_id: str):
     import re
     gateway_id = (gateway_id or "").strip().upper()
@@ -84,13 +135,37 @@ def delete_gateway(gateway_id: str):
             detail = "Timeout al contactar ChirpStack"
         return {"ok": False, "error": f"gRPC {code}: {detail}"}
 
-def main():
+def delete_gateways_batch(gateway_ids: list[str], concurrency: int = 8):
+    """
+    Borra varios gateways (compensación de un alta masiva que no llegó a Mongo).
+    NOT_FOUND cuenta como borrado: la operación es idempotente.
+    """
+    if not isinstance(gateway_ids, list) or not all(isinstance(g, str) and g for g in gateway_ids):
+        return {"ok": False, "error": "gateway_ids debe ser una lista de gateway_id"}
+
+    stub = gw_pb2_grpc.GatewayServiceStub(_channel())
+
+    def _one(gateway_id):
+        gateway_id = gateway_id.upper()
+        try:
+            stub.Delete(gw_pb2.DeleteGatewayRequest(gateway_id=gateway_id), timeout=5)
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.NOT_FOUND:
+                return {"gateway_id": gateway_id, "ok": False, "error": f"gRPC {e.code().name}: {e.details()}"}
+        return {"gateway_id": gateway_id, "ok": True}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        results = list(ex.map(_one, gateway_ids))
+    return {"ok": True, "deleted": sum(1 for r in results if r["ok"]), "results": results}
+
+def run(argv: list[str]) -> dict:
     p = argparse.ArgumentParser(prog="gw_sidecar", description="Gateway sidecar (safe cmds)")
     sub = p.add_subparsers(dest="cmd", required=True)
 
     p_list = sub.add_parser("list")
     p_list.add_argument("--limit", type=int, default=1)
     p_list.add_argument("--tenant-id", default="")
+    p_list.add_argument("--offset", type=int, default=0)
 
     p_create = sub.add_parser("create")
     p_create.add_argument("--gateway-id", required=True)
@@ -99,14 +174,23 @@ def main():
     p_create.add_argument("--description", default="")
     p_create.add_argument("--tags", default="", help="k1=v1,k2=v2")
     
+    p_batch = sub.add_parser("create-batch")
+    p_batch.add_argument("--tenant-id", required=True)
+    p_batch.add_argument("--items-json", required=True, help='[{"gateway_id","name","description","tags"}]')
+    p_batch.add_argument("--concurrency", type=int, default=8)
+
     p_delete = sub.add_parser("delete")
     p_delete.add_argument("--gateway-id", required=True)
 
-    args = p.parse_args()
+    p_del_batch = sub.add_parser("delete-batch")
+    p_del_batch.add_argument("--gateway-ids-json", required=True, help='["<gateway_id>", ...]')
+    p_del_batch.add_argument("--concurrency", type=int, default=8)
+
+    args = p.parse_args(argv)
 
     try:
         if args.cmd == "list":
-            out = list_gateways(limit=args.limit, tenant_id=args.tenant_id)
+            out = list_gateways(limit=args.limit, tenant_id=args.tenant_id, offset=args.offset)
         elif args.cmd == "create":
             out = create_gateway(
                 gateway_id=args.gateway_id,
@@ -115,8 +199,19 @@ def main():
                 description=args.description,
                 tags_str=args.tags,
             )
+        elif args.cmd == "create-batch":
+            out = create_gateways_batch(
+                tenant_id=args.tenant_id,
+                items=json.loads(args.items_json),
+                concurrency=args.concurrency,
+            )
         elif args.cmd == "delete":
             out = delete_gateway(gateway_id=args.gateway_id)
+        elif args.cmd == "delete-batch":
+            out = delete_gateways_batch(
+                gateway_ids=json.loads(args.gateway_ids_json),
+                concurrency=args.concurrency,
+            )
         else:
             out = {"ok": False, "error": f"unknown cmd {args.cmd}"}
     
@@ -127,7 +222,16 @@ def main():
     except Exception as e:
         out = {"ok": False, "error": str(e)}
 
-    print(json.dumps(out))
+    return out
+
+def main():
+    # python -m gw_sidecar serve → worker persistente (JSON-lines por stdin/stdout)
+    if sys.argv[1:2] == ["serve"]:
+        from sidecars.serve import serve_forever
+        serve_forever(run)
+        return
+    from sidecars.serve import run_cli
+    run_cli(run, sys.argv[1:])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
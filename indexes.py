@@ -0,0 +1,188 @@
+# indexes.py
+# Registro declarativo de índices de Mongo: cada consulta de crud.py / iotaas.py /
+# reconcile.py tiene aquí el índice que la respalda.
+#
+# - INDEXES: lista de specs {collection, keys, name, unique, partial}. Los índices de
+#   telemetría, rollups y jobs se toman de sus módulos (una sola definición).
+# - apply_indexes() compara cada spec con index_information() y crea solo lo que
+#   falta; las colecciones se procesan en paralelo (asyncio.gather), los índices de
+#   una misma colección en serie (evita builds simultáneos sobre la misma colección).
+# - dry_run=True no escribe nada: reporta qué crearía y, para los únicos, cuántas
+#   claves duplicadas impedirían crearlo.
+# - Un índice existente con el mismo nombre pero otra definición se reporta como
+#   "conflict" y NO se toca (borrarlo es decisión manual).
+#
+# Estados por índice: exists | created | would_create | conflict | error
+#
+# CLI:
+#   python -m indexes [--dry-run]
+#
+# ENV:
+#   INDEX_BOOTSTRAP   background = el lifespan aplica el registro en un task (default)
+#                     sync       = el lifespan espera a que terminen los builds
+#                     off        = no se aplica al arrancar (usar el CLI)
+import asyncio, json, os, sys
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from telemetry import TELEMETRY_INDEXES, TELEMETRY_COLLECTION
+from rollups import ROLLUP_INDEXES, ROLLUP_SECONDS, ROLLUPS_ENABLED, rollup_collection_name
+from jobs import JOB_INDEXES
+
+INDEX_BOOTSTRAP = os.getenv("INDEX_BOOTSTRAP", "background").lower()
+
+
+def _spec(collection: str, keys, name: str, unique: bool = False, partial: dict | None = None) -> dict:
+    return {"collection": collection, "keys": list(keys), "name": name, "unique": unique, "partial": partial}
+
+
+INDEXES = [
+    # devices: gateways/sensores por tenant; el prefijo tenant_id sirve a los
+    # count_documents / find por tenant y al dedupe {tenant_id, dev_eui $in}
+    _spec("devices", [("tenant_id", ASCENDING), ("type", ASCENDING), ("dev_eui", ASCENDING)],
+          "uniq_tenant_type_dev_eui", unique=True),
+    _spec("devices", [("tenant_id", ASCENDING), ("dev_eui", ASCENDING)], "tenant_dev_eui"),
+    # device_registry resuelve dev_eui → device en cada uplink
+    _spec("devices", [("dev_eui", ASCENDING)], "dev_eui"),
+    _spec("tenants", [("owner_uid", ASCENDING)], "owner_uid"),
+    _spec("users", [("uid", ASCENDING)], "uid_unique", unique=True),
+    _spec("alerts", [("tenant_id", ASCENDING)], "tenant_id"),
+    _spec("devicekeys", [("type", ASCENDING)], "type"),
+    # mismo nombre que el create_index("name", unique=True) histórico de /_dp_cache_install
+    _spec("dp_templates_cache", [("name", ASCENDING)], "name_1", unique=True),
+    _spec("device_profiles", [("tenant_id", ASCENDING), ("model", ASCENDING)],
+          "tenant_model_unique", unique=True),
+    # jobs: cola (status, run_after), find_active y el único parcial de enqueue_unique
+    *(_spec("jobs", keys, name, opts.get("unique", False), opts.get("partialFilterExpression"))
+      for keys, name, opts in JOB_INDEXES),
+    # mqtt_data ya debe existir como time-series (telemetry.ensure_telemetry_collection)
+    *(_spec(TELEMETRY_COLLECTION, keys, name) for keys, name in TELEMETRY_INDEXES),
+]
+
+if ROLLUPS_ENABLED:
+    INDEXES += [
+        _spec(rollup_collection_name(interval), keys, name, unique=opts.get("unique", False))
+        for interval in ROLLUP_SECONDS
+        for keys, name, opts in ROLLUP_INDEXES
+    ]
+
+
+def _key_tuple(keys) -> tuple:
+    # index_information() puede devolver 1.0 en vez de 1 según la versión del server
+    return tuple((k, int(d) if isinstance(d, (int, float)) else d) for k, d in keys)
+
+
+def _same_keys(info: dict, spec: dict) -> bool:
+    return (_key_tuple(info.get("key", [])) == _key_tuple(spec["keys"])
+            and bool(info.get("unique")) == spec["unique"]
+            and (info.get("partialFilterExpression") or None) == spec.get("partial"))
+
+
+async def _count_duplicates(collection, spec: dict) -> int:
+    """Grupos de claves repetidas que harían fallar un índice único."""
+    group_id = {k.replace(".", "_"): f"${k}" for k, _ in spec["keys"]}
+    pipeline = [{"$match": spec["partial"]}] if spec.get("partial") else []
+    pipeline += [
+        {"$group": {"_id": group_id, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+        {"$count": "dups"},
+    ]
+    async for doc in collection.aggregate(pipeline, allowDiskUse=True):
+        return doc.get("dups", 0)
+    return 0
+
+
+async def _apply_collection(db, name: str, specs: list[dict], dry_run: bool) -> list[dict]:
+    coll = db[name]
+    report = []
+    try:
+        existing = await coll.index_information()
+    except PyMongoError as e:
+        return [{**_report_key(s), "status": "error", "error": str(e)} for s in specs]
+
+    by_keys = {_key_tuple(info.get("key", [])): idx_name for idx_name, info in existing.items()}
+    for spec in specs:
+        entry = _report_key(spec)
+        info = existing.get(spec["name"])
+        try:
+            if info is not None:
+                if _same_keys(info, spec):
+                    entry["status"] = "exists"
+                else:
+                    entry.update(status="conflict", error=f"'{spec['name']}' existe con otra definición: {info.get('key')}")
+            elif _key_tuple(spec["keys"]) in by_keys:
+                # misma clave con otro nombre: Mongo rechazaría el duplicado
+                entry.update(status="conflict", error=f"misma clave ya indexada como '{by_keys[_key_tuple(spec['keys'])]}'")
+            elif dry_run:
+                entry["status"] = "would_create"
+                if spec["unique"]:
+                    entry["duplicates"] = await _count_duplicates(coll, spec)
+            else:
+                opts = {"partialFilterExpression": spec["partial"]} if spec.get("partial") else {}
+                await coll.create_index(spec["keys"], name=spec["name"], unique=spec["unique"], background=True, **opts)
+                entry["status"] = "created"
+        except PyMongoError as e:
+            entry.update(status="error", error=str(e))
+        report.append(entry)
+    return report
+
+
+def _report_key(spec: dict) -> dict:
+    return {"collection": spec["collection"], "name": spec["name"], "unique": spec["unique"]}
+
+
+async def apply_indexes(db, specs: list[dict] | None = None, dry_run: bool = False) -> dict:
+    """Aplica (o simula con dry_run) el registro. Devuelve {"ok", "summary", "indexes"}."""
+    specs = INDEXES if specs is None else specs
+    grouped: dict[str, list[dict]] = {}
+    for spec in specs:
+        grouped.setdefault(spec["collection"], []).append(spec)
+
+    results = await asyncio.gather(*(
+        _apply_collection(db, name, coll_specs, dry_run) for name, coll_specs in grouped.items()
+    ))
+    report = [entry for coll_report in results for entry in coll_report]
+    summary: dict[str, int] = {}
+    for entry in report:
+        summary[entry["status"]] = summary.get(entry["status"], 0) + 1
+    ok = not any(entry["status"] in ("error", "conflict") for entry in report)
+    return {"ok": ok, "dry_run": dry_run, "summary": summary, "indexes": report}
+
+
+async def bootstrap_indexes(db) -> dict:
+    """Versión para el lifespan: imprime el resumen y los problemas, nunca lanza."""
+    try:
+        result = await apply_indexes(db)
+    except Exception as e:
+        print(f"[BOOT] indexes ERROR: {e}")
+        return {"ok": False, "error": str(e)}
+    print(f"[BOOT] indexes: {json.dumps(result['summary'])}")
+    for entry in result["indexes"]:
+        if entry["status"] in ("error", "conflict"):
+            print(f"⚠️  Índice {entry['collection']}.{entry['name']}: {entry['status']} — {entry.get('error')}")
+    return result
+
+
+async def _main(dry_run: bool):
+    from db import db
+    if not dry_run:
+        # crear un índice sobre mqtt_data inexistente la crearía como colección normal
+        from telemetry import ensure_telemetry_collection
+        await ensure_telemetry_collection(db)
+    result = await apply_indexes(db, dry_run=dry_run)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return result
+
+
+def main():
+    args = sys.argv[1:]
+    if any(a not in ("--dry-run",) for a in args):
+        print("uso: python -m indexes [--dry-run]")
+        sys.exit(2)
+    result = asyncio.run(_main("--dry-run" in args))
+    sys.exit(0 if result["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
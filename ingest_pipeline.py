@@ -0,0 +1,161 @@
+# ingest_pipeline.py
+# Pipeline asyncio por etapas para la ingesta MQTT:
+#
+#   receive ──raw_q──▶ decode/validate ──decoded_q──▶ enrich ──▶ write (BatchWriter)
+#
+# Cada etapa corre en su propio task y se conecta con colas acotadas, así un Mongo
+# lento solo llena colas (backpressure hasta el consumidor MQTT) en vez de
+# bloquear el loop. Cada etapa lleva contadores de procesados/descartados/errores,
+# latencia y profundidad de su cola de entrada (ver stats()). Los errores se
+# imprimen la primera vez por etapa y tipo, y luego uno de cada _ERROR_LOG_EVERY.
+#
+# ENV:
+#   INGEST_QUEUE_SIZE        tamaño de cada cola entre etapas (default 5000)
+#   INGEST_STATS_INTERVAL_S  cada cuánto se imprime stats() (default 60, 0 = nunca)
+import asyncio, json, os, time
+
+from telemetry import to_document
+
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "5000"))
+INGEST_STATS_INTERVAL_S = float(os.getenv("INGEST_STATS_INTERVAL_S", "60"))
+
+_ERROR_LOG_EVERY = 1000
+
+
+class StageStats:
+    __slots__ = ("processed", "dropped", "errors", "latency_sum", "latency_max")
+
+    def __init__(self):
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def observe(self, seconds: float):
+        self.processed += 1
+        self.latency_sum += seconds
+        if seconds > self.latency_max:
+            self.latency_max = seconds
+
+    def as_dict(self) -> dict:
+        avg = self.latency_sum / self.processed if self.processed else 0.0
+        return {
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "avg_ms": round(avg * 1000, 3),
+            "max_ms": round(self.latency_max * 1000, 3),
+        }
+
+
+class IngestPipeline:
+    def __init__(self, registry, writer, queue_size: int = INGEST_QUEUE_SIZE):
+        self.registry = registry
+        self.writer = writer
+        self.raw_q: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.decoded_q: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.stages = {name: StageStats() for name in ("receive", "decode", "enrich", "write")}
+        self.end_to_end = StageStats()  # recepción → entregado al writer
+        self._tasks: list[asyncio.Task] = []
+        self._error_counts: dict[tuple[str, str], int] = {}
+
+    def _error(self, stage: str, e: Exception):
+        self.stages[stage].errors += 1
+        key = (stage, type(e).__name__)
+        n = self._error_counts[key] = self._error_counts.get(key, 0) + 1
+        if n == 1 or n % _ERROR_LOG_EVERY == 0:
+            print(f"⚠️  Ingesta {stage}: {key[1]}: {e} (x{n})")
+
+    # ── etapas ────────────────────────────────────
+    async def receive(self, messages):
+        """Consume el iterador de aiomqtt; espera si raw_q está llena (backpressure)."""
+        st = self.stages["receive"]
+        async for message in messages:
+            t0 = time.monotonic()
+            await self.raw_q.put((str(message.topic), message.payload, t0))
+            st.observe(time.monotonic() - t0)
+
+    async def _decode(self):
+        st = self.stages["decode"]
+        while True:
+            topic, raw, t_recv = await self.raw_q.get()
+            t0 = time.monotonic()
+            try:
+                payload = json.loads(raw.decode() if isinstance(raw, (bytes, bytearray)) else raw)
+                if not isinstance(payload, dict) or not payload.get("device_eui"):
+                    # Mensaje sin device_eui, ignorado
+                    st.dropped += 1
+                    continue
+                await self.decoded_q.put((topic, payload, t_recv))
+                st.observe(time.monotonic() - t0)
+            except Exception as e:
+                self._error("decode", e)
+            finally:
+                self.raw_q.task_done()
+
+    async def _enrich(self):
+        st = self.stages["enrich"]
+        wst = self.stages["write"]
+        while True:
+            topic, payload, t_recv = await self.decoded_q.get()
+            t0 = time.monotonic()
+            try:
+                # Dispositivo registrado? (registro en memoria, sin lecturas a Mongo)
+                device = await self.registry.resolve(payload["device_eui"])
+                if not device:
+                    st.dropped += 1
+                    continue
+
+                # Esquema time-series: timestamp datetime + meta {device_eui, tenant_id}
+                doc = to_document(payload, tenant_id=device.get("tenant_id"), topic=topic)
+                st.observe(time.monotonic() - t0)
+
+                # write: encolar en el BatchWriter (espera si su cola está llena)
+                t1 = time.monotonic()
+                await self.writer.put(doc)
+                now = time.monotonic()
+                wst.observe(now - t1)
+                self.end_to_end.observe(now - t_recv)
+            except Exception as e:
+                self._error("enrich", e)
+            finally:
+                self.decoded_q.task_done()
+
+    async def _report(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            print(f"📊 Ingesta: {json.dumps(self.stats())}")
+
+    # ── ciclo de vida ─────────────────────────────
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._decode()),
+            asyncio.create_task(self._enrich()),
+        ]
+        if INGEST_STATS_INTERVAL_S > 0:
+            self._tasks.append(asyncio.create_task(self._report(INGEST_STATS_INTERVAL_S)))
+
+    async def drain(self, timeout: float = 10):
+        """Espera a que las colas intermedias se vacíen (al apagar) y detiene las etapas."""
+        async def _join():
+            await self.raw_q.join()
+            await self.decoded_q.join()
+        try:
+            await asyncio.wait_for(_join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️  Ingesta: drain incompleto, {self.raw_q.qsize() + self.decoded_q.qsize()} mensajes sin procesar")
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        out = {name: st.as_dict() for name, st in self.stages.items()}
+        out["receive"]["queue_depth"] = 0
+        out["decode"]["queue_depth"] = self.raw_q.qsize()
+        out["enrich"]["queue_depth"] = self.decoded_q.qsize()
+        out["write"]["queue_depth"] = self.writer.pending
+        out["write"].update(self.writer.stats)
+        out["end_to_end"] = self.end_to_end.as_dict()
+        return out
@@ -1,26 +1,39 @@
 
 import asyncio
 import os, grpc
-import subprocess, sys, json
+import sys, json, csv, io
 import logging
 import httpx
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, Body, Query, Depends, HTTPException, APIRouter, Path
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from bson import ObjectId
-from pymongo import MongoClient, ASCENDING
-from crud import delete_tenant_by_id
+from pymongo import ASCENDING
 from grpc_auth_interceptor import ApiKeyAuthInterceptor
 from datetime import datetime, timezone
 
 # 📦 Módulos locales
-from db import tenants_collection, devicekeys_collection, users_collection, devices_collection, dp_templates_cache_collection, device_profiles_collection
+from db import tenants_collection, devicekeys_collection, users_collection, devices_collection, dp_templates_cache_collection, device_profiles_collection, mqtt_data_collection, jobs_collection
 from middleware import FirebaseAuthMiddleware
-from crud import create_tenant, register_device, list_devices_by_tenant, trigger_alert
+from tracing import TracingMiddleware, TRACING_ENABLED, flush as flush_traces
+from metrics import MetricsMiddleware, METRICS_ENABLED, METRICS_TOKEN, CONTENT_TYPE as METRICS_CONTENT_TYPE, render as render_metrics
+from tenant_access import owned_tenant, owned_device, require_tenant, invalidate_tenant
+from profile_index import profile_index
+from indexes import INDEXES, INDEX_BOOTSTRAP, apply_indexes, bootstrap_indexes
+from jobs import JobWorker, enqueue_unique, job_to_api, JOBS_WORKER_ENABLED, default_handlers as default_job_handlers
+from crud import create_tenant, register_device, list_devices_by_tenant, trigger_alert, provision_devices_bulk, import_gateways_bulk
+from telemetry import (
+    ensure_telemetry_collection, migrate_legacy_telemetry, to_api, TELEMETRY_MIGRATE,
+    fetch_page, parse_time_param, MAX_PAGE_SIZE, iter_export, gzip_stream, aggregate_buckets,
+    default_window, INTERVALS,
+)
+from rollups import rollup_buckets, can_serve as rollups_can_serve
 from models import TenantModel, DeviceModel, AlertModel, UserRegisterModel
-from chirpstack_grpc import ChirpstackGRPCClient
+from chirpstack_grpc import AsyncChirpstackGRPCClient, close_aio_channel
+from sidecar_pool import close_pools
+from sidecar_runner import run_sidecar, http_status_for, GW_SIDECAR, DP_SIDECAR
 from routers.device_profiles_router import router as dp_router
 from routers.smoke import router as smoke_router
 
@@ -35,6 +48,9 @@ load_dotenv()
 # logger = logging.getLogger(__name__)
 # logger.info("🌐 Iniciando servicio iotaas.py...")
 
+# worker de jobs en proceso (None si JOBS_WORKER_ENABLED=0: lo corre `python -m jobs worker`)
+job_worker: JobWorker | None = None
+
 # 🌀 Lifespan: equivalente a @app.on_event("startup")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -44,19 +60,50 @@ async def lifespan(app: FastAPI):
             await asyncio.sleep(60)
     asyncio.create_task(dummy_keepalive())
 
-    # 👉 Asegura índice único (tenant_id, model)
+    # 👉 Precarga nombre → id de device profiles
     try:
-        await device_profiles_collection.create_index(
-            [("tenant_id", ASCENDING), ("model", ASCENDING)],
-            name="tenant_model_unique",
-            unique=True,
-        )
-        print("[BOOT] device_profiles index OK")
+        warmed = await profile_index.warm_from_snapshots(device_profiles_collection)
+        print(f"[BOOT] profile_index: {warmed} profiles precargados")
+    except Exception as e:
+        print(f"[BOOT] profile_index ERROR: {e}")
+
+    # 👉 Telemetría en colección time-series (+ migración en background del esquema viejo)
+    try:
+        from db import db
+        kind = await ensure_telemetry_collection(db)
+        print(f"[BOOT] mqtt_data OK ({kind})")
+        if TELEMETRY_MIGRATE:
+            asyncio.create_task(migrate_legacy_telemetry(db))
+    except Exception as e:
+        print(f"[BOOT] mqtt_data ERROR: {e}")
+
+    # 👉 Índices declarados en indexes.INDEXES (después de crear mqtt_data time-series)
+    from db import db
+    if INDEX_BOOTSTRAP == "sync":
+        await bootstrap_indexes(db)
+    elif INDEX_BOOTSTRAP != "off":
+        asyncio.create_task(bootstrap_indexes(db))
+
+    # 👉 Cola de jobs (borrado de tenants en segundo plano)
+    global job_worker
+    try:
+        if JOBS_WORKER_ENABLED:
+            job_worker = JobWorker(jobs_collection, default_job_handlers())
+            job_worker.start()
     except Exception as e:
-        print(f"[BOOT] device_profiles index ERROR: {e}")
+        print(f"[BOOT] jobs ERROR: {e}")
 
     yield  # Aquí continúa el ciclo de vida normal de FastAPI
 
+    if job_worker is not None:
+        await job_worker.stop()
+        job_worker = None
+
+    # 🧹 Apagar workers sidecar persistentes
+    await close_pools()
+    await close_aio_channel()
+    flush_traces()
+
 #debug error silencioso railway
 print("[DEBUG] yield ejecutado en lifespan")
 
@@ -83,6 +130,14 @@ app.add_middleware(
 # 🔐 Middleware de autenticación
 app.add_middleware(FirebaseAuthMiddleware)
 
+# 🧵 Trazas: span por request (Mongo, gRPC y sidecars cuelgan de él)
+if TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
+
+# 📊 Métricas: el más externo, así cuenta también los 401 del auth
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 #detección error silencio con debug
 print("[DEBUG] Middleware cargado")
 
@@ -99,13 +154,22 @@ async def ping_db():
     except Exception as e:
         return {"status": "error", "details": str(e)}
     
+# 📊 Métricas Prometheus (ruta abierta en middleware.OPEN_PATHS; METRICS_TOKEN opcional)
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 # ------ PRUEBAS SMOKE PARA VERIFICACION MANUAL ------    
 # SMOKE GATEWAY
 @app.get("/_gw_smoke", include_in_schema=False)
 async def gw_smoke():
     try:
-        c = ChirpstackGRPCClient()  # usa tus stubs locales
-        resp = c.list_tenants(limit=1)
+        c = AsyncChirpstackGRPCClient()  # usa tus stubs locales
+        resp = await c.list_tenants(limit=1)
         return {
             "ok": True,
             "checked": "tenant_list",
@@ -116,16 +180,7 @@ async def gw_smoke():
     
 @app.get("/_gw_list_sidecar", include_in_schema=False)
 async def gw_list_sidecar():
-    try:
-        proc = subprocess.run(
-            [sys.executable, "gw_sidecar.py", "list", "--limit", "1"],
-            capture_output=True, text=True, check=True
-        )
-        return json.loads(proc.stdout or "{}")
-    except subprocess.CalledProcessError as e:
-        return {"ok": False, "error": e.stderr or str(e)}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+    return await run_sidecar(GW_SIDECAR, ["list", "--limit", "1"])
     
 @app.post("/_gw_create_sidecar", include_in_schema=False)
 async def _gw_create_sidecar(body: dict):
@@ -137,7 +192,7 @@ async def _gw_create_sidecar(body: dict):
     except KeyError as e:
         return {"ok": False, "error": f"missing field: {e.args[0]}"}
 
-    args = [sys.executable, "-m", "gw_sidecar", "create",
+    args = ["create",
             "--tenant-id", tenant_id,
             "--gateway-id", gateway_id,
             "--name", name]
@@ -150,14 +205,7 @@ async def _gw_create_sidecar(body: dict):
         tag_str = ",".join(f"{k}={v}" for k, v in body["tags"].items())
         args += ["--tags", tag_str]
 
-    proc = subprocess.run(args, capture_output=True, text=True)
-    if proc.returncode != 0:
-        return {"ok": False, "error": proc.stderr or proc.stdout}
-
-    try:
-        return json.loads(proc.stdout)
-    except Exception:
-        return {"ok": False, "error": f"bad sidecar json: {proc.stdout}"}
+    return await run_sidecar(GW_SIDECAR, args)
 
 # SMOKE DEVICE PROFILE TEMPLATE
 @app.get("/_dp_smoke", include_in_schema=False)
@@ -166,8 +214,8 @@ async def dp_smoke():
     Verifica conectividad gRPC (API Key / canal). Usamos list_tenants para smoke.
     """
     try:
-        c = ChirpstackGRPCClient()
-        resp = c.list_tenants(limit=1)
+        c = AsyncChirpstackGRPCClient()
+        resp = await c.list_tenants(limit=1)
         return {
             "ok": True,
             "checked": "tenant_list",
@@ -182,18 +230,7 @@ async def dp_list_sidecar(limit: int = 5, search: str = ""):
     """
     Invoca al dp_sidecar en modo 'list' para ver templates disponibles.
     """
-    import subprocess, sys, json
-    try:
-        proc = subprocess.run(
-            [sys.executable, "-m", "dp_sidecar", "list",
-             "--limit", str(limit), "--search", search],
-            capture_output=True, text=True, check=True
-        )
-        return json.loads(proc.stdout or "{}")
-    except subprocess.CalledProcessError as e:
-        return {"ok": False, "error": e.stderr or str(e)}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+    return await run_sidecar(DP_SIDECAR, ["list", "--limit", str(limit), "--search", search])
 
 
 @app.get("/_dp_get_sidecar", include_in_schema=False)
@@ -202,23 +239,15 @@ async def dp_get_sidecar(name: str):
     Invoca al dp_sidecar en modo 'get' para traer un template completo.
     Ejemplo: /_dp_get_sidecar?name=LBM01
     """
-    import subprocess, sys, json
-    try:
-        proc = subprocess.run(
-            [sys.executable, "-m", "dp_sidecar", "get", "--name", name],
-            capture_output=True, text=True, check=True
-        )
-        return json.loads(proc.stdout or "{}")
-    except subprocess.CalledProcessError as e:
-        return {"ok": False, "error": e.stderr or str(e)}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+    return await run_sidecar(DP_SIDECAR, ["get", "--name", name])
 
 @app.post("/_dp_cache_install", include_in_schema=False)
 async def _dp_cache_install():
     """Crea índice único en la colección dp_templates_cache."""
-    await dp_templates_cache_collection.create_index("name", unique=True)
-    return {"ok": True, "index": "name_unique"}
+    specs = [s for s in INDEXES if s["collection"] == "dp_templates_cache"]
+    from db import db
+    res = await apply_indexes(db, specs)
+    return {"ok": res["ok"], "index": "name_unique", "indexes": res["indexes"]}
 
 @app.get("/_dp_cache_get", include_in_schema=False)
 async def _dp_cache_get(name: str):
@@ -228,15 +257,7 @@ async def _dp_cache_get(name: str):
     if doc:
         return {"ok": True, "source": "cache", "template": doc["template"], "updated_at": doc.get("updated_at")}
 
-    import subprocess, sys, json
-    try:
-        proc = subprocess.run(
-            [sys.executable, "-m", "dp_sidecar", "get", "--name", name],
-            capture_output=True, text=True, check=True
-        )
-        out = json.loads(proc.stdout or "{}")
-    except subprocess.CalledProcessError as e:
-        return {"ok": False, "error": e.stderr or str(e)}
+    out = await run_sidecar(DP_SIDECAR, ["get", "--name", name])
     if not out.get("ok"):
         return out
 
@@ -255,15 +276,7 @@ async def _dp_cache_refresh(body: dict = Body(...)):
     name = body.get("name")
     if not name:
         return {"ok": False, "error": "missing field: name"}
-    import subprocess, sys, json
-    try:
-        proc = subprocess.run(
-            [sys.executable, "-m", "dp_sidecar", "get", "--name", name],
-            capture_output=True, text=True, check=True
-        )
-        out = json.loads(proc.stdout or "{}")
-    except subprocess.CalledProcessError as e:
-        return {"ok": False, "error": e.stderr or str(e)}
+    out = await run_sidecar(DP_SIDECAR, ["get", "--name", name])
     if not out.get("ok"):
         return out
 
@@ -294,20 +307,12 @@ async def _dp_create_from_cache(body: dict = Body(...)):
 
     template = doc["template"]
 
-    import subprocess, sys, json
-    try:
-        proc = subprocess.run(
-            [
-                sys.executable, "-m", "dp_sidecar", "create-from-template",
-                "--tenant-id", tenant_id,
-                "--profile-name", profile_name,
-                "--template-json", json.dumps(template),
-            ],
-            capture_output=True, text=True, check=True
-        )
-        return json.loads(proc.stdout or "{}")
-    except subprocess.CalledProcessError as e:
-        return {"ok": False, "error": e.stderr or str(e)}
+    return await run_sidecar(DP_SIDECAR, [
+        "create-from-template",
+        "--tenant-id", tenant_id,
+        "--profile-name", profile_name,
+        "--template-json", json.dumps(template),
+    ])
 
 
 # 🔒 Rutas protegidas (Autenticadas)
@@ -370,42 +375,95 @@ async def list_tenants(request: Request):
             "id": str(doc["_id"]),
             "name": doc.get("name", ""),
             "plan": doc.get("plan", "free"),
+            "status": doc.get("status", "active"),
             "created_at": doc.get("created_at", None)
         })
     return {"tenants": tenants}
 
-@app.delete("/tenants/{tenant_id}")
+@app.delete("/tenants/{tenant_id}", status_code=202)
 async def delete_tenant_endpoint(
     tenant_id: str = Path(...),
     request: Request = None,
     purge_devices: bool = True,
 ):
+    # 1) Validar ID y propiedad antes de borrar
+    # (no existe o no pertenece al usuario autenticado → 404)
+    user = request.state.user
+    tenant = await require_tenant(user, tenant_id, detail="Comunidad no encontrada o no autorizada.",
+                                  allow_deleting=True)
+
+    # 2) Encolar el borrado (ChirpStack + cascada en Mongo); si ya hay uno en curso, se devuelve ese
+    job, created = await enqueue_unique(jobs_collection, "tenant_teardown", {
+        "tenant_id": tenant_id,
+        "chirpstack_tenant_id": tenant.get("chirpstack_tenant_id"),
+        "purge_devices": purge_devices,
+    }, owner_uid=user["uid"])
+    if created:
+        await tenants_collection.update_one({"_id": tenant["_id"]}, {"$set": {"status": "deleting"}})
+        invalidate_tenant(tenant_id)
+        if job_worker is not None:
+            job_worker.notify()
+
+    # progreso en GET /jobs/{job_id}
+    return {"ok": True, "tenant_id": tenant_id, **job_to_api(job)}
+
+@app.post("/tenants/{tenant_id}/reconcile", status_code=202)
+async def reconcile_tenant_endpoint(
+    tenant_id: str,
+    request: Request,
+    tenant: dict = Depends(owned_tenant),
+    apply: bool = Query(False, description="false = solo reporta las diferencias"),
+):
+    """Encola una reconciliación Mongo ↔ ChirpStack del tenant (ver reconcile.py)."""
+    job, created = await enqueue_unique(jobs_collection, "reconcile", {"tenant_id": tenant_id, "apply": apply},
+                                        owner_uid=request.state.user["uid"], max_attempts=1)
+    if created and job_worker is not None:
+        job_worker.notify()
+    return {"ok": True, "tenant_id": tenant_id, **job_to_api(job)}
+
+@app.get("/jobs/{job_id}")
+async def get_job_endpoint(job_id: str, request: Request):
     user = request.state.user
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
-
-    # 1) Validar ID y propiedad antes de borrar
     try:
-        oid = ObjectId(tenant_id)
+        oid = ObjectId(job_id)
     except Exception:
-        raise HTTPException(status_code=400, detail="tenant_id inválido")
+        raise HTTPException(status_code=400, detail="job_id inválido")
+    job = await jobs_collection.find_one({"_id": oid, "owner_uid": user["uid"]})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return job_to_api(job)
 
-    tenant = await tenants_collection.find_one({"_id": oid, "owner_uid": user["uid"]})
-    if not tenant:
-        # No existe o no pertenece al usuario autenticado
-        raise HTTPException(status_code=404, detail="Comunidad no encontrada o no autorizada.")
 
-    # 2) Ejecutar borrado centralizado (Mongo + ChirpStack)
+# 📦 Altas masivas (JSON o CSV): lectura común del body
+async def _read_bulk_body(request: Request, list_key: str) -> tuple[dict, list]:
+    """
+    Lee el body de un alta masiva: CSV con cabecera (Content-Type: text/csv),
+    un objeto JSON con la lista en `list_key` o un array JSON.
+    Devuelve (campos del objeto o {}, lista de items).
+    """
+    content_type = (request.headers.get("content-type") or "").split(";", 1)[0].strip().lower()
+    raw = await request.body()
+    body: dict = {}
     try:
-        result = await delete_tenant_by_id(tenant_id, purge_devices=purge_devices)
-        # result es un dict: {"ok": True, "chirpstack_deleted": bool, "mongo_devices_deleted": int, "tenant_id": str}
-        return result
-    except ValueError as e:
-        # Errores esperables (ids inválidos, fallo gRPC, etc.)
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception:
-        raise HTTPException(status_code=500, detail="Error interno al eliminar tenant")
-
+        if content_type in {"text/csv", "application/csv"}:
+            rows = [
+                {k.strip(): (v or "").strip() for k, v in r.items() if k}
+                for r in csv.DictReader(io.StringIO(raw.decode("utf-8-sig")))
+            ]
+        else:
+            parsed = json.loads(raw or b"null")
+            if isinstance(parsed, dict):
+                body, rows = parsed, parsed.get(list_key)
+            else:
+                rows = parsed
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Body inválido: {e}")
+
+    if not isinstance(rows, list) or not rows:
+        raise HTTPException(status_code=400, detail=f"Se requiere una lista '{list_key}' no vacía")
+    return body, rows
 
 # 📡 Gestión de Gateways
 @app.post("/gateways")
@@ -429,14 +487,7 @@ async def create_gateway_api(data: dict = Body(...), request: Request = None):
         raise HTTPException(status_code=400, detail="gateway_id debe tener 16 hex")
 
     # tenant dueño?
-    try:
-        oid = ObjectId(tenant_mongo_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="tenant_id inválido")
-
-    tenant = await tenants_collection.find_one({"_id": oid, "owner_uid": user["uid"]})
-    if not tenant:
-        raise HTTPException(status_code=404, detail="Tenant no encontrado o no autorizado")
+    tenant = await require_tenant(user, tenant_mongo_id)
 
     chirp_tenant_id = tenant.get("chirpstack_tenant_id")
     if not chirp_tenant_id:
@@ -461,9 +512,9 @@ async def create_gateway_api(data: dict = Body(...), request: Request = None):
             "tags": tags,
         })
         if not js.get("ok"):
-           # deja pasar el error funcional con 400
+           # error funcional → 400/409; timeout/sidecar caído → 504/503
            detail = js.get("error") or "Error al crear gateway en ChirpStack (sidecar)"
-           raise HTTPException(status_code=400, detail=f"ChirpStack error: {detail}")
+           raise HTTPException(status_code=http_status_for(js, default=400), detail=f"ChirpStack error: {detail}")
     except HTTPException:
         # respeta los 400/401/... que tú mismo generes
         raise
@@ -495,6 +546,26 @@ async def create_gateway_api(data: dict = Body(...), request: Request = None):
         "tenant_id": tenant_mongo_id,
     }
 
+@app.post("/gateways/bulk")
+async def bulk_import_gateways_endpoint(
+    request: Request,
+    tenant_id: str | None = Query(None, description="Requerido con CSV o con un array JSON"),
+):
+    """
+    Body JSON: {"tenant_id", "gateways": [{gateway_id, name, description?, tags?, location?}]}
+    o [{...}] con tenant_id en la query. CSV (text/csv): gateway_id,name,description,location,tags
+    """
+    body, rows = await _read_bulk_body(request, "gateways")
+    tenant_id = body.get("tenant_id") or tenant_id
+    if not tenant_id:
+        raise HTTPException(status_code=400, detail="tenant_id es obligatorio")
+
+    tenant = await require_tenant(request.state.user, tenant_id)
+    try:
+        return await import_gateways_bulk(tenant_id, tenant, rows)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/_gw_delete_sidecar", include_in_schema=False)
 async def _gw_delete_sidecar(body: dict):
     # body: { gateway_id }
@@ -503,21 +574,7 @@ async def _gw_delete_sidecar(body: dict):
     except KeyError as e:
         return {"ok": False, "error": f"missing field: {e.args[0]}"}
 
-    args = [sys.executable, "-m", "gw_sidecar", "delete",
-            "--gateway-id", gateway_id]
-
-    proc = subprocess.run(args, capture_output=True, text=True)
-    if proc.returncode != 0:
-        # sidecar puede imprimir JSON de error o solo texto
-        try:
-            return json.loads(proc.stdout or proc.stderr or "{}")
-        except Exception:
-            return {"ok": False, "error": proc.stderr or proc.stdout or "unknown delete error"}
-
-    try:
-        return json.loads(proc.stdout)
-    except Exception:
-        return {"ok": False, "error": f"bad sidecar json: {proc.stdout}"}
+    return await run_sidecar(GW_SIDECAR, ["delete", "--gateway-id", gateway_id])
 
 @app.delete("/gateways/{gateway_id}")
 async def delete_gateway_api(
@@ -538,15 +595,8 @@ async def delete_gateway_api(
     if len(gw_eui) != 16 or any(c not in "0123456789ABCDEF" for c in gw_eui):
         raise HTTPException(status_code=400, detail="gateway_id debe ser 16 hex (0-9, A-F)")
 
-    try:
-        oid = ObjectId(tenant_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="tenant_id inválido")
-
     # Tenant dueño
-    tenant = await tenants_collection.find_one({"_id": oid, "owner_uid": user["uid"]})
-    if not tenant:
-        raise HTTPException(status_code=404, detail="Tenant no encontrado o no autorizado")
+    await require_tenant(user, tenant_id)
 
     # Buscar gateway en Mongo (colección devices con type=gateway)
     doc = await devices_collection.find_one({
@@ -562,8 +612,8 @@ async def delete_gateway_api(
         if not js.get("ok"):
             # Si el GW no existe en ChirpStack, seguimos (idempotente)
             msg = (js.get("error") or "").lower()
-            if "not found" not in msg and "does not exist" not in msg:
-                raise HTTPException(status_code=502, detail=f"ChirpStack delete error: {js.get('error')}")
+            if js.get("code") != "not_found" and "not found" not in msg and "does not exist" not in msg:
+                raise HTTPException(status_code=http_status_for(js), detail=f"ChirpStack delete error: {js.get('error')}")
     except HTTPException:
         raise
     except Exception as e:
@@ -584,19 +634,7 @@ async def delete_gateway_api(
     }
 
 @app.get("/gateways")
-async def list_gateways_api(tenant_id: str = Query(...), request: Request = None):
-    user = request.state.user
-    if not user:
-        raise HTTPException(status_code=401, detail="Unauthorized")
-
-    try:
-        oid = ObjectId(tenant_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="tenant_id inválido")
-
-    tenant = await tenants_collection.find_one({"_id": oid, "owner_uid": user["uid"]})
-    if not tenant:
-        raise HTTPException(status_code=404, detail="Tenant no encontrado o no autorizado")
+async def list_gateways_api(tenant_id: str = Query(...), tenant: dict = Depends(owned_tenant)):
 
     cursor = devices_collection.find({"tenant_id": tenant_id, "type": "gateway"})
     out = []
@@ -610,26 +648,8 @@ async def list_gateways_api(tenant_id: str = Query(...), request: Request = None
         })
     return {"gateways": out}
 
-@app.get("/_gw_list_sidecar", include_in_schema=False)
-async def gw_list_sidecar():
-    try:
-        proc = subprocess.run(
-            [sys.executable, "-m", "gw_sidecar", "list", "--limit", "1"],
-            capture_output=True, text=True, check=True
-        )
-        return json.loads(proc.stdout or "{}")
-    except subprocess.CalledProcessError as e:
-        return {"ok": False, "error": e.stderr or str(e)}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
-
 # 📡 Gestión de Dispositivos
-# en startup (si tienes acceso al motor/colección aquí):
-# await devices_collection.create_index(
-#     [("tenant_id", 1), ("type", 1), ("dev_eui", 1)],
-#     unique=True,
-#     name="uniq_tenant_type_dev_eui"
-# )
+# (índices de devices: ver indexes.INDEXES)
 
 @app.post("/devices")
 async def register_device_endpoint(data: dict = Body(...), request: Request = None):
@@ -647,6 +667,38 @@ async def register_device_endpoint(data: dict = Body(...), request: Request = No
         print("❌ Error general:", str(e))
         raise HTTPException(status_code=500, detail="Error interno al registrar el dispositivo")
 
+# 📦 Alta masiva de dispositivos (JSON o CSV)
+@app.post("/devices/bulk")
+async def bulk_provision_devices_endpoint(
+    request: Request,
+    tenant_id: str | None = Query(None, description="Requerido con CSV o con un array JSON"),
+    profile_name: str | None = Query(None),
+    type: str | None = Query(None, description="type en Mongo (default: profile_name)"),
+    no_keys: bool = Query(False),
+):
+    """
+    Body JSON:
+      {"tenant_id", "profile_name", "type"?, "no_keys"?, "devices": [{dev_eui, name, app_key, ...}]}
+      o directamente [{...}, ...] con tenant_id/profile_name en la query.
+    Body CSV (Content-Type: text/csv), con cabecera:
+      dev_eui,name,app_key,nwk_key,join_eui,location,description,tags,gateway_id
+    """
+    body, rows = await _read_bulk_body(request, "devices")
+    tenant_id = body.get("tenant_id") or tenant_id
+    profile_name = body.get("profile_name") or profile_name
+    type = body.get("type") or type
+    no_keys = bool(body.get("no_keys", no_keys))
+    if not tenant_id or not profile_name:
+        raise HTTPException(status_code=400, detail="tenant_id y profile_name son obligatorios")
+
+    tenant = await require_tenant(request.state.user, tenant_id)
+    try:
+        return await provision_devices_bulk(
+            tenant_id, tenant, profile_name.strip(), rows, device_type=type, no_keys=no_keys,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/devices/{tenant_id}")
 async def get_devices_for_tenant(tenant_id: str, request: Request):
     user = request.state.user
@@ -685,16 +737,134 @@ async def delete_device(device_id: str, confirm: bool = Query(False), request: R
     raise HTTPException(status_code=404, detail="Dispositivo no encontrado")
 
 @app.get("/devices/{dev_eui}/data")
-def get_device_data(dev_eui: str):
-    db = MongoClient(os.getenv("MONGO_URI"))["PLATAFORMA_IOT"]
-    data = list(db["mqtt_data"].find({"device_eui": dev_eui}))
-    if not data:
+async def get_device_data(
+    dev_eui: str,
+    tenant: dict = Depends(owned_device),
+    from_: str | None = Query(None, alias="from", description="Inicio (ISO-8601 o epoch), inclusivo"),
+    to: str | None = Query(None, description="Fin (ISO-8601 o epoch), exclusivo"),
+    limit: int = Query(500, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = Query(None, description="next_cursor de la página anterior"),
+    fields: str | None = Query(None, description="Campos a devolver, separados por coma"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+):
+    try:
+        start = parse_time_param(from_) if from_ else None
+        end = parse_time_param(to) if to else None
+        data, next_cursor = await fetch_page(
+            mqtt_data_collection, {"device_eui": dev_eui, "tenant_id": str(tenant["_id"])},
+            start=start, end=end, limit=limit, cursor=cursor,
+            fields=[f.strip() for f in fields.split(",")] if fields else None,
+            descending=(order == "desc"),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not data and not cursor:
         raise HTTPException(status_code=404, detail="No se encontraron datos para este dispositivo.")
-    for d in data:
-        d["_id"] = str(d["_id"])
-        if "timestamp" in d:
-            d["timestamp"] = str(d["timestamp"])
-    return {"device_eui": dev_eui, "data": data}
+    return {"device_eui": dev_eui, "data": [to_api(d) for d in data], "next_cursor": next_cursor}
+
+# 📤 Exportación completa de telemetría (streaming, memoria constante)
+def _export_response(meta: dict, name: str, fmt: str, from_: str | None, to: str | None,
+                     fields: str | None, gzip: bool) -> StreamingResponse:
+    try:
+        start = parse_time_param(from_) if from_ else None
+        end = parse_time_param(to) if to else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    body = iter_export(
+        mqtt_data_collection, meta, start=start, end=end, fmt=fmt,
+        fields=[f.strip() for f in fields.split(",")] if fields else None,
+    )
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"{name}.{fmt}"
+    if gzip:
+        body = gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        body, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/devices/{dev_eui}/export")
+async def export_device_data(
+    dev_eui: str,
+    tenant: dict = Depends(owned_device),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    from_: str | None = Query(None, alias="from"),
+    to: str | None = Query(None),
+    fields: str | None = Query(None),
+    gzip: bool = Query(False),
+):
+    return _export_response({"device_eui": dev_eui, "tenant_id": str(tenant["_id"])}, f"telemetry_{dev_eui}", format, from_, to, fields, gzip)
+
+@app.get("/tenants/{tenant_id}/export")
+async def export_tenant_data(
+    tenant_id: str,
+    tenant: dict = Depends(owned_tenant),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    from_: str | None = Query(None, alias="from"),
+    to: str | None = Query(None),
+    fields: str | None = Query(None),
+    gzip: bool = Query(False),
+):
+    return _export_response({"tenant_id": tenant_id}, f"telemetry_tenant_{tenant_id}", format, from_, to, fields, gzip)
+
+# 📊 Agregados por intervalo (min/max/avg/count) para gráficas
+async def _aggregate_response(meta: dict, interval: str, from_: str | None, to: str | None,
+                              fields: str | None, by_device: bool = False, tz: str = "UTC",
+                              source: str = "auto") -> dict:
+    try:
+        start = parse_time_param(from_) if from_ else None
+        end = parse_time_param(to) if to else None
+        field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+        # rollups pre-calculados (alineados a UTC) salvo que se pida 'raw' u otra zona horaria,
+        # haya campos anidados o el rango empiece antes de su marca de agua
+        from db import db
+        if source == "auto" and tz == "UTC" and interval in INTERVALS:
+            window_start, _ = default_window(interval, start, end)
+            use_rollups = await rollups_can_serve(db, interval, window_start, field_list)
+        else:
+            use_rollups = source == "rollups"
+        if use_rollups:
+            result = await rollup_buckets(db, meta, interval, start=start, end=end,
+                                          fields=field_list, by_device=by_device)
+        else:
+            result = await aggregate_buckets(
+                mqtt_data_collection, meta, interval, start=start, end=end,
+                fields=field_list, by_device=by_device, tz=tz,
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**meta, **result}
+
+@app.get("/devices/{dev_eui}/aggregate")
+async def aggregate_device_data(
+    dev_eui: str,
+    tenant: dict = Depends(owned_device),
+    interval: str = Query("1h", pattern="^(1m|5m|1h|1d)$"),
+    from_: str | None = Query(None, alias="from"),
+    to: str | None = Query(None),
+    fields: str | None = Query(None, description="Campos numéricos a resumir, separados por coma"),
+    tz: str = Query("UTC"),
+    source: str = Query("auto", pattern="^(auto|raw|rollups)$"),
+):
+    return await _aggregate_response({"device_eui": dev_eui, "tenant_id": str(tenant["_id"])}, interval, from_, to, fields, tz=tz, source=source)
+
+@app.get("/tenants/{tenant_id}/aggregate")
+async def aggregate_tenant_data(
+    tenant_id: str,
+    tenant: dict = Depends(owned_tenant),
+    interval: str = Query("1h", pattern="^(1m|5m|1h|1d)$"),
+    from_: str | None = Query(None, alias="from"),
+    to: str | None = Query(None),
+    fields: str | None = Query(None),
+    by_device: bool = Query(False, description="Una serie por dispositivo"),
+    tz: str = Query("UTC"),
+    source: str = Query("auto", pattern="^(auto|raw|rollups)$"),
+):
+    return await _aggregate_response({"tenant_id": tenant_id}, interval, from_, to, fields, by_device, tz, source)
 
 @app.post("/device-keys")
 async def save_device_key(data: dict = Body(...), request: Request = None):
@@ -723,8 +893,8 @@ async def save_device_key(data: dict = Body(...), request: Request = None):
 @app.get("/grpc/device/{dev_eui}")
 async def grpc_get_device(dev_eui: str):
     try:
-        client = ChirpstackGRPCClient()
-        device = client.get_device(dev_eui)
+        client = AsyncChirpstackGRPCClient()
+        device = await client.get_device(dev_eui)
         return {
             "dev_eui": device.dev_eui,
             "name": device.name,
@@ -738,8 +908,8 @@ async def grpc_get_device(dev_eui: str):
 @app.post("/grpc/device/")
 async def grpc_create_device(payload: dict):
     try:
-        client = ChirpstackGRPCClient()
-        client.create_device(
+        client = AsyncChirpstackGRPCClient()
+        await client.create_device(
             dev_eui=payload["dev_eui"],
             name=payload["name"],
             description=payload.get("description", ""),
@@ -753,8 +923,8 @@ async def grpc_create_device(payload: dict):
 @app.delete("/grpc/device/{dev_eui}")
 async def grpc_delete_device(dev_eui: str):
     try:
-        client = ChirpstackGRPCClient()
-        client.delete_device(dev_eui)
+        client = AsyncChirpstackGRPCClient()
+        await client.delete_device(dev_eui)
         return {"message": "Device deleted via gRPC"}
     except grpc.RpcError as e:
         raise HTTPException(status_code=400, detail=f"gRPC Error: {e.details()}")
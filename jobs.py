@@ -0,0 +1,312 @@
+# jobs.py
+# Cola de trabajos en segundo plano persistida en Mongo (colección jobs).
+#
+# Documento de job:
+#   {
+#     "type": "tenant_teardown", "params": {...}, "owner_uid": ...,
+#     "status": "queued" | "running" | "succeeded" | "failed",
+#     "attempts": n, "max_attempts": n, "run_after": datetime, "error": str | None,
+#     "progress": {"step": str, "steps": {"<paso>": {"status": ..., "deleted": n}}},
+#     "locked_by": str, "locked_until": datetime, "active": true (solo en cola o en curso),
+#     "created_at", "updated_at", "started_at", "finished_at"
+#   }
+#
+# - enqueue() inserta el job; el API responde al instante con su id.
+# - enqueue_unique() no encola dos jobs activos del mismo (type, params.tenant_id): lo
+#   garantiza un índice único parcial sobre los jobs con active=true (un filtro por
+#   status $in solo vale desde MongoDB 6.0), no un find previo que puede competir.
+# - JobWorker reclama jobs con find_one_and_update (lease de JOB_LEASE_S, renovado
+#   en cada progress() y por un heartbeat cada JOB_LEASE_S/3), así un worker caído no
+#   deja el job bloqueado para siempre y varios procesos pueden consumir la misma cola.
+# - Un handler que lanza excepción se reintenta con backoff exponencial hasta
+#   max_attempts; los handlers deben ser idempotentes (se re-ejecutan completos).
+#
+# Worker dedicado (además del que corre dentro del API si JOBS_WORKER_ENABLED=1):
+#   python -m jobs worker
+#
+# ENV:
+#   JOBS_WORKER_ENABLED   1 = el API arranca un worker en su lifespan (default 1)
+#   JOBS_CONCURRENCY      jobs simultáneos por worker (default 1)
+#   JOBS_POLL_S           espera entre búsquedas cuando la cola está vacía (default 2)
+#   JOB_LEASE_S           duración del lease de un job en ejecución (default 120)
+#   JOB_MAX_ATTEMPTS      intentos por job (default 5)
+#   JOB_RETRY_BASE_S      backoff base entre intentos (default 5)
+import asyncio, os, socket, sys, traceback, uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+JOBS_WORKER_ENABLED = os.getenv("JOBS_WORKER_ENABLED", "1") != "0"
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "1"))
+JOBS_POLL_S = float(os.getenv("JOBS_POLL_S", "2"))
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_S = float(os.getenv("JOB_RETRY_BASE_S", "5"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# (keys, name, opciones) de la colección jobs
+JOB_INDEXES = [
+    ([("status", ASCENDING), ("run_after", ASCENDING)], "status_run_after", {}),
+    ([("type", ASCENDING), ("params.tenant_id", ASCENDING), ("status", ASCENDING)], "type_tenant_status", {}),
+    ([("type", ASCENDING), ("params.tenant_id", ASCENDING)], "uniq_active_type_tenant", {
+        "unique": True,
+        "partialFilterExpression": {"active": True, "params.tenant_id": {"$exists": True}},
+    }),
+]
+
+
+async def ensure_job_indexes(collection):
+    for keys, name, opts in JOB_INDEXES:
+        await collection.create_index(keys, name=name, **opts)
+
+
+async def enqueue(collection, job_type: str, params: dict, owner_uid: str | None = None,
+                  max_attempts: int = JOB_MAX_ATTEMPTS) -> dict:
+    now = _now()
+    job = {
+        "type": job_type,
+        "params": params,
+        "owner_uid": owner_uid,
+        "status": "queued",
+        "active": True,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "run_after": now,
+        "error": None,
+        "progress": {"step": None, "steps": {}},
+        "created_at": now,
+        "updated_at": now,
+    }
+    res = await collection.insert_one(job)
+    job["_id"] = res.inserted_id
+    return job
+
+
+async def enqueue_unique(collection, job_type: str, params: dict, owner_uid: str | None = None,
+                         max_attempts: int = JOB_MAX_ATTEMPTS) -> tuple[dict, bool]:
+    """
+    Como enqueue, pero si ya hay un job activo del mismo tipo para params["tenant_id"]
+    devuelve ese. Devuelve (job, creado).
+    """
+    for _ in range(3):
+        job = await find_active(collection, job_type, tenant_id=params["tenant_id"])
+        if job is not None:
+            return job, False
+        try:
+            return await enqueue(collection, job_type, params, owner_uid, max_attempts), True
+        except DuplicateKeyError:
+            # otra petición lo encoló entre el find y el insert; se devuelve el suyo
+            # (si ya terminó también, se reintenta el alta)
+            continue
+    raise RuntimeError(f"no se pudo encolar {job_type} para tenant {params['tenant_id']}")
+
+
+async def find_active(collection, job_type: str, **params) -> dict | None:
+    """Job en cola o en curso con esos params (para no encolar dos veces lo mismo)."""
+    query = {"type": job_type, "status": {"$in": list(ACTIVE_STATUSES)}}
+    query.update({f"params.{k}": v for k, v in params.items()})
+    return await collection.find_one(query)
+
+
+def job_to_api(job: dict) -> dict:
+    def _iso(v):
+        return v.isoformat() if isinstance(v, datetime) else v
+    return {
+        "job_id": str(job["_id"]),
+        "type": job.get("type"),
+        "status": job.get("status"),
+        "params": job.get("params", {}),
+        "attempts": job.get("attempts", 0),
+        "max_attempts": job.get("max_attempts"),
+        "error": job.get("error"),
+        "progress": job.get("progress", {}),
+        "result": job.get("result"),
+        "created_at": _iso(job.get("created_at")),
+        "started_at": _iso(job.get("started_at")),
+        "finished_at": _iso(job.get("finished_at")),
+        "next_attempt_at": _iso(job.get("run_after")) if job.get("status") == "queued" else None,
+    }
+
+
+class JobContext:
+    """Lo que recibe un handler: params del job y un progress() que persiste el avance."""
+
+    def __init__(self, worker: "JobWorker", job: dict):
+        self.worker = worker
+        self.job = job
+        self.params = job.get("params", {})
+
+    async def progress(self, step: str, status: str = "running", **fields):
+        now = _now()
+        update = {
+            "progress.step": step,
+            f"progress.steps.{step}.status": status,
+            "updated_at": now,
+            "locked_until": now + timedelta(seconds=self.worker.lease),
+        }
+        for k, v in fields.items():
+            update[f"progress.steps.{step}.{k}"] = v
+        await self.worker.collection.update_one(
+            {"_id": self.job["_id"], "locked_by": self.worker.worker_id}, {"$set": update}
+        )
+
+
+class JobWorker:
+    def __init__(self, collection, handlers: dict, concurrency: int = JOBS_CONCURRENCY,
+                 poll_interval: float = JOBS_POLL_S, lease: float = JOB_LEASE_S):
+        self.collection = collection
+        self.handlers = handlers
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self.stats = {"succeeded": 0, "failed": 0, "retried": 0}
+
+    def notify(self):
+        """Despierta a los loops (p.ej. justo después de encolar)."""
+        self._wakeup.set()
+
+    async def _claim(self) -> dict | None:
+        now = _now()
+        return await self.collection.find_one_and_update(
+            {
+                "type": {"$in": list(self.handlers)},
+                "$or": [
+                    {"status": "queued", "run_after": {"$lte": now}},
+                    # lease vencido: el worker que lo tenía murió
+                    {"status": "running", "locked_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "locked_by": self.worker_id,
+                    "locked_until": now + timedelta(seconds=self.lease),
+                    "started_at": now,
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_after", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _heartbeat(self, owned: dict):
+        """Renueva el lease cada lease/3 mientras corre el handler (un paso lento sin
+        progress() no debe dejar que otro worker reclame el job y lo ejecute en paralelo)."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            now = _now()
+            try:
+                await self.collection.update_one(owned, {"$set": {
+                    "locked_until": now + timedelta(seconds=self.lease), "updated_at": now,
+                }})
+            except Exception as e:
+                print(f"⚠️  Jobs: no se pudo renovar el lease de {owned['_id']}: {e}")
+
+    async def _run_job(self, job: dict):
+        handler = self.handlers[job["type"]]
+        ctx = JobContext(self, job)
+        owned = {"_id": job["_id"], "locked_by": self.worker_id}
+        heartbeat = asyncio.create_task(self._heartbeat(owned))
+        try:
+            result = await handler(ctx)
+        except Exception as e:
+            heartbeat.cancel()
+            traceback.print_exc()
+            now = _now()
+            if job.get("attempts", 1) < job.get("max_attempts", JOB_MAX_ATTEMPTS):
+                delay = JOB_RETRY_BASE_S * (2 ** (job.get("attempts", 1) - 1))
+                self.stats["retried"] += 1
+                print(f"⚠️  Job {job['_id']} ({job['type']}) intento {job.get('attempts')} falló: {e}; reintento en {delay:g}s")
+                await self.collection.update_one(owned, {"$set": {
+                    "status": "queued", "error": str(e), "run_after": now + timedelta(seconds=delay),
+                    "updated_at": now, "locked_by": None, "locked_until": None,
+                }})
+            else:
+                self.stats["failed"] += 1
+                print(f"🔴 Job {job['_id']} ({job['type']}) falló definitivamente: {e}")
+                await self.collection.update_one(owned, {"$set": {
+                    "status": "failed", "error": str(e), "finished_at": now,
+                    "updated_at": now, "locked_by": None, "locked_until": None,
+                }, "$unset": {"active": ""}})
+            return
+        finally:
+            heartbeat.cancel()
+
+        now = _now()
+        self.stats["succeeded"] += 1
+        await self.collection.update_one(owned, {"$set": {
+            "status": "succeeded", "error": None, "result": result, "finished_at": now,
+            "updated_at": now, "locked_by": None, "locked_until": None,
+        }, "$unset": {"active": ""}})
+
+    async def _loop(self):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"⚠️  Jobs: error al reclamar job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run_job(job)
+            except Exception as e:
+                # p.ej. Mongo caído al guardar el estado final: el lease vence y se reintenta
+                print(f"🔴 Jobs: error al cerrar job {job.get('_id')} ({job.get('type')}): {e}")
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._loop()) for _ in range(self.concurrency)]
+        print(f"🟢 Jobs: worker {self.worker_id} ({self.concurrency} en paralelo) para {', '.join(self.handlers)}")
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def default_handlers() -> dict:
+    from crud import teardown_tenant
+    from reconcile import reconcile_job
+    return {"tenant_teardown": teardown_tenant, "reconcile": reconcile_job}
+
+
+async def _worker_main():
+    from db import jobs_collection
+    await ensure_job_indexes(jobs_collection)
+    worker = JobWorker(jobs_collection, default_handlers())
+    worker.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await worker.stop()
+
+
+def main():
+    if sys.argv[1:2] != ["worker"]:
+        print("uso: python -m jobs worker")
+        sys.exit(2)
+    try:
+        asyncio.run(_worker_main())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
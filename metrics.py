@@ -0,0 +1,407 @@
+# metrics.py
+# Métricas en proceso, expuestas en formato de texto de Prometheus (GET /metrics).
+#
+# Sin dependencias externas: contadores, gauges e histogramas con labels guardados
+# en dicts (un lock por métrica; los listeners de pymongo y el canal gRPC síncrono
+# registran desde hilos del executor). Coste por observación: un bisect + dos sumas.
+#
+# Fuentes:
+#   http_*        MetricsMiddleware (ASGI puro; route = template de FastAPI, p.ej.
+#                 "/devices/{dev_eui}/data", "unmatched" si no hubo ruta → cardinalidad acotada)
+#   chirpstack_*  interceptores gRPC (rpc_interceptors / aio_rpc_interceptors) en chirpstack_grpc.py
+#   sidecar_*     sidecar_runner.run_sidecar (llamadas) y sidecar_pool (procesos lanzados)
+#   mongo_*       MongoCommandMetrics (pymongo CommandListener) registrado en db.py
+#   ingest_*      ingest_collector(pipeline, registry) en mqtt_client.py; el ingestor es
+#                 otro proceso, así que expone su propio /metrics (start_metrics_server)
+#   process_*     CPU y memoria del proceso
+#
+# ENV:
+#   METRICS_ENABLED     1 = instrumentación activa y /metrics expuesto (default 1)
+#   METRICS_TOKEN       si se define, /metrics exige "Authorization: Bearer <token>" (default abierto)
+#   MQTT_METRICS_PORT   puerto del /metrics del ingestor (mqtt_client.py; default 9102, 0 = desactivado)
+import asyncio, bisect, os, resource, sys, threading, time
+
+import grpc
+from pymongo import monitoring
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+MQTT_METRICS_PORT = int(os.getenv("MQTT_METRICS_PORT", "9102"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RPC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SIDECAR_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+# ────────────────────────────────────────────────
+# 📈 Tipos de métrica
+# ────────────────────────────────────────────────
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount: float = 1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount: float = 1.0):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value: float):
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = HTTP_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                # [conteos por bucket (+Inf al final), suma, total]
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(k, list(s[0]), s[1], s[2]) for k, s in self._values.items()]
+        lines = []
+        for key, counts, total_sum, total in items:
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                acc += n
+                le = 'le="%s"' % _num(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {acc}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total_sum)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+class Registry:
+    """Métricas propias + collectors: callables que devuelven
+    [(nombre, tipo, help, [(labels_dict, valor), ...])] al momento del scrape."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def register_collector(self, fn):
+        self._collectors.append(fn)
+
+    def unregister_collector(self, fn):
+        if fn in self._collectors:
+            self._collectors.remove(fn)
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            body = m.render()
+            if body:
+                lines += m.header() + body
+        for fn in list(self._collectors):
+            try:
+                families = fn()
+            except Exception as e:
+                print(f"⚠️  metrics: collector {getattr(fn, '__qualname__', fn)} falló: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_num(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ────────────────────────────────────────────────
+# 📊 Métricas de la plataforma
+# ────────────────────────────────────────────────
+HTTP_REQUESTS = Counter("http_requests_total", "Peticiones HTTP por ruta y status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Latencia HTTP por template de ruta",
+                         ("method", "route"), HTTP_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Peticiones HTTP en curso", ("method",))
+
+RPC_LATENCY = Histogram("chirpstack_rpc_duration_seconds", "Latencia de llamadas gRPC a ChirpStack",
+                        ("method",), RPC_BUCKETS)
+RPC_ERRORS = Counter("chirpstack_rpc_errors_total", "Llamadas gRPC a ChirpStack con status != OK", ("method", "code"))
+
+SIDECAR_CALLS = Counter("sidecar_calls_total", "Invocaciones de sidecars por resultado", ("module", "command", "code"))
+SIDECAR_LATENCY = Histogram("sidecar_call_duration_seconds", "Duración de invocaciones de sidecars (incluye espera de cupo)",
+                            ("module", "command"), SIDECAR_BUCKETS)
+SIDECAR_SPAWNS = Counter("sidecar_spawns_total", "Procesos sidecar lanzados", ("module", "mode"))
+SIDECAR_SPAWN_LATENCY = Histogram("sidecar_spawn_duration_seconds", "Tiempo de lanzar un proceso sidecar",
+                                  ("module", "mode"), SIDECAR_BUCKETS)
+
+MONGO_LATENCY = Histogram("mongo_command_duration_seconds", "Latencia de comandos Mongo por colección y operación",
+                          ("collection", "command"), MONGO_BUCKETS)
+MONGO_FAILURES = Counter("mongo_command_failures_total", "Comandos Mongo fallidos", ("collection", "command"))
+
+_START_TIME = time.time()
+
+
+def _process_collector():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss: KiB en Linux, bytes en macOS
+    rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return [
+        ("process_cpu_seconds_total", "counter", "CPU de usuario + sistema", [({}, usage.ru_utime + usage.ru_stime)]),
+        ("process_max_resident_memory_bytes", "gauge", "Pico de memoria residente", [({}, rss)]),
+        ("process_start_time_seconds", "gauge", "Arranque del proceso (epoch)", [({}, _START_TIME)]),
+    ]
+
+
+REGISTRY.register_collector(_process_collector)
+
+
+# ────────────────────────────────────────────────
+# 🌐 HTTP
+# ────────────────────────────────────────────────
+class MetricsMiddleware:
+    """ASGI puro (no envuelve el body: streaming/SSE intactos). Debe ser el middleware
+    más externo para contar también los 401 del auth."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            elapsed = time.perf_counter() - t0
+            HTTP_IN_FLIGHT.dec(method)
+            # el router de FastAPI deja la ruta resuelta en el scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_LATENCY.observe(elapsed, method, route)
+            HTTP_REQUESTS.inc(method, route, str(status))
+
+
+# ────────────────────────────────────────────────
+# 📡 gRPC (ChirpStack)
+# ────────────────────────────────────────────────
+def _rpc_method(details) -> str:
+    """'/api.DeviceService/Create' → 'DeviceService/Create'."""
+    method = details.method
+    if isinstance(method, bytes):
+        method = method.decode()
+    method = method.lstrip("/")
+    return method[4:] if method.startswith("api.") else method
+
+
+class RpcMetricsInterceptor(grpc.UnaryUnaryClientInterceptor):
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        t0 = time.perf_counter()
+        outcome = continuation(client_call_details, request)
+        code = outcome.code()
+        method = _rpc_method(client_call_details)
+        RPC_LATENCY.observe(time.perf_counter() - t0, method)
+        if code is not None and code.name != "OK":
+            RPC_ERRORS.inc(method, code.name)
+        return outcome
+
+
+class AsyncRpcMetricsInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        t0 = time.perf_counter()
+        call = await continuation(client_call_details, request)
+        code = await call.code()  # espera a que termine sin lanzar; el caller recibe el call intacto
+        method = _rpc_method(client_call_details)
+        RPC_LATENCY.observe(time.perf_counter() - t0, method)
+        if code.name != "OK":
+            RPC_ERRORS.inc(method, code.name)
+        return call
+
+
+def rpc_interceptors() -> list:
+    """Interceptores para grpc.intercept_channel (vacío si METRICS_ENABLED=0)."""
+    return [RpcMetricsInterceptor()] if METRICS_ENABLED else []
+
+
+def aio_rpc_interceptors() -> list:
+    """Interceptores para grpc.aio.insecure_channel(interceptors=...)."""
+    return [AsyncRpcMetricsInterceptor()] if METRICS_ENABLED else []
+
+
+# ────────────────────────────────────────────────
+# 🧩 Sidecars
+# ────────────────────────────────────────────────
+def observe_sidecar_call(module: str, command: str, out: dict, seconds: float):
+    code = "ok" if out.get("ok") else (out.get("code") or "error")
+    SIDECAR_CALLS.inc(module, command, code)
+    SIDECAR_LATENCY.observe(seconds, module, command)
+
+
+def observe_sidecar_spawn(module: str, mode: str, seconds: float):
+    SIDECAR_SPAWNS.inc(module, mode)
+    SIDECAR_SPAWN_LATENCY.observe(seconds, module, mode)
+
+
+# ────────────────────────────────────────────────
+# 🍃 Mongo
+# ────────────────────────────────────────────────
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Latencia por (colección, comando). El nombre de la colección solo viene en el
+    evento started; se guarda por request_id hasta el succeeded/failed."""
+
+    def __init__(self):
+        self._pending: dict = {}
+
+    def started(self, event):
+        name = event.command_name
+        target = event.command.get("collection") if name == "getMore" else event.command.get(name)
+        self._pending[(event.connection_id, event.request_id)] = target if isinstance(target, str) else "-"
+
+    def _finish(self, event) -> str:
+        return self._pending.pop((event.connection_id, event.request_id), "-")
+
+    def succeeded(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, self._finish(event), event.command_name)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, collection, event.command_name)
+        MONGO_FAILURES.inc(collection, event.command_name)
+
+
+def mongo_listeners() -> list:
+    return [MongoCommandMetrics()] if METRICS_ENABLED else []
+
+
+# ────────────────────────────────────────────────
+# 📥 Ingesta MQTT
+# ────────────────────────────────────────────────
+def ingest_collector(pipeline, registry=None):
+    """Collector que traduce pipeline.stats() / registry.stats a métricas ingest_*."""
+
+    def _collect():
+        stats = pipeline.stats()
+        stages = ("receive", "decode", "enrich", "write")
+        out = [
+            (f"ingest_stage_{key}_total", "counter", f"Mensajes {label} por etapa",
+             [({"stage": s}, stats[s][key]) for s in stages])
+            for key, label in (("processed", "procesados"), ("dropped", "descartados"), ("errors", "con error"))
+        ]
+        out.append(("ingest_queue_depth", "gauge", "Mensajes esperando en la cola de entrada de cada etapa",
+                    [({"stage": s}, stats[s]["queue_depth"]) for s in stages]))
+        write = stats["write"]
+        out += [
+            ("ingest_inserted_total", "counter", "Documentos insertados en mqtt_data", [({}, write["inserted"])]),
+            ("ingest_batches_total", "counter", "Lotes insert_many ejecutados", [({}, write["batches"])]),
+            ("ingest_write_errors_total", "counter", "Documentos con error de escritura", [({}, write["write_errors"])]),
+            ("ingest_write_dropped_total", "counter", "Documentos descartados tras reintentos", [({}, write["dropped"])]),
+            ("ingest_end_to_end_max_seconds", "gauge", "Máxima latencia recepción → writer",
+             [({}, stats["end_to_end"]["max_ms"] / 1000)]),
+        ]
+        if registry is not None:
+            out.append(("ingest_registry_devices", "gauge", "Dispositivos en el registro en memoria", [({}, len(registry))]))
+            out.append(("ingest_registry_events_total", "counter",
+                        "Eventos del registro (hits, negative_hits, db_lookups, snapshots, stream_events)",
+                        [({"event": k}, v) for k, v in registry.stats.items()]))
+        return out
+
+    return _collect
+
+
+async def start_metrics_server(host: str = "0.0.0.0", port: int = MQTT_METRICS_PORT):
+    """Servidor HTTP mínimo (solo GET /metrics) para procesos sin FastAPI, como el ingestor."""
+
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET" or parts[1].split("?")[0] != "/metrics":
+                status, body, ctype = "404 Not Found", b"not found\n", "text/plain"
+            elif METRICS_TOKEN and headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+                status, body, ctype = "401 Unauthorized", b"unauthorized\n", "text/plain"
+            else:
+                status, body, ctype = "200 OK", render().encode(), CONTENT_TYPE
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(_handle, host, port)
+    print(f"🟢 Métricas en http://{host}:{port}/metrics")
+    return server
@@ -1,7 +1,8 @@
 import logging
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from auth import verify_token
+import re
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from auth import verify_token_async
 
 # Configurar logger para este módulo
 logger = logging.getLogger(__name__)
@@ -9,6 +10,8 @@ logger = logging.getLogger(__name__)
 # ➕ rutas abiertas (sin auth)
 OPEN_PATHS = {
     "/", "/ping-db",
+    # --- Métricas (Prometheus no usa Firebase; ver METRICS_TOKEN en metrics.py) ---
+    "/metrics",
     # --- Gateway ---
     "/_gw_smoke", "/_gw_list_sidecar", "/_gw_create_sidecar",
     # --- Device Profile ---
@@ -23,26 +26,67 @@ OPEN_PATHS = {
     "/favicon.ico",
 }
 
-class FirebaseAuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
+# ➕ prefijos abiertos (p.ej. "/docs/" para assets de la doc)
+OPEN_PREFIXES: tuple[str, ...] = (
+    "/docs/",
+)
+
+# ➕ patrones abiertos (regex sobre el path completo)
+OPEN_PATTERNS: list[re.Pattern] = []
+
+_OPEN_METHODS = {"OPTIONS", "HEAD"}
+
+
+def is_open_path(path: str) -> bool:
+    if path in OPEN_PATHS or path.startswith(OPEN_PREFIXES):
+        return True
+    return any(p.fullmatch(path) for p in OPEN_PATTERNS)
+
+
+def _bearer_token(scope: Scope) -> str | None:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            value = value.decode("latin-1")
+            if value.startswith("Bearer "):
+                return value.split(" ", 1)[1]
+            return None
+    return None
+
+
+class FirebaseAuthMiddleware:
+    """
+    Middleware ASGI puro: valida el Bearer token de Firebase y deja el token
+    decodificado en scope["state"]["user"] (request.state.user en los endpoints).
+    No envuelve la respuesta, así que streaming/SSE pasan tal cual.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        method = scope["method"]
 
         # Permitir sin autenticación: rutas públicas o método OPTIONS
-        if request.method in {"OPTIONS", "HEAD"} or path in OPEN_PATHS:
-            return await call_next(request)
+        if method in _OPEN_METHODS or is_open_path(path):
+            return await self.app(scope, receive, send)
 
-        auth_header = request.headers.get("Authorization")
+        token = _bearer_token(scope)
 
         # Log dentro del contexto de la petición
-        logger.info(f"[AUTH] {request.method} {path} - Authorization present? {bool(auth_header)}")
+        logger.info(f"[AUTH] {method} {path} - Authorization present? {token is not None}")
 
-        if not auth_header or not auth_header.startswith("Bearer "):
-            raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
+        if not token:
+            response = JSONResponse({"detail": "Missing or invalid Authorization header"}, status_code=401)
+            return await response(scope, receive, send)
 
-        token = auth_header.split(" ", 1)[1]
-        decoded_token = verify_token(token)
+        decoded_token = await verify_token_async(token)
         if not decoded_token:
-            raise HTTPException(status_code=401, detail="Invalid or expired token")
+            response = JSONResponse({"detail": "Invalid or expired token"}, status_code=401)
+            return await response(scope, receive, send)
 
-        request.state.user = decoded_token  # Puedes usar esto en tus endpoints
-        return await call_next(request)
+        scope.setdefault("state", {})["user"] = decoded_token  # Puedes usar esto en tus endpoints
+        return await self.app(scope, receive, send)
@@ -1,58 +1,85 @@
 # mqtt_client.py
 import asyncio
+import signal
 from aiomqtt import Client
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from datetime import datetime, timezone
-import json
 import os
 
+from db import db, devices_collection, mqtt_data_collection
+from device_registry import DeviceRegistry
+from telemetry_writer import BatchWriter
+from ingest_pipeline import IngestPipeline
+from telemetry import ensure_telemetry_collection
+from rollups import RollupMaterializer, ROLLUPS_ENABLED
+from metrics import REGISTRY, METRICS_ENABLED, MQTT_METRICS_PORT, ingest_collector, start_metrics_server
+
 # Carga variables de entorno
 load_dotenv()
 
 MQTT_HOST = os.getenv("MQTT_HOST", "maglev.proxy.rlwy.net")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
 MQTT_TOPIC = os.getenv("MQTT_TOPIC", "#")
-MONGODB_URI = os.getenv("MONGODB_URI")
-
-# Conexión a MongoDB
-mongo_client = MongoClient(MONGODB_URI)
-db = mongo_client["PLATAFORMA_IOT"]
-collection = db["mqtt_data"]
 
 async def mqtt_handler():
-    async with Client(MQTT_HOST, port=MQTT_PORT) as client:
+    # mqtt_data como time-series (idempotente; la copia del legacy la hace el API)
+    await ensure_telemetry_collection(db)
+
+    # Registro dev_eui → device en memoria (Motor + change stream); evita un find_one por uplink
+    registry = DeviceRegistry(devices_collection)
+    await registry.start()
+
+    # Rollups 1m/1h/1d actualizados tras cada lote insertado
+    after_flush = []
+    if ROLLUPS_ENABLED:
+        rollups = RollupMaterializer(db)
+        await rollups.ensure_indexes()
+        after_flush.append(rollups.apply)
+
+    # Escritura por micro-lotes (insert_many) con backpressure sobre el consumidor
+    writer = BatchWriter(mqtt_data_collection, after_flush=after_flush)
+    await writer.start()
+
+    # receive → decode/validate → enrich → write, con colas acotadas entre etapas
+    pipeline = IngestPipeline(registry, writer)
+    pipeline.start()
+
+    # Contadores de la ingesta en formato Prometheus (proceso aparte del API → su propio /metrics)
+    collector = ingest_collector(pipeline, registry)
+    REGISTRY.register_collector(collector)
+    metrics_server = None
+    if METRICS_ENABLED and MQTT_METRICS_PORT:
+        try:
+            metrics_server = await start_metrics_server(port=MQTT_METRICS_PORT)
+        except OSError as e:
+            print(f"⚠️  Métricas: no se pudo abrir el puerto {MQTT_METRICS_PORT}: {e}")
+
+    try:
+        async with Client(MQTT_HOST, port=MQTT_PORT) as client:
             await client.subscribe(MQTT_TOPIC)
             print(f"🟢 Suscrito a: {MQTT_TOPIC}")
+            await pipeline.receive(client.messages)
+    finally:
+        # Flush final garantizado (cancelación, SIGTERM o caída del broker)
+        await pipeline.drain()
+        await writer.close()
+        await registry.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        REGISTRY.unregister_collector(collector)
+        print(f"🟢 Ingesta detenida: {pipeline.stats()}")
+
+async def main():
+    task = asyncio.create_task(mqtt_handler())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, task.cancel)
+        except NotImplementedError:
+            pass
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
 
-            async for message in client.messages:
-                print(f"[{message.topic}] {message.payload.decode()}")
-            
-                try:
-                    payload = json.loads(message.payload.decode())
-                    
-                    # Validar que existe device_eui
-                    device_eui = payload.get("device_eui")
-                    if not device_eui:
-                        print("⚠️  Mensaje sin device_eui, ignorado.")
-                        continue
-
-                    # Verificar si el device_eui está registrado
-                    device = db["devices"].find_one({"dev_eui": device_eui})
-                    if not device:
-                        print(f"⚠️  Dispositivo no registrado: {device_eui}, mensaje ignorado.")
-                        continue
-
-                    # Agregar campos adicionales
-                    if "timestamp" not in payload:
-                        payload["timestamp"] = datetime.now(timezone.utc).isoformat()
-                    
-                    payload["topic"] = str(message.topic)
-                    collection.insert_one(payload)
-                    print("🟢 Mensaje guardado en MongoDB.")
-
-                except Exception as e:
-                    print(f"🔴 Error al procesar mensaje: {e}")
-            
 if __name__ == "__main__":
-    asyncio.run(mqtt_handler())
\ No newline at end of file
+    asyncio.run(main())
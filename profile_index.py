@@ -0,0 +1,164 @@
+# profile_index.py
+# Índice por tenant de ChirpStack: nombre de Device Profile → id.
+#
+# - Se llena con un List paginado completo (no solo los primeros 50).
+# - Cada tenant caduca a los PROFILE_INDEX_TTL_S; un nombre desconocido fuerza
+#   un refresh del tenant (como mucho uno cada PROFILE_INDEX_MISS_S).
+# - Se puede precalentar con los snapshots de device_profiles_collection
+#   (warm_from_snapshots) y se invalida al crear un profile nuevo.
+# - Sin dependencias de Mongo ni de stubs concretos: quien llama pasa una función
+#   list_page(limit, offset) → ListDeviceProfilesResponse (sync o async), así lo
+#   usan igual el cliente gRPC del API y los sidecars.
+#
+# ENV:
+#   PROFILE_INDEX_TTL_S    vida del índice de un tenant (default 300)
+#   PROFILE_INDEX_MISS_S   intervalo mínimo entre refresh por nombre no encontrado (default 5)
+import asyncio, os, threading, time
+
+PROFILE_INDEX_TTL_S = float(os.getenv("PROFILE_INDEX_TTL_S", "300"))
+PROFILE_INDEX_MISS_S = float(os.getenv("PROFILE_INDEX_MISS_S", "5"))
+
+_PAGE_SIZE = 100
+
+
+def _items(resp):
+    for it in resp.result:
+        src = getattr(it, "device_profile", it)
+        name, pid = getattr(src, "name", None), getattr(src, "id", None)
+        if name and pid:
+            yield name, pid
+
+
+def list_all(list_page) -> dict[str, str]:
+    """Recorre todas las páginas de ListDeviceProfiles (sync)."""
+    out, offset = {}, 0
+    while True:
+        resp = list_page(_PAGE_SIZE, offset)
+        batch = len(resp.result)
+        out.update(_items(resp))
+        offset += batch
+        total = getattr(resp, "total_count", None)
+        if batch == 0 or (total is not None and offset >= total):
+            return out
+
+
+async def list_all_async(list_page) -> dict[str, str]:
+    """Recorre todas las páginas de ListDeviceProfiles (async)."""
+    out, offset = {}, 0
+    while True:
+        resp = await list_page(_PAGE_SIZE, offset)
+        batch = len(resp.result)
+        out.update(_items(resp))
+        offset += batch
+        total = getattr(resp, "total_count", None)
+        if batch == 0 or (total is not None and offset >= total):
+            return out
+
+
+class _TenantProfiles:
+    __slots__ = ("by_name", "expires_at", "listed_at")
+
+    def __init__(self):
+        self.by_name: dict[str, str] = {}
+        self.expires_at = 0.0   # entradas válidas hasta
+        self.listed_at = 0.0    # último List, para limitar refresh por misses
+
+
+class ProfileIndex:
+    def __init__(self, ttl: float = PROFILE_INDEX_TTL_S, miss_interval: float = PROFILE_INDEX_MISS_S):
+        self.ttl = ttl
+        self.miss_interval = miss_interval
+        self._tenants: dict[str, _TenantProfiles] = {}
+        self._lock = threading.Lock()
+        self._alocks: dict[str, asyncio.Lock] = {}
+        self.stats = {"hits": 0, "misses": 0, "lists": 0}
+
+    # ── estado ────────────────────────────────────
+    def _entry(self, tenant_id: str) -> _TenantProfiles:
+        entry = self._tenants.get(tenant_id)
+        if entry is None:
+            entry = self._tenants[tenant_id] = _TenantProfiles()
+        return entry
+
+    def lookup(self, tenant_id: str, name: str) -> str | None:
+        """Solo memoria: id si el nombre está y el tenant no caducó."""
+        entry = self._tenants.get(tenant_id)
+        if entry is None:
+            return None
+        pid = entry.by_name.get(name)
+        if pid is not None and entry.expires_at > time.monotonic():
+            return pid
+        return None
+
+    def put(self, tenant_id: str, name: str, profile_id: str):
+        with self._lock:
+            entry = self._entry(tenant_id)
+            if entry.expires_at <= time.monotonic():
+                # caducado: no revivir nombres viejos junto con el nuevo
+                entry.by_name = {}
+                entry.expires_at = time.monotonic() + self.ttl
+            entry.by_name[name] = profile_id
+
+    def replace(self, tenant_id: str, by_name: dict[str, str]):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(tenant_id)
+            entry.by_name = dict(by_name)
+            entry.expires_at = now + self.ttl
+            entry.listed_at = now
+        self.stats["lists"] += 1
+
+    def invalidate(self, tenant_id: str | None = None):
+        with self._lock:
+            if tenant_id is None:
+                self._tenants.clear()
+            else:
+                self._tenants.pop(tenant_id, None)
+
+    def _should_list(self, tenant_id: str) -> bool:
+        entry = self._tenants.get(tenant_id)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return True
+        return time.monotonic() - entry.listed_at >= self.miss_interval
+
+    # ── resolución ────────────────────────────────
+    def resolve(self, tenant_id: str, name: str, list_page) -> str | None:
+        pid = self.lookup(tenant_id, name)
+        if pid is not None:
+            self.stats["hits"] += 1
+            return pid
+        self.stats["misses"] += 1
+        if self._should_list(tenant_id):
+            self.replace(tenant_id, list_all(list_page))
+        return self._entry(tenant_id).by_name.get(name)
+
+    async def resolve_async(self, tenant_id: str, name: str, list_page) -> str | None:
+        pid = self.lookup(tenant_id, name)
+        if pid is not None:
+            self.stats["hits"] += 1
+            return pid
+        self.stats["misses"] += 1
+        # un solo List por tenant aunque lleguen muchos registros a la vez
+        lock = self._alocks.setdefault(tenant_id, asyncio.Lock())
+        async with lock:
+            pid = self.lookup(tenant_id, name)
+            if pid is not None:
+                return pid
+            if self._should_list(tenant_id):
+                self.replace(tenant_id, await list_all_async(list_page))
+        return self._entry(tenant_id).by_name.get(name)
+
+    async def warm_from_snapshots(self, collection) -> int:
+        """Precarga desde device_profiles_collection (docs con chirpstack_tenant_id/profile_name/device_profile_id)."""
+        n = 0
+        projection = {"chirpstack_tenant_id": 1, "profile_name": 1, "device_profile_id": 1}
+        async for doc in collection.find({"device_profile_id": {"$ne": None}}, projection):
+            tid, name, pid = doc.get("chirpstack_tenant_id"), doc.get("profile_name"), doc.get("device_profile_id")
+            if tid and name and pid:
+                self.put(tid, name, pid)
+                n += 1
+        return n
+
+
+# Índice compartido del proceso
+profile_index = ProfileIndex()
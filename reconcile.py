@@ -0,0 +1,291 @@
+# reconcile.py
+# Reconciliación Mongo ↔ ChirpStack, tenant por tenant.
+#
+# Para cada tenant de Mongo (con chirpstack_tenant_id):
+#   - ChirpStack se recorre página a página con los List existentes
+#     (devices de la application vía dev_sidecar, gateways vía gw_sidecar,
+#     device profiles vía gRPC) y se guarda solo la clave → (id de profile, nombre).
+#   - Mongo se recorre con un cursor por tenant (projection mínima) y se va
+#     tachando del lado ChirpStack; lo que sobra en cada lado es la diferencia.
+#   Memoria: proporcional a las claves de UN tenant, nunca a toda la base.
+#
+# Acciones (emitidas siempre; aplicadas solo con apply=True):
+#   import_device / import_gateway     existe en ChirpStack, falta en Mongo → se crea el espejo
+#   mark_missing                       existe en Mongo, falta en ChirpStack → status "missing_in_chirpstack"
+#   mark_active                        marcado como missing pero ya existe en ChirpStack
+#   update_profile                     el device_profile_id de Mongo no coincide con ChirpStack
+#   drop_profile_snapshot              snapshot de device_profiles cuyo id ya no existe en ChirpStack
+#   tenant_missing                     el tenant de ChirpStack no existe (solo se informa)
+# Nada se borra de ChirpStack: los dispositivos físicos mandan.
+#
+# Uso:
+#   python -m reconcile [--tenant-id <Mongo id>] [--apply] [--concurrency 8]
+#   (imprime una acción por línea en JSON y un resumen al final)
+# o como job "reconcile" (POST /tenants/{tenant_id}/reconcile): informa progreso
+# (y renueva el lease) tras cada página de ChirpStack y cada tenant.
+#
+# ENV:
+#   RECONCILE_PAGE_SIZE     tamaño de página de los List (default 200)
+#   RECONCILE_CONCURRENCY   acciones aplicadas en paralelo (default 8)
+#   RECONCILE_REPORT_LIMIT  acciones guardadas en el resultado del job (default 500)
+import argparse, asyncio, json, os, sys
+from datetime import datetime, timezone
+
+from grpc import RpcError
+
+from db import tenants_collection, devices_collection, device_profiles_collection
+from chirpstack_grpc import AsyncChirpstackGRPCClient
+from sidecar_runner import run_sidecar, DEV_SIDECAR, GW_SIDECAR
+from profile_index import profile_index
+
+RECONCILE_PAGE_SIZE = int(os.getenv("RECONCILE_PAGE_SIZE", "200"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "8"))
+RECONCILE_REPORT_LIMIT = int(os.getenv("RECONCILE_REPORT_LIMIT", "500"))
+
+MISSING_STATUS = "missing_in_chirpstack"
+
+
+class ReconcileError(Exception):
+    pass
+
+
+class Reconciler:
+    def __init__(self, apply: bool = False, concurrency: int = RECONCILE_CONCURRENCY,
+                 page_size: int = RECONCILE_PAGE_SIZE, emit=None, progress=None):
+        self.apply = apply
+        self.page_size = page_size
+        self.emit = emit  # async callable(action) opcional
+        self.progress = progress  # async callable(**stats) opcional, por tenant y por página
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._pending: set[asyncio.Task] = set()
+        self.stats: dict[str, int] = {"tenants": 0, "actions": 0, "applied": 0, "errors": 0}
+
+    # ── ChirpStack, por páginas ───────────────────
+    async def _sidecar_pages(self, module: str, base_args: list[str]):
+        offset = 0
+        while True:
+            out = await run_sidecar(module, base_args + ["--limit", str(self.page_size), "--offset", str(offset)])
+            if not out.get("ok"):
+                raise ReconcileError(f"{module}: {out.get('error')}")
+            items = out.get("items") or []
+            await self._report()
+            if items:
+                yield items
+            offset += len(items)
+            total = out.get("total_count")
+            if not items or (total is not None and offset >= total):
+                return
+
+    async def _report(self):
+        if self.progress:
+            await self.progress(**self.stats)
+
+    async def _cs_devices(self, app_id: str) -> dict[str, dict]:
+        out = {}
+        async for page in self._sidecar_pages(DEV_SIDECAR, ["list", "--application-id", app_id]):
+            for d in page:
+                out[d["dev_eui"].upper()] = {"profile_id": d.get("device_profile_id"), "name": d.get("name")}
+        return out
+
+    async def _cs_gateways(self, cs_tenant_id: str) -> dict[str, dict]:
+        out = {}
+        async for page in self._sidecar_pages(GW_SIDECAR, ["list", "--tenant-id", cs_tenant_id]):
+            for g in page:
+                out[g["gateway_id"].upper()] = {"name": g.get("name"), "description": g.get("description")}
+        return out
+
+    async def _cs_profiles(self, cs: AsyncChirpstackGRPCClient, cs_tenant_id: str) -> dict[str, str]:
+        out, offset = {}, 0
+        while True:
+            resp = await cs.list_device_profiles(cs_tenant_id, limit=self.page_size, offset=offset)
+            await self._report()
+            for p in resp.result:
+                out[p.id] = p.name
+            offset += len(resp.result)
+            if not resp.result or offset >= resp.total_count:
+                return out
+
+    # ── acciones ──────────────────────────────────
+    async def _action(self, action: dict):
+        self.stats["actions"] += 1
+        self.stats[action["action"]] = self.stats.get(action["action"], 0) + 1
+        if self.emit:
+            await self.emit(action)
+        if not self.apply or action["action"] == "tenant_missing":
+            return
+        # acotado: como mucho `concurrency` escrituras en vuelo
+        await self._sem.acquire()
+        task = asyncio.create_task(self._apply(action))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _apply(self, action: dict):
+        try:
+            kind = action["action"]
+            now = datetime.now(timezone.utc)
+            if kind in {"import_device", "import_gateway"}:
+                await devices_collection.insert_one(action["doc"])
+            elif kind == "mark_missing":
+                await devices_collection.update_one({"_id": action["_id"]}, {"$set": {"status": MISSING_STATUS, "reconciled_at": now}})
+            elif kind == "mark_active":
+                await devices_collection.update_one({"_id": action["_id"]}, {"$set": {"status": "active", "reconciled_at": now}})
+            elif kind == "update_profile":
+                await devices_collection.update_one({"_id": action["_id"]}, {"$set": {
+                    "meta.device_profile_id": action["chirpstack"], "reconciled_at": now,
+                }})
+            elif kind == "drop_profile_snapshot":
+                await device_profiles_collection.delete_one({"_id": action["_id"]})
+                profile_index.invalidate(action["chirpstack_tenant_id"])
+            self.stats["applied"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"🔴 Reconcile: {action['action']} {action.get('key')}: {e}")
+        finally:
+            self._sem.release()
+
+    async def _drain(self):
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    # ── diff por tenant ───────────────────────────
+    async def reconcile_tenant(self, tenant: dict):
+        tenant_id = str(tenant["_id"])
+        cs_tenant_id = tenant.get("chirpstack_tenant_id")
+        app_id = tenant.get("chirpstack_app_id")
+        base = {"tenant_id": tenant_id, "chirpstack_tenant_id": cs_tenant_id}
+        cs = AsyncChirpstackGRPCClient()
+        self.stats["tenants"] += 1
+
+        try:
+            await cs.get_tenant(cs_tenant_id)
+        except RpcError as e:
+            if e.code().name == "NOT_FOUND":
+                await self._action({**base, "kind": "tenant", "key": cs_tenant_id, "action": "tenant_missing"})
+                return
+            raise
+
+        now = datetime.now(timezone.utc)
+
+        # device profiles: snapshots de Mongo vs ChirpStack
+        profiles = await self._cs_profiles(cs, cs_tenant_id)
+        async for snap in device_profiles_collection.find(
+            {"tenant_id": {"$in": [tenant_id, cs_tenant_id]}}, {"device_profile_id": 1, "profile_name": 1}
+        ):
+            if snap.get("device_profile_id") not in profiles:
+                await self._action({**base, "kind": "device_profile", "key": snap.get("device_profile_id"),
+                                    "action": "drop_profile_snapshot", "_id": snap["_id"],
+                                    "profile_name": snap.get("profile_name")})
+
+        # gateways
+        cs_gws = await self._cs_gateways(cs_tenant_id)
+        async for d in devices_collection.find(
+            {"tenant_id": tenant_id, "type": "gateway"}, {"dev_eui": 1, "status": 1}
+        ):
+            key = (d.get("dev_eui") or "").upper()
+            if cs_gws.pop(key, None) is None:
+                if d.get("status") != MISSING_STATUS:
+                    await self._action({**base, "kind": "gateway", "key": key, "action": "mark_missing", "_id": d["_id"]})
+            elif d.get("status") == MISSING_STATUS:
+                await self._action({**base, "kind": "gateway", "key": key, "action": "mark_active", "_id": d["_id"]})
+        for key, g in cs_gws.items():
+            await self._action({**base, "kind": "gateway", "key": key, "action": "import_gateway", "doc": {
+                "tenant_id": tenant_id, "dev_eui": key, "name": g.get("name") or key, "type": "gateway",
+                "status": "active", "location": "", "created_at": now,
+                "meta": {"chirpstack_tenant_id": cs_tenant_id, "description": g.get("description") or "",
+                         "tags": {}, "reconciled": True},
+            }})
+        del cs_gws
+
+        # devices (sensores) de la application del tenant
+        if not app_id:
+            return
+        cs_devs = await self._cs_devices(app_id)
+        async for d in devices_collection.find(
+            {"tenant_id": tenant_id, "type": {"$ne": "gateway"}},
+            {"dev_eui": 1, "status": 1, "meta.device_profile_id": 1},
+        ):
+            key = (d.get("dev_eui") or "").upper()
+            cs_dev = cs_devs.pop(key, None)
+            if cs_dev is None:
+                if d.get("status") != MISSING_STATUS:
+                    await self._action({**base, "kind": "device", "key": key, "action": "mark_missing", "_id": d["_id"]})
+                continue
+            if d.get("status") == MISSING_STATUS:
+                await self._action({**base, "kind": "device", "key": key, "action": "mark_active", "_id": d["_id"]})
+            mongo_pid = (d.get("meta") or {}).get("device_profile_id")
+            if mongo_pid and cs_dev["profile_id"] and mongo_pid != cs_dev["profile_id"]:
+                await self._action({**base, "kind": "device", "key": key, "action": "update_profile",
+                                    "_id": d["_id"], "mongo": mongo_pid, "chirpstack": cs_dev["profile_id"]})
+        for key, dev in cs_devs.items():
+            profile_name = profiles.get(dev["profile_id"])
+            await self._action({**base, "kind": "device", "key": key, "action": "import_device", "doc": {
+                "tenant_id": tenant_id, "dev_eui": key, "name": dev.get("name") or key,
+                "type": profile_name or "unknown", "status": "active", "location": "", "created_at": now,
+                "meta": {"chirpstack_tenant_id": cs_tenant_id, "chirpstack_app_id": app_id,
+                         "device_profile_name": profile_name, "device_profile_id": dev["profile_id"],
+                         "reconciled": True},
+            }})
+
+    async def run(self, tenant_id: str | None = None) -> dict:
+        query = {"chirpstack_tenant_id": {"$nin": [None, ""]}, "status": {"$ne": "deleting"}}
+        if tenant_id:
+            from bson import ObjectId
+            query["_id"] = ObjectId(tenant_id)
+        try:
+            async for tenant in tenants_collection.find(query):
+                try:
+                    await self.reconcile_tenant(tenant)
+                except (ReconcileError, RpcError) as e:
+                    self.stats["errors"] += 1
+                    print(f"🔴 Reconcile: tenant {tenant['_id']}: {e}")
+                await self._report()
+        finally:
+            await self._drain()
+        return dict(self.stats)
+
+
+def action_to_api(action: dict) -> dict:
+    """Acción serializable (sin ObjectId/datetime ni el doc completo)."""
+    return {k: (str(v) if k == "_id" else v) for k, v in action.items() if k != "doc"}
+
+
+# ────────────────────────────────────────────────
+# 🧰 Job "reconcile" (ver jobs.py)
+# ────────────────────────────────────────────────
+async def reconcile_job(ctx) -> dict:
+    actions: list[dict] = []
+
+    async def _collect(action):
+        if len(actions) < RECONCILE_REPORT_LIMIT:
+            actions.append(action_to_api(action))
+
+    async def _progress(**stats):
+        # renueva el lease del job además del heartbeat del worker
+        await ctx.progress("reconcile", **stats)
+
+    rec = Reconciler(apply=bool(ctx.params.get("apply")), emit=_collect, progress=_progress)
+    await ctx.progress("reconcile")
+    stats = await rec.run(ctx.params.get("tenant_id"))
+    await ctx.progress("reconcile", "done", **stats)
+    return {"stats": stats, "actions": actions, "truncated": stats["actions"] > len(actions)}
+
+
+async def _main(args):
+    async def _print(action):
+        print(json.dumps(action_to_api(action), default=str), flush=True)
+
+    rec = Reconciler(apply=args.apply, concurrency=args.concurrency, emit=_print)
+    stats = await rec.run(args.tenant_id or None)
+    print(json.dumps({"summary": stats, "applied": args.apply}), file=sys.stderr)
+
+
+def main():
+    p = argparse.ArgumentParser(prog="reconcile", description="Reconciliación Mongo ↔ ChirpStack")
+    p.add_argument("--tenant-id", default="", help="solo este tenant (Mongo _id)")
+    p.add_argument("--apply", action="store_true", help="aplicar las acciones (por defecto solo se listan)")
+    p.add_argument("--concurrency", type=int, default=RECONCILE_CONCURRENCY)
+    asyncio.run(_main(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+# rollups.py
+# Pre-agregados incrementales de telemetría (1m / 1h / 1d) por dispositivo.
+#
+# Cada colección mqtt_rollups_<intervalo> guarda un doc por (device_eui, bucket):
+#   {
+#     "device_eui": ..., "tenant_id": ..., "bucket": datetime (UTC, inicio del intervalo),
+#     "count": n, "last_seen": datetime,
+#     "fields": {"<campo numérico>": {"min": .., "max": .., "sum": .., "count": ..}}
+#   }
+#
+# El ingestor llama a RollupMaterializer.apply() tras cada insert_many: el lote se
+# pre-agrega en memoria y se aplica con un bulk_write de upserts $inc/$min/$max
+# (una operación por bucket tocado, no por uplink).
+#
+# Marca de agua (colección mqtt_rollups_state, un doc por intervalo):
+#   live_since       primer bucket completo mantenido por el ingestor (límite siguiente a
+#                    su primer lote); desde ahí los rollups están al día.
+#   complete_since   inicio del último backfill global que llegó hasta live_since.
+# El API solo sirve source=auto desde rollups si el rango empieza en o después de
+# complete_since (o live_since si nunca hubo backfill): el histórico previo o migrado
+# sigue saliendo de la telemetría cruda.
+#
+# Reconstrucción desde mqtt_data:
+#   python -m rollups backfill [--device-eui X | --tenant-id T] [--from ISO] [--to ISO] [--intervals 1m,1h,1d] [--force]
+# El backfill se detiene en live_since (los buckets posteriores los mantiene el ingestor
+# con $inc: borrarlos y reconstruirlos en paralelo contaría dos veces). --force reconstruye
+# también esos buckets: solo con la ingesta parada (p.ej. tras un periodo con ROLLUPS_ENABLED=0).
+#
+# ENV:
+#   ROLLUPS_ENABLED     1 = el ingestor mantiene rollups y el API los lee (default 1)
+#   ROLLUP_INTERVALS    intervalos a mantener (default 1m,1h,1d)
+import argparse, asyncio, os, time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from telemetry import (
+    META_FIELD, TIME_FIELD, TELEMETRY_COLLECTION, parse_timestamp, parse_time_param, build_query,
+    bucket_to_api, default_window, check_window, MAX_BUCKET_ROWS,
+)
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1") != "0"
+ROLLUP_SECONDS = {"1m": 60, "1h": 3600, "1d": 86400}
+ROLLUP_INTERVALS = [i for i in os.getenv("ROLLUP_INTERVALS", "1m,1h,1d").split(",") if i in ROLLUP_SECONDS]
+
+# campos del uplink que nunca se resumen
+_SKIP_FIELDS = {"_id", TIME_FIELD, META_FIELD, "topic", "device_eui", "tenant_id"}
+
+_BACKFILL_BATCH = 5000
+
+STATE_COLLECTION = "mqtt_rollups_state"
+_WATERMARK_TTL_S = 30.0
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# (keys, name, opciones) por colección mqtt_rollups_<intervalo>
+ROLLUP_INDEXES = [
+    ([("device_eui", ASCENDING), ("bucket", ASCENDING)], "device_bucket_unique", {"unique": True}),
+    ([("tenant_id", ASCENDING), ("bucket", ASCENDING)], "tenant_bucket", {}),
+]
+
+
+def rollup_collection_name(interval: str) -> str:
+    return f"mqtt_rollups_{interval}"
+
+
+def bucket_start(ts: datetime, interval: str) -> datetime:
+    secs = ROLLUP_SECONDS[interval]
+    epoch = int(parse_timestamp(ts).timestamp())
+    return datetime.fromtimestamp(epoch - epoch % secs, tz=timezone.utc)
+
+
+def numeric_fields(doc: dict) -> dict:
+    """Campos numéricos de primer nivel (sin bool, sin nombres con '.' o '$')."""
+    return {
+        k: v for k, v in doc.items()
+        if k not in _SKIP_FIELDS and isinstance(v, (int, float)) and not isinstance(v, bool)
+        and "." not in k and not k.startswith("$")
+    }
+
+
+class _Partial:
+    __slots__ = ("tenant_id", "count", "last_seen", "fields")
+
+    def __init__(self, tenant_id):
+        self.tenant_id = tenant_id
+        self.count = 0
+        self.last_seen = None
+        self.fields: dict[str, list] = {}  # nombre → [min, max, sum, count]
+
+    def add(self, ts: datetime, values: dict):
+        self.count += 1
+        if self.last_seen is None or ts > self.last_seen:
+            self.last_seen = ts
+        for k, v in values.items():
+            f = self.fields.get(k)
+            if f is None:
+                self.fields[k] = [v, v, v, 1]
+            else:
+                if v < f[0]:
+                    f[0] = v
+                if v > f[1]:
+                    f[1] = v
+                f[2] += v
+                f[3] += 1
+
+    def update(self) -> dict:
+        inc = {"count": self.count}
+        mins, maxs = {}, {"last_seen": self.last_seen}
+        for k, (mn, mx, sm, n) in self.fields.items():
+            mins[f"fields.{k}.min"] = mn
+            maxs[f"fields.{k}.max"] = mx
+            inc[f"fields.{k}.sum"] = sm
+            inc[f"fields.{k}.count"] = n
+        upd = {"$inc": inc, "$max": maxs}
+        if mins:
+            upd["$min"] = mins
+        if self.tenant_id:
+            upd["$setOnInsert"] = {"tenant_id": self.tenant_id}
+        return upd
+
+
+class RollupMaterializer:
+    def __init__(self, db, intervals: list[str] | None = None):
+        self.db = db
+        self.intervals = intervals or ROLLUP_INTERVALS
+        self.stats = {"docs": 0, "upserts": 0, "errors": 0}
+        self._live_marked = False
+
+    async def mark_live(self, now: datetime | None = None):
+        """Registra live_since: el ingestor mantiene cada intervalo desde el bucket siguiente."""
+        now = now or datetime.now(timezone.utc)
+        try:
+            for interval in self.intervals:
+                boundary = bucket_start(now, interval) + timedelta(seconds=ROLLUP_SECONDS[interval])
+                await self.db[STATE_COLLECTION].update_one(
+                    {"_id": interval}, {"$min": {"live_since": boundary}}, upsert=True)
+            self._live_marked = True
+        except PyMongoError as e:
+            print(f"🔴 Rollups: no se pudo registrar live_since: {e}")
+
+    async def ensure_indexes(self):
+        for interval in self.intervals:
+            coll = self.db[rollup_collection_name(interval)]
+            for keys, name, opts in ROLLUP_INDEXES:
+                await coll.create_index(keys, name=name, **opts)
+
+    def _accumulate(self, docs: list[dict], windows: dict | None = None) -> dict[str, dict]:
+        acc: dict[str, dict] = {i: {} for i in (windows or self.intervals)}
+        for doc in docs:
+            meta = doc.get(META_FIELD) or {}
+            eui = meta.get("device_eui")
+            if not eui:
+                continue
+            ts = parse_timestamp(doc.get(TIME_FIELD))
+            values = numeric_fields(doc)
+            for interval in acc:
+                key = (eui, bucket_start(ts, interval))
+                if windows and not _in_window(key[1], windows[interval]):
+                    continue
+                part = acc[interval].get(key)
+                if part is None:
+                    part = acc[interval][key] = _Partial(meta.get("tenant_id"))
+                part.add(ts, values)
+        return acc
+
+    async def apply(self, docs: list[dict], windows: dict | None = None):
+        """
+        Aplica un lote de docs (esquema time-series) a todos los intervalos, o solo a los
+        buckets dentro de windows {intervalo: (desde, hasta)} (backfill).
+        """
+        if not docs:
+            return
+        if windows is None and not self._live_marked:
+            await self.mark_live()
+        acc = self._accumulate(docs, windows)
+        self.stats["docs"] += len(docs)
+        for interval, parts in acc.items():
+            if not parts:
+                continue
+            ops = [
+                UpdateOne({"device_eui": eui, "bucket": bucket}, part.update(), upsert=True)
+                for (eui, bucket), part in parts.items()
+            ]
+            try:
+                await self.db[rollup_collection_name(interval)].bulk_write(ops, ordered=False)
+                self.stats["upserts"] += len(ops)
+            except BulkWriteError as e:
+                # carreras de upsert concurrentes (duplicate key) → se reintenta esa op
+                errors = (e.details or {}).get("writeErrors", [])
+                retry = [ops[err["index"]] for err in errors if err.get("code") == 11000]
+                self.stats["errors"] += len(errors) - len(retry)
+                if retry:
+                    await self.db[rollup_collection_name(interval)].bulk_write(retry, ordered=False)
+                self.stats["upserts"] += len(ops) - (len(errors) - len(retry))
+            except PyMongoError as e:
+                self.stats["errors"] += len(ops)
+                print(f"🔴 Rollups {interval}: error en bulk_write ({len(ops)} ops): {e}")
+
+    async def backfill(self, meta: dict | None = None, start: datetime | None = None,
+                       end: datetime | None = None, batch_size: int = _BACKFILL_BATCH,
+                       force: bool = False) -> int:
+        """
+        Reconstruye rollups desde mqtt_data. Cada intervalo se alinea a su bucket para no
+        dejar buckets a medias; los rollups existentes en el rango se borran antes.
+        Sin force, el rango de cada intervalo termina en su live_since (los buckets
+        posteriores los mantiene el ingestor en vivo).
+        """
+        meta = meta or {}
+        states = {d["_id"]: d async for d in self.db[STATE_COLLECTION].find({"_id": {"$in": self.intervals}})}
+        started = datetime.now(timezone.utc)
+        windows = {}
+        for interval in self.intervals:
+            secs = ROLLUP_SECONDS[interval]
+            lo = bucket_start(start, interval) if start is not None else None
+            hi = None
+            if end is not None:
+                aligned = bucket_start(end, interval)
+                hi = aligned if aligned == parse_timestamp(end) else aligned + timedelta(seconds=secs)
+            if not force:
+                # sin ingestor registrado: hasta el bucket en curso al empezar (no incluido)
+                live = _aware((states.get(interval) or {}).get("live_since")) or bucket_start(started, interval)
+                hi = live if hi is None else min(hi, live)
+            if lo is not None and hi is not None and lo >= hi:
+                print(f"ℹ️  Backfill {interval}: nada que reconstruir antes de live_since ({hi.isoformat()})")
+                continue
+            windows[interval] = (lo, hi)
+        if not windows:
+            return 0
+
+        for interval, (lo, hi) in windows.items():
+            rollup_filter = dict(meta)
+            rng = _range(lo, hi)
+            if rng:
+                rollup_filter["bucket"] = rng
+            await self.db[rollup_collection_name(interval)].delete_many(rollup_filter)
+
+        los = [w[0] for w in windows.values()]
+        his = [w[1] for w in windows.values()]
+        scan_start = None if None in los else min(los)
+        scan_end = None if None in his else max(his)
+        cursor = self.db[TELEMETRY_COLLECTION].find(build_query(meta, scan_start, scan_end)).batch_size(batch_size)
+        batch, total = [], 0
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await self.apply(batch, windows)
+                total += len(batch)
+                batch = []
+        if batch:
+            await self.apply(batch, windows)
+            total += len(batch)
+
+        # marca de agua: solo un backfill global que enlaza con la ingesta en vivo
+        if not meta:
+            for interval, (lo, hi) in windows.items():
+                live = _aware((states.get(interval) or {}).get("live_since"))
+                if (force and end is None) or (live is not None and hi == live):
+                    await self.db[STATE_COLLECTION].update_one(
+                        {"_id": interval}, {"$min": {"complete_since": lo or _EPOCH}}, upsert=True)
+            _watermarks.clear()
+        return total
+
+
+def _aware(dt: datetime | None) -> datetime | None:
+    # pymongo devuelve datetimes naive (UTC) salvo tz_aware=True
+    return dt.replace(tzinfo=timezone.utc) if dt is not None and dt.tzinfo is None else dt
+
+
+def _range(lo: datetime | None, hi: datetime | None) -> dict:
+    rng = {}
+    if lo is not None:
+        rng["$gte"] = lo
+    if hi is not None:
+        rng["$lt"] = hi
+    return rng
+
+
+def _in_window(bucket: datetime, window: tuple) -> bool:
+    lo, hi = window
+    return (lo is None or bucket >= lo) and (hi is None or bucket < hi)
+
+
+# ────────────────────────────────────────────────
+# 📖 Lectura: buckets desde rollups (mismo formato que telemetry.aggregate_buckets)
+# ────────────────────────────────────────────────
+# intervalo pedido → (colección de rollup, unit, binSize) para re-agrupar
+_READ_PLAN = {
+    "1m": ("1m", "minute", 1),
+    "5m": ("1m", "minute", 5),
+    "1h": ("1h", "hour", 1),
+    "1d": ("1d", "day", 1),
+}
+
+
+# intervalo de rollup → (marca de agua, expira); la marca solo baja con un backfill
+_watermarks: dict[str, tuple[datetime | None, float]] = {}
+
+
+async def watermark(db, interval: str) -> datetime | None:
+    """Desde cuándo los rollups de 'interval' están completos (None = aún no se sabe)."""
+    cached = _watermarks.get(interval)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    state = await db[STATE_COLLECTION].find_one({"_id": interval}) or {}
+    mark = _aware(state.get("complete_since") or state.get("live_since"))
+    _watermarks[interval] = (mark, time.monotonic() + _WATERMARK_TTL_S)
+    return mark
+
+
+async def can_serve(db, interval: str, start: datetime, fields: list[str] | None = None) -> bool:
+    """
+    True si los rollups dan el mismo resultado que la telemetría cruda: solo guardan campos
+    numéricos de primer nivel y solo desde su marca de agua.
+    """
+    source = _READ_PLAN.get(interval, ("",))[0]
+    if not ROLLUPS_ENABLED or source not in ROLLUP_INTERVALS:
+        return False
+    if any("." in f or f.startswith("$") for f in fields or []):
+        return False
+    mark = await watermark(db, source)
+    return mark is not None and start >= mark
+
+
+def build_rollup_pipeline(meta: dict, interval: str, start: datetime, end: datetime,
+                          fields: list[str] | None = None, by_device: bool = False) -> list[dict]:
+    _, unit, bin_size = _READ_PLAN[interval]
+    group_id = {"t": {"$dateTrunc": {"date": "$bucket", "unit": unit, "binSize": bin_size}}}
+    if by_device:
+        group_id["device_eui"] = "$device_eui"
+    group = {"_id": group_id, "count": {"$sum": "$count"}}
+    for i, field in enumerate(fields or []):
+        group[f"f{i}_min"] = {"$min": f"$fields.{field}.min"}
+        group[f"f{i}_max"] = {"$max": f"$fields.{field}.max"}
+        group[f"f{i}_sum"] = {"$sum": f"$fields.{field}.sum"}
+        group[f"f{i}_n"] = {"$sum": f"$fields.{field}.count"}
+    match = dict(meta)
+    match["bucket"] = {"$gte": start, "$lt": end}
+    return [
+        {"$match": match},
+        {"$group": group},
+        {"$sort": {"_id.t": 1}},
+        {"$limit": MAX_BUCKET_ROWS + 1},
+    ]
+
+
+async def read_buckets(db, meta: dict, interval: str, start: datetime, end: datetime,
+                       fields: list[str] | None = None, by_device: bool = False) -> list[dict]:
+    source = _READ_PLAN[interval][0]
+    pipeline = build_rollup_pipeline(meta, interval, start, end, fields, by_device)
+    rows = await db[rollup_collection_name(source)].aggregate(pipeline).to_list(None)
+    for r in rows:
+        for i, _ in enumerate(fields or []):
+            n = r.pop(f"f{i}_n", 0)
+            s = r.pop(f"f{i}_sum", 0)
+            r[f"f{i}_avg"] = (s / n) if n else None
+    return rows
+
+
+async def rollup_buckets(db, meta: dict, interval: str, start: datetime | None = None,
+                         end: datetime | None = None, fields: list[str] | None = None,
+                         by_device: bool = False) -> dict:
+    """Como telemetry.aggregate_buckets, pero leyendo las colecciones de rollups."""
+    if interval not in _READ_PLAN:
+        raise ValueError(f"interval inválido, usa uno de: {', '.join(_READ_PLAN)}")
+    start, end = default_window(interval, start, end)
+    check_window(interval, start, end)
+    rows = await read_buckets(db, meta, interval, start, end, fields, by_device)
+    return {
+        "interval": interval,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "source": "rollups",
+        "buckets": [bucket_to_api(r, fields) for r in rows[:MAX_BUCKET_ROWS]],
+        "truncated": len(rows) > MAX_BUCKET_ROWS,
+    }
+
+
+# ────────────────────────────────────────────────
+# 🛠️ CLI: backfill
+# ────────────────────────────────────────────────
+async def _backfill_cli(args):
+    from db import db
+    intervals = [i for i in args.intervals.split(",") if i in ROLLUP_SECONDS]
+    mat = RollupMaterializer(db, intervals)
+    await mat.ensure_indexes()
+    meta = {}
+    if args.device_eui:
+        meta["device_eui"] = args.device_eui
+    if args.tenant_id:
+        meta["tenant_id"] = args.tenant_id
+    total = await mat.backfill(
+        meta,
+        start=parse_time_param(args.from_) if args.from_ else None,
+        end=parse_time_param(args.to) if args.to else None,
+        force=args.force,
+    )
+    print(f"🟢 Backfill: {total} docs procesados, {mat.stats}")
+
+
+def main():
+    p = argparse.ArgumentParser(prog="rollups", description="Rollups de telemetría")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    p_bf = sub.add_parser("backfill", help="Reconstruye rollups desde mqtt_data")
+    scope = p_bf.add_mutually_exclusive_group()
+    scope.add_argument("--device-eui", default="")
+    scope.add_argument("--tenant-id", default="")
+    p_bf.add_argument("--from", dest="from_", default="")
+    p_bf.add_argument("--to", default="")
+    p_bf.add_argument("--intervals", default=",".join(ROLLUP_INTERVALS))
+    p_bf.add_argument("--force", action="store_true",
+                      help="reconstruye también desde live_since (solo con la ingesta parada)")
+    args = p.parse_args()
+    if args.cmd == "backfill":
+        asyncio.run(_backfill_cli(args))
+
+
+if __name__ == "__main__":
+    main()
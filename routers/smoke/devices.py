@@ -3,20 +3,12 @@
 from fastapi import APIRouter, Body, Query
 from bson import ObjectId
 from datetime import datetime, timezone
-import subprocess, sys, json, re, os
+import re
 
 from db import tenants_collection, devices_collection
-from chirpstack_grpc import ChirpstackGRPCClient
-
-def _sidecar_env():
-    env = os.environ.copy()
-    # Asegura que el intérprete del subproceso resuelva paquetes desde el root del proyecto
-    # (en Railway normalmente el working dir ya es /app; "." funciona también localmente)
-    env.setdefault("PYTHONPATH", ".")
-    # Si quieres más traza gRPC en caso de error, descomenta:
-    # env["GRPC_VERBOSITY"] = "DEBUG"
-    # env["GRPC_TRACE"] = "http,call_error,op_failure"
-    return env
+from chirpstack_grpc import AsyncChirpstackGRPCClient
+from sidecar_runner import run_sidecar, DEV_SIDECAR
+from tenant_access import invalidate_tenant
 
 router = APIRouter()
 
@@ -31,21 +23,13 @@ async def _dev_list_sidecar(
     Lista devices de una Application en ChirpStack vía sidecar.
     """
     try:
-        args = [sys.executable, "-m", "sidecars.dev_sidecar", "list",
+        args = ["list",
                 "--application-id", application_id,
                 "--limit", str(limit), "--offset", str(offset), "--search", search]
-        proc = subprocess.run(
-            args, capture_output=True, text=True, check=True, env=_sidecar_env()
-        )
-        return json.loads(proc.stdout or "{}")
-    except subprocess.CalledProcessError as e:
-        # ← aquí añadimos el comando real para depurar
-        raw = (e.stdout or e.stderr or "").strip()
-        try:
-            out = json.loads(raw or "{}")
-        except Exception:
-            out = {"ok": False, "error": raw or "sidecar failed"}
-        out["cmd"] = args
+        out = await run_sidecar(DEV_SIDECAR, args)
+        if not out.get("ok"):
+            # ← aquí añadimos el comando real para depurar
+            out["cmd"] = args
         return out
     except Exception as e:
         return {"ok": False, "error": str(e)}
@@ -96,7 +80,7 @@ async def _dev_smoke_create(body: dict = Body(...)):
         return {"ok": False, "error": "Tenant no encontrado"}
 
     try:
-        cs = ChirpstackGRPCClient()  # SOLO lecturas/ensure; la creación va por sidecar
+        cs = AsyncChirpstackGRPCClient()  # SOLO lecturas/ensure; la creación va por sidecar
 
         tenant_cs_id = tenant.get("chirpstack_tenant_id")
         if not tenant_cs_id:
@@ -105,16 +89,17 @@ async def _dev_smoke_create(body: dict = Body(...)):
         app_id = tenant.get("chirpstack_app_id")
         if not app_id:
             composed = tenant.get("chirpstack_tenant_name") or tenant.get("name") or "default-app"
-            app_id = cs.ensure_application_same_as_tenant(tenant_cs_id, composed)
+            app_id = await cs.ensure_application_same_as_tenant(tenant_cs_id, composed)
             await tenants_collection.update_one({"_id": oid}, {"$set": {"chirpstack_app_id": app_id}})
+            invalidate_tenant(oid)
 
         # Busca ID del Device Profile por nombre (método ya probado)
-        profile_id = cs.get_device_profile_id_by_name(profile, tenant_cs_id)
+        profile_id = await cs.get_device_profile_id_by_name(profile, tenant_cs_id)
         if not profile_id:
             return {"ok": False, "error": f"Device Profile '{profile}' no existe en tenant {tenant_cs_id}"}
 
         # -------- Build args para sidecar CREATE --------
-        args = [sys.executable, "-m", "sidecars.dev_sidecar", "create",
+        args = ["create",
                 "--application-id", app_id,
                 "--device-profile-id", profile_id,
                 "--dev-eui", dev_eui,
@@ -150,19 +135,9 @@ async def _dev_smoke_create(body: dict = Body(...)):
                 args += ["--join-eui", join_eui]
 
         # -------- Invocar sidecar --------
-        try:
-            proc = subprocess.run(args, capture_output=True, text=True, check=True, env=_sidecar_env())
-            out = json.loads(proc.stdout or "{}")
-        except subprocess.CalledProcessError as e:
-            raw = (e.stdout or e.stderr or "").strip()
-            try:
-                out = json.loads(raw or "{}")
-            except Exception:
-                out = {"ok": False, "error": raw or "sidecar failed"}
-            out["cmd"] = args
-            return out
-
+        out = await run_sidecar(DEV_SIDECAR, args)
         if not out.get("ok"):
+            out["cmd"] = args
             return out  # el sidecar ya trae {"ok":False,"error":...}
 
         # -------- Persistir en Mongo si Create fue OK --------
@@ -0,0 +1,149 @@
+# sidecar_pool.py
+# Pool de workers sidecar persistentes (python -m <sidecar> serve).
+#
+# Cada worker mantiene vivo su intérprete, los imports de grpc/protobuf y su
+# canal gRPC ya conectado; el API le envía comandos JSON-lines por stdin y lee
+# la respuesta por stdout. Así una ráfaga de aprovisionamiento no paga el
+# arranque de Python + canal nuevo en cada llamada.
+#
+# ENV:
+#   SIDECAR_POOL_SIZE     workers por módulo sidecar (default 2)
+import asyncio, itertools, json, os, sys, time
+
+from metrics import observe_sidecar_spawn
+from tracing import export_remote
+
+SIDECAR_POOL_SIZE = int(os.getenv("SIDECAR_POOL_SIZE", "2"))
+
+# Límite del StreamReader: los templates de device profile pueden superar los 64 KiB por defecto
+READ_LIMIT = 8 * 1024 * 1024
+
+
+class SidecarPoolError(RuntimeError):
+    """Fallo de transporte con el worker (murió, respuesta ilegible, etc.)."""
+
+
+def sidecar_env():
+    env = os.environ.copy()
+    # El worker debe resolver paquetes desde el root del proyecto (sidecars.*, grpc_auth_interceptor)
+    env.setdefault("PYTHONPATH", ".")
+    return env
+
+
+class _Worker:
+    def __init__(self, module: str):
+        self.module = module
+        self.proc: asyncio.subprocess.Process | None = None
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        t0 = time.perf_counter()
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", self.module, "serve",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=sidecar_env(),
+            limit=READ_LIMIT,
+        )
+        observe_sidecar_spawn(self.module, "pool", time.perf_counter() - t0)
+
+    async def request(self, req_id: int, argv: list[str], traceparent: str | None = None) -> dict:
+        if not self.alive:
+            await self.start()
+        req = {"id": req_id, "argv": argv}
+        if traceparent:
+            req["traceparent"] = traceparent
+        line = json.dumps(req) + "\n"
+        self.proc.stdin.write(line.encode())
+        await self.proc.stdin.drain()
+        raw = await self.proc.stdout.readline()
+        if not raw:
+            raise SidecarPoolError(f"{self.module}: worker terminó sin responder")
+        msg = json.loads(raw)
+        if msg.get("id") != req_id:
+            raise SidecarPoolError(f"{self.module}: respuesta desincronizada")
+        export_remote(msg.get("spans"))
+        return msg.get("result") or {}
+
+    async def stop(self):
+        if self.proc is None or self.proc.returncode is not None:
+            return
+        try:
+            self.proc.stdin.close()
+            await asyncio.wait_for(self.proc.wait(), timeout=2)
+        except Exception:
+            self.kill()
+
+    def kill(self):
+        if self.proc is not None and self.proc.returncode is None:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+        self.proc = None  # el próximo request relanza el worker
+
+
+class SidecarPool:
+    """
+    N workers por módulo; cada worker atiende un comando a la vez.
+    Los workers se levantan bajo demanda y se relanzan si mueren.
+    """
+
+    def __init__(self, module: str, size: int = SIDECAR_POOL_SIZE):
+        self.module = module
+        self.size = max(1, size)
+        self._idle: asyncio.Queue[_Worker] = asyncio.Queue()
+        for _ in range(self.size):
+            self._idle.put_nowait(_Worker(module))
+        self._ids = itertools.count(1)
+
+    async def warm(self):
+        """Arranca todos los workers ahora (en vez de en la primera llamada)."""
+        workers = [self._idle.get_nowait() for _ in range(self._idle.qsize())]
+        try:
+            await asyncio.gather(*(w.start() for w in workers if not w.alive))
+        finally:
+            for w in workers:
+                self._idle.put_nowait(w)
+
+    async def call(self, argv: list[str], traceparent: str | None = None) -> dict:
+        """Envía argv (los mismos args del CLI) a un worker libre y devuelve su dict de salida."""
+        worker = await self._idle.get()
+        try:
+            return await worker.request(next(self._ids), [str(a) for a in argv], traceparent)
+        except SidecarPoolError:
+            worker.kill()
+            raise
+        except (BrokenPipeError, ConnectionResetError, ValueError) as e:
+            # pipe roto o JSON inválido → se descarta el worker; el próximo uso lo relanza
+            worker.kill()
+            raise SidecarPoolError(f"{self.module}: {e}") from e
+        except BaseException:
+            # cancelación a mitad de request: el worker queda con una respuesta pendiente
+            worker.kill()
+            raise
+        finally:
+            self._idle.put_nowait(worker)
+
+    async def close(self):
+        workers = [self._idle.get_nowait() for _ in range(self._idle.qsize())]
+        await asyncio.gather(*(w.stop() for w in workers), return_exceptions=True)
+
+
+_pools: dict[str, SidecarPool] = {}
+
+
+def get_pool(module: str) -> SidecarPool:
+    pool = _pools.get(module)
+    if pool is None:
+        pool = _pools[module] = SidecarPool(module)
+    return pool
+
+
+async def close_pools():
+    await asyncio.gather(*(p.close() for p in _pools.values()), return_exceptions=True)
+    _pools.clear()
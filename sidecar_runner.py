@@ -0,0 +1,156 @@
+# sidecar_runner.py
+# Punto único para invocar sidecars desde código async (endpoints, crud).
+#
+# - Nunca bloquea el event loop: usa el pool de workers (sidecar_pool.py) o,
+#   si SIDECAR_POOL_ENABLED=0, un subproceso asyncio de un solo uso.
+# - Timeout por llamada; al vencer o al cancelarse la request se mata el proceso.
+# - Límite global de llamadas concurrentes (SIDECAR_MAX_CONCURRENCY).
+# - Errores estructurados: siempre devuelve un dict {"ok": ..., "code": ..., "error": ...}
+#   en vez de lanzar, para que cada call site decida el status HTTP.
+#
+# ENV:
+#   SIDECAR_TIMEOUT_S         timeout por llamada en segundos (default 30)
+#   SIDECAR_MAX_CONCURRENCY   llamadas simultáneas máximas (default 16)
+#   SIDECAR_POOL_ENABLED      1 = workers persistentes, 0 = un proceso por llamada (default 1)
+import asyncio, json, os, re, sys, time
+
+from metrics import observe_sidecar_call, observe_sidecar_spawn
+from tracing import span, export_remote, CLIENT
+from sidecar_pool import get_pool, SidecarPoolError, sidecar_env, READ_LIMIT
+
+SIDECAR_TIMEOUT_S = float(os.getenv("SIDECAR_TIMEOUT_S", "30"))
+SIDECAR_MAX_CONCURRENCY = int(os.getenv("SIDECAR_MAX_CONCURRENCY", "16"))
+SIDECAR_POOL_ENABLED = os.getenv("SIDECAR_POOL_ENABLED", "1") != "0"
+
+GW_SIDECAR = "gw_sidecar"
+DP_SIDECAR = "dp_sidecar"
+DEV_SIDECAR = "sidecars.dev_sidecar"
+
+_semaphore: asyncio.Semaphore | None = None
+
+# "gRPC NOT_FOUND: ..." (formato de los sidecars) → code
+_GRPC_CODE_RE = re.compile(r"gRPC ([A-Z_]+):")
+_GRPC_TO_CODE = {
+    "NOT_FOUND": "not_found",
+    "ALREADY_EXISTS": "already_exists",
+    "INVALID_ARGUMENT": "invalid_argument",
+    "UNAUTHENTICATED": "unauthenticated",
+    "PERMISSION_DENIED": "permission_denied",
+    "DEADLINE_EXCEEDED": "timeout",
+    "UNAVAILABLE": "chirpstack_unavailable",
+}
+
+# code → status HTTP sugerido para los endpoints
+_CODE_TO_HTTP = {
+    "not_found": 404,
+    "already_exists": 409,
+    "invalid_argument": 400,
+    "bad_request": 400,
+    "unauthenticated": 502,
+    "permission_denied": 502,
+    "chirpstack_error": 502,
+    "chirpstack_unavailable": 503,
+    "sidecar_unavailable": 503,
+    "bad_output": 502,
+    "timeout": 504,
+}
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(1, SIDECAR_MAX_CONCURRENCY))
+    return _semaphore
+
+
+def _error(code: str, msg: str) -> dict:
+    return {"ok": False, "code": code, "error": msg}
+
+
+def _classify(out: dict) -> dict:
+    """Añade 'code' a los errores funcionales que devuelven los sidecars."""
+    if out.get("ok") or out.get("code"):
+        return out
+    msg = str(out.get("error") or "")
+    m = _GRPC_CODE_RE.search(msg)
+    if m:
+        out["code"] = _GRPC_TO_CODE.get(m.group(1), "chirpstack_error")
+    elif "no existe" in msg or "no encontrado" in msg or "not found" in msg.lower():
+        out["code"] = "not_found"
+    else:
+        out["code"] = "bad_request"
+    return out
+
+
+def http_status_for(out: dict, default: int = 502) -> int:
+    """Status HTTP sugerido para un resultado fallido de run_sidecar."""
+    return _CODE_TO_HTTP.get(out.get("code") or "", default)
+
+
+async def _run_oneshot(module: str, argv: list[str], traceparent: str | None = None) -> dict:
+    env = sidecar_env()
+    if traceparent:
+        env["TRACEPARENT"] = traceparent  # el sidecar devuelve sus spans en "_spans"
+    t0 = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", module, *argv,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        env=env, limit=READ_LIMIT,
+    )
+    observe_sidecar_spawn(module, "oneshot", time.perf_counter() - t0)
+    try:
+        out, err = await proc.communicate()
+    except BaseException:
+        # timeout o cancelación: no dejar el hijo huérfano
+        if proc.returncode is None:
+            proc.kill()
+        raise
+    # Los sidecars imprimen JSON también al fallar (exit != 0)
+    raw = (out or b"").decode().strip()
+    if raw:
+        try:
+            parsed = json.loads(raw.splitlines()[-1])
+        except Exception:
+            parsed = None
+        if isinstance(parsed, dict):
+            export_remote(parsed.pop("_spans", None))
+            return parsed
+    if proc.returncode != 0:
+        return _error("sidecar_unavailable", (err or out or b"").decode().strip() or f"{module} exit {proc.returncode}")
+    return _error("bad_output", f"{module}: bad JSON: {raw[:200]}")
+
+
+async def run_sidecar(module: str, argv: list, timeout: float | None = None) -> dict:
+    """
+    Ejecuta un comando de sidecar (mismos args que su CLI) y devuelve su dict.
+    Nunca lanza por fallos del sidecar; sí propaga CancelledError.
+    """
+    argv = [str(a) for a in argv]
+    timeout = SIDECAR_TIMEOUT_S if timeout is None else timeout
+    command = argv[0] if argv else ""
+    t0 = time.perf_counter()
+
+    with span(f"sidecar {module} {command}".strip(), CLIENT,
+              {"sidecar.module": module, "sidecar.command": command}) as sp:
+        async with _get_semaphore():
+            try:
+                if SIDECAR_POOL_ENABLED:
+                    call = get_pool(module).call(argv, sp.traceparent())
+                else:
+                    call = _run_oneshot(module, argv, sp.traceparent())
+                out = await asyncio.wait_for(call, timeout=timeout)
+            except asyncio.TimeoutError:
+                out = _error("timeout", f"{module} {command}: timeout tras {timeout:g}s")
+            except SidecarPoolError as e:
+                out = _error("sidecar_unavailable", str(e))
+            except OSError as e:
+                out = _error("sidecar_unavailable", f"{module}: {e}")
+
+        if not isinstance(out, dict):
+            out = _error("bad_output", f"{module}: respuesta no es un objeto JSON")
+        out = _classify(out)
+        if not out.get("ok"):
+            sp.set_attribute("sidecar.code", out.get("code"))
+            sp.set_error(out.get("error") or out.get("code"))
+    observe_sidecar_call(module, command, out, time.perf_counter() - t0)
+    return out
@@ -1,7 +1,10 @@
 # iotaas/sidecars/dev_sidecar.py
 import os, sys, json, argparse, grpc
+from concurrent.futures import ThreadPoolExecutor
 from google.protobuf import empty_pb2
 from grpc_auth_interceptor import ApiKeyAuthInterceptor
+from tracing import rpc_trace_interceptors
+from profile_index import profile_index
 
 # Stubs de internet (PyPI: chirpstack-api)
 from chirpstack_api.api import device_pb2 as dev_pb2
@@ -9,16 +12,23 @@ from chirpstack_api.api import device_pb2_grpc as dev_grpc
 from chirpstack_api.api import device_profile_pb2 as dp_pb2
 from chirpstack_api.api import device_profile_pb2_grpc as dp_grpc
 
-# --- Canal gRPC ---
+# --- Canal gRPC (memoizado: en modo serve se reutiliza entre comandos) ---
+_CHANNEL = None
+
 def _channel():
+    global _CHANNEL
+    if _CHANNEL is not None:
+        return _CHANNEL
     addr = os.getenv("CHIRPSTACK_GRPC_ADDRESS", "localhost:8080")
     apikey = os.getenv("CHIRPSTACK_API_KEY")
     if not apikey:
         raise RuntimeError("CHIRPSTACK_API_KEY missing")
-    return grpc.intercept_channel(
+    _CHANNEL = grpc.intercept_channel(
         grpc.insecure_channel(addr),
         ApiKeyAuthInterceptor(apikey),
+        *rpc_trace_interceptors(),  # spans gRPC hijos del traceparent del API
     )
+    return _CHANNEL
 
 def ok(payload: dict):
     print(json.dumps({"ok": True, **payload}, ensure_ascii=False)); sys.exit(0)
@@ -44,23 +54,15 @@ def _parse_tags(tags_str: str | None) -> dict:
     return out
 
 def _resolve_profile_id(ch, tenant_id: str, profile_name: str) -> str | None:
+    # Índice nombre→id del proceso: en modo serve se reutiliza entre creates
     stub = dp_grpc.DeviceProfileServiceStub(ch)
-    limit, offset = 200, 0
-    while True:
-        resp = stub.List(dp_pb2.ListDeviceProfilesRequest(
+
+    def list_page(limit, offset):
+        return stub.List(dp_pb2.ListDeviceProfilesRequest(
             tenant_id=tenant_id, limit=limit, offset=offset
         ))
-        batch = 0
-        for it in resp.result:
-            src = getattr(it, "device_profile", it)
-            if getattr(src, "name", None) == profile_name:
-                return getattr(src, "id", None)
-            batch += 1
-        if batch == 0: break
-        total = getattr(resp, "total_count", None)
-        offset += batch
-        if total is not None and offset >= total: break
-    return None
+
+    return profile_index.resolve(tenant_id, profile_name, list_page)
 
 # --- Comandos
 def cmd_list(args):
@@ -74,7 +76,7 @@ def cmd_list(args):
         resp = stub.List(req)
         items = [{
             "dev_eui": d.dev_eui, "name": d.name,
-            "application_id": d.application_id, "device_profile_id": d.device_profile_id,
+            "application_id": args.application_id, "device_profile_id": d.device_profile_id,
             "description": d.description, "tags": dict(d.tags),
         } for d in resp.result]
         ok({"total_count": getattr(resp, "total_count", None), "items": items})
@@ -89,8 +91,8 @@ def cmd_create(args):
         fail("dev_eui debe ser 16 hex (EUI64)")
     if not args.application_id:
         fail("application_id requerido")
-    if not args.device_profile_id:
-        fail("device_profile_id requerido")
+    if not args.device_profile_id and not (args.tenant_id and args.profile_name):
+        fail("Falta device_profile_id o (tenant-id + profile-name)")
     if not args.name:
         fail("name requerido")
 
@@ -99,22 +101,20 @@ def cmd_create(args):
     # Resolver device_profile_id si no viene explícito
     profile_id = args.device_profile_id
     if not profile_id:
-        if not args.tenant_id or not args.profile_name:
-            fail("Falta device_profile_id o (tenant-id + profile-name)")
         profile_id = _resolve_profile_id(ch, args.tenant_id, args.profile_name)
         if not profile_id:
             fail(f"Device Profile '{args.profile_name}' no existe en tenant {args.tenant_id}")
    
     dev_stub  = dev_grpc.DeviceServiceStub(ch)
-    keys_stub = dev_grpc.DeviceKeysServiceStub(ch)
 
     device = dev_pb2.Device(
         dev_eui=args.dev_eui.upper(),
         name=args.name,
         description=args.description or "",
         application_id=args.application_id,
-        device_profile_id=args.device_profile_id,
+        device_profile_id=profile_id,
         tags=_parse_tags(args.tags),
+        join_eui=(args.join_eui or "0000000000000000").upper(),  # v4: join_eui va en Device
     )
     
     # Crear Device
@@ -132,9 +132,9 @@ def cmd_create(args):
                 dev_eui=args.dev_eui.upper(),
                 app_key=(args.app_key or "").upper(),
                 nwk_key=((args.nwk_key or args.app_key) or "").upper(),
-                join_eui=(args.join_eui or "0000000000000000").upper(),
             )
-            _ = keys_stub.Create(dev_pb2.CreateDeviceKeysRequest(device_keys=dk))
+            # v4: las keys se crean con DeviceService.CreateKeys
+            _ = dev_stub.CreateKeys(dev_pb2.CreateDeviceKeysRequest(device_keys=dk))
         except grpc.RpcError as e:
             catch_grpc(e)
 
@@ -146,7 +146,104 @@ def cmd_create(args):
         "keys": (not args.no_keys),
     })
 
-def main():
+def _create_one(dev_stub, application_id: str, profile_id: str, item: dict) -> dict:
+    """Device + DeviceKeys de un item; si fallan las keys se borra el device (sin huérfanos)."""
+    dev_eui = item["dev_eui"].upper()
+    tags = item.get("tags") or {}
+    try:
+        dev_stub.Create(dev_pb2.CreateDeviceRequest(device=dev_pb2.Device(
+            dev_eui=dev_eui,
+            name=item.get("name") or dev_eui,
+            description=item.get("description") or "",
+            application_id=application_id,
+            device_profile_id=profile_id,
+            tags={str(k): str(v) for k, v in tags.items()},
+            join_eui=(item.get("join_eui") or "0000000000000000").upper(),
+        )))
+    except grpc.RpcError as e:
+        return {"dev_eui": dev_eui, "ok": False, "error": f"gRPC {e.code().name}: {e.details()}"}
+
+    if item.get("no_keys"):
+        return {"dev_eui": dev_eui, "ok": True, "keys": False}
+    try:
+        app_key = (item.get("app_key") or "").upper()
+        dev_stub.CreateKeys(dev_pb2.CreateDeviceKeysRequest(device_keys=dev_pb2.DeviceKeys(
+            dev_eui=dev_eui,
+            app_key=app_key,
+            nwk_key=(item.get("nwk_key") or app_key).upper(),
+        )))
+    except grpc.RpcError as e:
+        try:
+            dev_stub.Delete(dev_pb2.DeleteDeviceRequest(dev_eui=dev_eui))
+        except grpc.RpcError:
+            pass
+        return {"dev_eui": dev_eui, "ok": False, "error": f"gRPC {e.code().name} (keys): {e.details()}"}
+    return {"dev_eui": dev_eui, "ok": True, "keys": True}
+
+def cmd_create_batch(args):
+    """
+    Crea varios devices con el mismo application/profile sobre un solo canal,
+    con --concurrency RPCs en paralelo. Las validaciones de formato las hace el API.
+    """
+    try:
+        items = json.loads(args.items_json)
+    except json.JSONDecodeError as e:
+        fail(f"items-json inválido: {e}")
+    if not isinstance(items, list) or not all(isinstance(i, dict) and i.get("dev_eui") for i in items):
+        fail("items-json debe ser una lista de objetos con dev_eui")
+
+    ch = _channel()
+    profile_id = args.device_profile_id
+    if not profile_id:
+        if not (args.tenant_id and args.profile_name):
+            fail("Falta device_profile_id o (tenant-id + profile-name)")
+        profile_id = _resolve_profile_id(ch, args.tenant_id, args.profile_name)
+        if not profile_id:
+            fail(f"Device Profile '{args.profile_name}' no existe en tenant {args.tenant_id}")
+
+    dev_stub  = dev_grpc.DeviceServiceStub(ch)
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as ex:
+        results = list(ex.map(
+            lambda it: _create_one(dev_stub, args.application_id, profile_id, it), items
+        ))
+
+    ok({
+        "application_id": args.application_id,
+        "device_profile_id": profile_id,
+        "created": sum(1 for r in results if r["ok"]),
+        "results": results,
+    })
+
+def cmd_delete_batch(args):
+    """
+    Borra varios devices (compensación de un alta masiva que no llegó a Mongo).
+    NOT_FOUND cuenta como borrado: la operación es idempotente.
+    """
+    try:
+        dev_euis = json.loads(args.dev_euis_json)
+    except json.JSONDecodeError as e:
+        fail(f"dev-euis-json inválido: {e}")
+    if not isinstance(dev_euis, list) or not all(isinstance(d, str) and d for d in dev_euis):
+        fail("dev-euis-json debe ser una lista de dev_eui")
+
+    dev_stub = dev_grpc.DeviceServiceStub(_channel())
+
+    def _one(dev_eui):
+        dev_eui = dev_eui.upper()
+        try:
+            dev_stub.Delete(dev_pb2.DeleteDeviceRequest(dev_eui=dev_eui))
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.NOT_FOUND:
+                return {"dev_eui": dev_eui, "ok": False, "error": f"gRPC {e.code().name}: {e.details()}"}
+        return {"dev_eui": dev_eui, "ok": True}
+
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as ex:
+        results = list(ex.map(_one, dev_euis))
+
+    ok({"deleted": sum(1 for r in results if r["ok"]), "results": results})
+
+def run(argv: list[str]):
+    """Ejecuta un comando; imprime el JSON de salida y termina con sys.exit (ok/fail)."""
     p = argparse.ArgumentParser(prog="dev_sidecar", description="Sidecar Devices (ChirpStack v4, stubs de internet)")
     sub = p.add_subparsers(dest="cmd", required=True)
 
@@ -173,7 +270,22 @@ def main():
     sp_create.add_argument("--join-eui", default="", help="JoinEUI 16 hex (default 0000000000000000)")
     sp_create.set_defaults(func=cmd_create)
 
-    args = p.parse_args()
+    sp_batch = sub.add_parser("create-batch", help="Crear varios devices (mismo application/profile)")
+    sp_batch.add_argument("--application-id", required=True)
+    sp_batch.add_argument("--device-profile-id", help="ID del Device Profile")
+    sp_batch.add_argument("--tenant-id", help="Tenant ID de ChirpStack (para resolver profile por nombre)")
+    sp_batch.add_argument("--profile-name", help="Nombre del Device Profile (si no pasas --device-profile-id)")
+    sp_batch.add_argument("--items-json", required=True,
+                          help='[{"dev_eui","name","description","tags","app_key","nwk_key","join_eui","no_keys"}]')
+    sp_batch.add_argument("--concurrency", type=int, default=8)
+    sp_batch.set_defaults(func=cmd_create_batch)
+
+    sp_del_batch = sub.add_parser("delete-batch", help="Borrar varios devices (idempotente)")
+    sp_del_batch.add_argument("--dev-euis-json", required=True, help='["<dev_eui>", ...]')
+    sp_del_batch.add_argument("--concurrency", type=int, default=8)
+    sp_del_batch.set_defaults(func=cmd_delete_batch)
+
+    args = p.parse_args(argv)
 
     if args.cmd == "create" and not args.no_keys:
         if not args.app_key or len(args.app_key.strip()) != 32:
@@ -187,5 +299,16 @@ def main():
         fail(str(e))
 
 
+def main():
+    # python -m sidecars.dev_sidecar serve → worker persistente (JSON-lines por stdin/stdout);
+    # run_captured recoge lo que imprimen ok()/fail() y absorbe su sys.exit
+    if sys.argv[1:2] == ["serve"]:
+        from sidecars.serve import serve_forever
+        serve_forever(run)
+        return
+    from sidecars.serve import run_cli
+    run_cli(run, sys.argv[1:])
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,97 @@
+# sidecars/serve.py
+# Modo "serve" compartido por gw_sidecar, dp_sidecar y sidecars.dev_sidecar.
+#
+# Protocolo JSON-lines por stdin/stdout:
+#   → {"id": 1, "argv": ["create", "--gateway-id", "...", ...]}
+#   ← {"id": 1, "result": {"ok": true, ...}}
+#
+# El proceso queda vivo entre comandos, así que el import de grpc/protobuf y el
+# canal gRPC (memoizado en cada _channel()) se pagan una sola vez.
+#
+# Trazas: si el request trae "traceparent" (o el env TRACEPARENT en modo un solo
+# uso, ver run_cli), el comando corre dentro de un span hijo y los spans generados
+# vuelven al API en la respuesta ("spans" / "_spans"); los exporta tracing.py allí.
+import io, os, sys, json, contextlib
+
+from tracing import remote_child
+
+
+def run_captured(dispatch, argv: list[str]) -> dict:
+    """
+    Ejecuta dispatch(argv) capturando stdout/stderr y SystemExit,
+    para reutilizar tal cual la lógica CLI de cada sidecar.
+    Si dispatch devuelve un dict, se usa; si no, se parsea la última línea impresa.
+    """
+    out_buf, err_buf = io.StringIO(), io.StringIO()
+    result = None
+    try:
+        with contextlib.redirect_stdout(out_buf), contextlib.redirect_stderr(err_buf):
+            result = dispatch(argv)
+    except SystemExit:
+        pass
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+    if isinstance(result, dict):
+        return result
+
+    lines = [l for l in out_buf.getvalue().splitlines() if l.strip()]
+    if lines:
+        try:
+            return json.loads(lines[-1])
+        except Exception:
+            pass
+    return {"ok": False, "error": (err_buf.getvalue() or out_buf.getvalue() or "sin salida").strip()}
+
+
+def _prog() -> str:
+    # python -m gw_sidecar → .../gw_sidecar.py
+    return os.path.splitext(os.path.basename(sys.argv[0]))[0] or "sidecar"
+
+
+def run_traced(dispatch, argv: list[str], traceparent: str | None) -> tuple[dict, list[dict]]:
+    """run_captured dentro de un span hijo de traceparent; devuelve (resultado, spans)."""
+    prog, command = _prog(), argv[0] if argv else ""
+    with remote_child(traceparent, f"{prog} {command}".strip(),
+                      {"sidecar.module": prog, "sidecar.command": command}) as (sp, spans):
+        result = run_captured(dispatch, argv)
+        if not result.get("ok"):
+            sp.set_error(result.get("error") or "error")
+    return result, spans
+
+
+def run_cli(dispatch, argv: list[str]):
+    """Modo un-proceso-por-llamada. Con TRACEPARENT en el env, la salida JSON incluye "_spans"."""
+    traceparent = os.getenv("TRACEPARENT")
+    if not traceparent:
+        out = dispatch(argv)
+        if isinstance(out, dict):
+            print(json.dumps(out))
+        return
+    result, spans = run_traced(dispatch, argv, traceparent)
+    if spans:
+        result["_spans"] = spans
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def serve_forever(dispatch):
+    """Bucle de lectura JSON-lines; termina cuando se cierra stdin."""
+    stdout = sys.stdout
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            req = json.loads(line)
+            argv = [str(a) for a in req.get("argv") or []]
+        except Exception as e:
+            stdout.write(json.dumps({"id": None, "result": {"ok": False, "error": f"bad request: {e}"}}) + "\n")
+            stdout.flush()
+            continue
+
+        result, spans = run_traced(dispatch, argv, req.get("traceparent"))
+        resp = {"id": req.get("id"), "result": result}
+        if spans:
+            resp["spans"] = spans
+        stdout.write(json.dumps(resp, ensure_ascii=False) + "\n")
+        stdout.flush()
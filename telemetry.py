@@ -0,0 +1,506 @@
+# telemetry.py
+# Almacenamiento de telemetría (mqtt_data) como colección time-series de MongoDB.
+#
+# Esquema de cada documento:
+#   {
+#     "timestamp": datetime (UTC)                 ← timeField
+#     "meta": {"device_eui": ..., "tenant_id": ...} ← metaField
+#     "topic": ...,
+#     ...resto de campos del uplink
+#   }
+#
+# Migración (ensure_telemetry_collection + migrate_legacy_telemetry):
+#   1) Si mqtt_data existe como colección normal, se renombra a mqtt_data_legacy.
+#   2) Se crea mqtt_data como time-series (o normal si el servidor no lo soporta).
+#   3) Índices secundarios (device_eui, timestamp) y (tenant_id, timestamp).
+#   4) En background se copian los docs de mqtt_data_legacy por lotes (reanudable:
+#      cada lote copiado se borra del legacy; si se corta entre copiar y borrar, el
+#      lote no se duplica al reintentar). Un doc que no se puede convertir se aparta
+#      en mqtt_data_legacy_rejected en vez de frenar la migración.
+#
+# ENV:
+#   TELEMETRY_GRANULARITY   seconds | minutes | hours (default seconds)
+#   TELEMETRY_TTL_DAYS      expireAfterSeconds en días (default 0 = sin expiración)
+#   TELEMETRY_MIGRATE       1 = copiar mqtt_data_legacy al arrancar el API (default 1)
+import asyncio, base64, csv, io, json, os, re, zlib
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from bson import ObjectId
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure, PyMongoError
+
+TELEMETRY_COLLECTION = "mqtt_data"
+LEGACY_COLLECTION = "mqtt_data_legacy"
+REJECTED_COLLECTION = "mqtt_data_legacy_rejected"
+TIME_FIELD = "timestamp"
+META_FIELD = "meta"
+
+TELEMETRY_GRANULARITY = os.getenv("TELEMETRY_GRANULARITY", "seconds")
+TELEMETRY_TTL_DAYS = int(os.getenv("TELEMETRY_TTL_DAYS", "0"))
+TELEMETRY_MIGRATE = os.getenv("TELEMETRY_MIGRATE", "1") != "0"
+
+_MIGRATE_BATCH = 1000
+
+TELEMETRY_INDEXES = [
+    ([(f"{META_FIELD}.device_eui", ASCENDING), (TIME_FIELD, DESCENDING)], "meta_device_eui_ts"),
+    ([(f"{META_FIELD}.tenant_id", ASCENDING), (TIME_FIELD, DESCENDING)], "meta_tenant_id_ts"),
+]
+
+
+def parse_timestamp(value) -> datetime:
+    """ISO-8601 (con o sin 'Z'), epoch en s/ms o datetime → datetime UTC. Si no se puede, ahora."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, (int, float)):
+        secs = value / 1000 if value > 1e11 else value
+        try:
+            return datetime.fromtimestamp(secs, tz=timezone.utc)
+        except (OverflowError, ValueError, OSError):
+            # epoch fuera de rango (o NaN/inf)
+            return datetime.now(timezone.utc)
+    if isinstance(value, str) and value:
+        try:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return datetime.now(timezone.utc)
+
+
+def to_document(payload: dict, tenant_id=None, topic: str | None = None) -> dict:
+    """
+    Convierte un uplink (JSON plano) al esquema time-series.
+    tenant_id (el del registro de dispositivos) manda sobre el del payload: quien publica
+    no puede escribir en la telemetría de otro tenant.
+    """
+    doc = dict(payload)
+    doc.pop("_id", None)
+    device_eui = doc.pop("device_eui", None)
+    payload_tenant = doc.pop("tenant_id", None)
+    tenant = tenant_id or payload_tenant
+    meta = {"device_eui": device_eui}
+    if tenant:
+        meta["tenant_id"] = str(tenant)
+    doc[META_FIELD] = meta
+    doc[TIME_FIELD] = parse_timestamp(doc.get(TIME_FIELD))
+    if topic is not None:
+        doc["topic"] = topic
+    return doc
+
+
+def to_api(doc: dict) -> dict:
+    """Documento time-series → forma plana que consume el frontend (device_eui, timestamp ISO)."""
+    out = dict(doc)
+    meta = out.pop(META_FIELD, None) or {}
+    if "_id" in out:
+        out["_id"] = str(out["_id"])
+    out["device_eui"] = meta.get("device_eui")
+    if meta.get("tenant_id"):
+        out["tenant_id"] = meta["tenant_id"]
+    ts = out.get(TIME_FIELD)
+    if isinstance(ts, datetime):
+        out[TIME_FIELD] = (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).isoformat()
+    elif ts is not None:
+        out[TIME_FIELD] = str(ts)
+    return out
+
+
+# ────────────────────────────────────────────────
+# 📖 Lecturas paginadas (keyset sobre timestamp, _id)
+# ────────────────────────────────────────────────
+MAX_PAGE_SIZE = 5000
+
+
+def parse_time_param(value: str) -> datetime:
+    """Parámetro de query (ISO-8601 o epoch) → datetime UTC. ValueError si es inválido."""
+    value = (value or "").strip()
+    if value.replace(".", "", 1).isdigit():
+        return parse_timestamp(float(value))
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"fecha inválida: {value!r}")
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def encode_cursor(doc: dict) -> str:
+    ts = doc[TIME_FIELD]
+    raw = json.dumps({"t": parse_timestamp(ts).isoformat(), "id": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    try:
+        pad = "=" * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(cursor + pad))
+        return parse_time_param(raw["t"]), ObjectId(raw["id"])
+    except Exception:
+        raise ValueError("cursor inválido")
+
+
+def build_query(meta: dict, start: datetime | None = None, end: datetime | None = None) -> dict:
+    """Filtro por meta.* (device_eui / tenant_id) y rango [start, end)."""
+    query = {f"{META_FIELD}.{k}": v for k, v in meta.items()}
+    rng = {}
+    if start is not None:
+        rng["$gte"] = start
+    if end is not None:
+        rng["$lt"] = end
+    if rng:
+        query[TIME_FIELD] = rng
+    return query
+
+
+def build_projection(fields: list[str] | None) -> dict | None:
+    """Solo los campos pedidos + los que necesita la paginación/respuesta."""
+    if not fields:
+        return None
+    # _id/timestamp/meta van siempre enteros: pedir también meta.x daría "Path collision at meta"
+    always = ("_id", TIME_FIELD, META_FIELD)
+    proj = {f: 1 for f in fields
+            if f and not f.startswith("$") and f.split(".", 1)[0] not in always}
+    proj.update({k: 1 for k in always})
+    return proj
+
+
+async def fetch_page(collection, meta: dict, start: datetime | None = None, end: datetime | None = None,
+                     limit: int = 500, cursor: str | None = None, fields: list[str] | None = None,
+                     descending: bool = False) -> tuple[list[dict], str | None]:
+    """
+    Página de telemetría ordenada por (timestamp, _id). Devuelve (docs, next_cursor).
+    El cursor es la posición del último doc devuelto (keyset), no un offset.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = build_query(meta, start, end)
+    if cursor:
+        c_ts, c_id = decode_cursor(cursor)
+        op = "$lt" if descending else "$gt"
+        query["$or"] = [
+            {TIME_FIELD: {op: c_ts}},
+            {TIME_FIELD: c_ts, "_id": {op: c_id}},
+        ]
+    direction = DESCENDING if descending else ASCENDING
+    docs = await (
+        collection.find(query, build_projection(fields))
+        .sort([(TIME_FIELD, direction), ("_id", direction)])
+        .limit(limit + 1)
+        .to_list(limit + 1)
+    )
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1])
+    return docs, next_cursor
+
+
+# ────────────────────────────────────────────────
+# 📤 Exportación en streaming (NDJSON / CSV, gzip opcional)
+# ────────────────────────────────────────────────
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+_CHUNK_BYTES = 64 * 1024
+
+
+def _csv_value(v):
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, default=str, ensure_ascii=False)
+    return v
+
+
+async def iter_export(collection, meta: dict, start: datetime | None = None, end: datetime | None = None,
+                      fmt: str = "ndjson", fields: list[str] | None = None,
+                      batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Genera el export como bloques de bytes (~64 KiB) iterando un cursor Motor,
+    sin materializar el rango completo en memoria.
+    CSV: columnas = fields, o las del primer documento si no se indican.
+    """
+    cursor = (
+        collection.find(build_query(meta, start, end), build_projection(fields))
+        .sort([(TIME_FIELD, ASCENDING), ("_id", ASCENDING)])
+        .batch_size(batch_size)
+    )
+    buf = io.StringIO()
+    writer = None
+    async for doc in cursor:
+        row = to_api(doc)
+        if fmt == "csv":
+            if writer is None:
+                columns = ["timestamp", "device_eui"] + [c for c in (fields or row.keys())
+                                                         if c not in ("timestamp", "device_eui")]
+                writer = csv.DictWriter(buf, fieldnames=columns, extrasaction="ignore")
+                writer.writeheader()
+            writer.writerow({k: _csv_value(v) for k, v in row.items()})
+        else:
+            buf.write(json.dumps(row, default=str, ensure_ascii=False))
+            buf.write("\n")
+        if buf.tell() >= _CHUNK_BYTES:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+async def gzip_stream(chunks):
+    """Comprime al vuelo un iterador async de bytes (formato gzip)."""
+    comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
+
+
+# ────────────────────────────────────────────────
+# 📊 Agregación por buckets ($dateTrunc) para gráficas
+# ────────────────────────────────────────────────
+# intervalo → (unit, binSize) de $dateTrunc
+INTERVALS = {
+    "1m": ("minute", 1),
+    "5m": ("minute", 5),
+    "1h": ("hour", 1),
+    "1d": ("day", 1),
+}
+INTERVAL_SECONDS = {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+DEFAULT_BUCKETS = 1000   # ventana por defecto si no se indica 'from'
+MAX_BUCKETS = 10000      # buckets de tiempo por consulta (más → 400)
+MAX_BUCKET_ROWS = 50000  # filas por respuesta con by_device (más → truncated)
+
+_TZ_OFFSET_RE = re.compile(r"^[+-]\d{2}(:?\d{2})?$")
+
+
+def default_window(interval: str, start: datetime | None, end: datetime | None) -> tuple[datetime, datetime]:
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(seconds=INTERVAL_SECONDS[interval] * DEFAULT_BUCKETS)
+    return start, end
+
+
+def check_window(interval: str, start: datetime, end: datetime):
+    """ValueError si la ventana no tiene sentido o pasa de MAX_BUCKETS buckets."""
+    if end <= start:
+        raise ValueError("'to' debe ser posterior a 'from'")
+    buckets = (end - start).total_seconds() / INTERVAL_SECONDS[interval]
+    if buckets > MAX_BUCKETS:
+        raise ValueError(f"rango demasiado amplio para interval={interval}: {int(buckets)} buckets "
+                         f"(máximo {MAX_BUCKETS}); usa un intervalo mayor o acota from/to")
+
+
+def check_timezone(tz: str) -> str:
+    """Zona IANA (Europe/Madrid, UTC) u offset (+01:00) válida para $dateTrunc; ValueError si no."""
+    if _TZ_OFFSET_RE.match(tz or ""):
+        return tz
+    try:
+        ZoneInfo(tz)
+    except (ValueError, KeyError):  # ZoneInfoNotFoundError es un KeyError
+        raise ValueError(f"tz inválida: {tz!r}")
+    return tz
+
+
+def _numeric(field: str) -> dict:
+    # ignora valores no numéricos ($min/$max/$avg descartan null)
+    return {"$cond": [{"$isNumber": f"${field}"}, f"${field}", None]}
+
+
+def build_aggregate_pipeline(meta: dict, interval: str, start: datetime, end: datetime,
+                             fields: list[str] | None = None, by_device: bool = False,
+                             tz: str = "UTC") -> list[dict]:
+    unit, bin_size = INTERVALS[interval]
+    tz = check_timezone(tz)
+    group_id = {"t": {"$dateTrunc": {"date": f"${TIME_FIELD}", "unit": unit, "binSize": bin_size, "timezone": tz}}}
+    if by_device:
+        group_id["device_eui"] = f"${META_FIELD}.device_eui"
+
+    group = {"_id": group_id, "count": {"$sum": 1}}
+    # claves f0_min, f0_max... (los nombres de campo pueden traer puntos)
+    for i, field in enumerate(fields or []):
+        expr = _numeric(field)
+        group[f"f{i}_min"] = {"$min": expr}
+        group[f"f{i}_max"] = {"$max": expr}
+        group[f"f{i}_avg"] = {"$avg": expr}
+
+    return [
+        {"$match": build_query(meta, start, end)},
+        {"$group": group},
+        {"$sort": {"_id.t": 1}},
+        # +1 para detectar truncado (by_device multiplica las filas por dispositivo)
+        {"$limit": MAX_BUCKET_ROWS + 1},
+    ]
+
+
+def bucket_to_api(row: dict, fields: list[str] | None) -> dict:
+    t = row["_id"]["t"]
+    out = {"t": parse_timestamp(t).isoformat(), "count": row["count"]}
+    if "device_eui" in row["_id"]:
+        out["device_eui"] = row["_id"]["device_eui"]
+    if fields:
+        out["fields"] = {
+            field: {"min": row.get(f"f{i}_min"), "max": row.get(f"f{i}_max"), "avg": row.get(f"f{i}_avg")}
+            for i, field in enumerate(fields)
+        }
+    return out
+
+
+async def aggregate_buckets(collection, meta: dict, interval: str, start: datetime | None = None,
+                            end: datetime | None = None, fields: list[str] | None = None,
+                            by_device: bool = False, tz: str = "UTC") -> dict:
+    """min/max/avg/count por bucket de 'interval' sobre la telemetría cruda."""
+    if interval not in INTERVALS:
+        raise ValueError(f"interval inválido, usa uno de: {', '.join(INTERVALS)}")
+    start, end = default_window(interval, start, end)
+    check_window(interval, start, end)
+    pipeline = build_aggregate_pipeline(meta, interval, start, end, fields, by_device, tz)
+    rows = await collection.aggregate(pipeline, allowDiskUse=True).to_list(None)
+    return {
+        "interval": interval,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "buckets": [bucket_to_api(r, fields) for r in rows[:MAX_BUCKET_ROWS]],
+        "truncated": len(rows) > MAX_BUCKET_ROWS,
+    }
+
+
+async def _collection_type(db, name: str) -> str | None:
+    """"timeseries" | "collection" | None si no existe."""
+    try:
+        cursor = await db.list_collections(filter={"name": name})
+        infos = await cursor.to_list(None)
+    except NotImplementedError:
+        # clientes de prueba sin listCollections: solo sabemos si existe
+        return "collection" if name in await db.list_collection_names() else None
+    return infos[0].get("type", "collection") if infos else None
+
+
+async def ensure_telemetry_collection(db) -> str:
+    """
+    Idempotente. Deja mqtt_data como time-series con sus índices.
+    Devuelve "timeseries" o "collection" (fallback si el servidor no soporta time-series).
+    """
+    kind = await _collection_type(db, TELEMETRY_COLLECTION)
+
+    if kind == "collection":
+        sample = await db[TELEMETRY_COLLECTION].find_one({})
+        if sample is None:
+            # vacía: se recrea como time-series
+            await db[TELEMETRY_COLLECTION].drop()
+            kind = None
+        elif META_FIELD in sample:
+            # ya tiene el esquema nuevo (fallback sin time-series de un arranque anterior)
+            pass
+        elif await _collection_type(db, LEGACY_COLLECTION) is None:
+            # Colección vieja (docs planos con timestamp string): se aparta para migrarla
+            await db[TELEMETRY_COLLECTION].rename(LEGACY_COLLECTION)
+            print(f"[BOOT] {TELEMETRY_COLLECTION} → {LEGACY_COLLECTION} (pendiente de migrar)")
+            kind = None
+        else:
+            print(f"[BOOT] {LEGACY_COLLECTION} ya existe; {TELEMETRY_COLLECTION} queda como colección normal")
+
+    if kind is None:
+        opts = {"timeseries": {"timeField": TIME_FIELD, "metaField": META_FIELD, "granularity": TELEMETRY_GRANULARITY}}
+        if TELEMETRY_TTL_DAYS > 0:
+            opts["expireAfterSeconds"] = TELEMETRY_TTL_DAYS * 86400
+        try:
+            await db.create_collection(TELEMETRY_COLLECTION, **opts)
+            kind = "timeseries"
+        except CollectionInvalid:
+            # carrera con otro proceso (API / ingestor)
+            kind = await _collection_type(db, TELEMETRY_COLLECTION) or "collection"
+        except (OperationFailure, TypeError, NotImplementedError) as e:
+            # MongoDB < 5.0 o cliente sin soporte: colección normal con el mismo esquema
+            print(f"[BOOT] time-series no disponible ({e}); usando colección normal")
+            kind = "collection"
+        print(f"[BOOT] {TELEMETRY_COLLECTION} lista ({kind})")
+
+    coll = db[TELEMETRY_COLLECTION]
+    for keys, name in TELEMETRY_INDEXES:
+        await coll.create_index(keys, name=name)
+    return kind
+
+
+async def _already_migrated(target, docs: list[dict]) -> set:
+    """_ids del lote que ya están en mqtt_data (lote copiado pero no borrado del legacy)."""
+    times = [d[TIME_FIELD] for d in docs]
+    cursor = target.find(
+        # el rango de timestamp deja descartar buckets enteros en time-series
+        {"_id": {"$in": [d["_id"] for d in docs]}, TIME_FIELD: {"$gte": min(times), "$lte": max(times)}},
+        {"_id": 1},
+    )
+    return {d["_id"] async for d in cursor}
+
+
+async def _tenants_by_eui(devices, docs: list[dict]) -> dict:
+    """device_eui → tenant_id según la colección devices (los docs legacy no traen tenant)."""
+    euis = {str(d.get("device_eui")) for d in docs if d.get("device_eui")}
+    if not euis:
+        return {}
+    tenants = {}
+    cursor = devices.find({"dev_eui": {"$in": list(euis | {e.upper() for e in euis})}},
+                          {"dev_eui": 1, "tenant_id": 1}).sort("_id", ASCENDING)
+    async for dev in cursor:
+        if dev.get("tenant_id"):
+            # un dev_eui en varios tenants: se queda el registro más antiguo
+            tenants.setdefault(dev["dev_eui"], dev["tenant_id"])
+    return tenants
+
+
+async def migrate_legacy_telemetry(db, batch_size: int = _MIGRATE_BATCH) -> int:
+    """
+    Copia mqtt_data_legacy → mqtt_data por lotes; reanudable. Devuelve docs migrados.
+    meta.tenant_id se resuelve por device_eui en devices (export/agregados por tenant y
+    teardown_tenant filtran por él).
+    Si un arranque anterior se cortó entre copiar y borrar un lote, ese lote no se duplica:
+    en colección normal el _id conservado choca (11000 = ya copiado); en time-series
+    (_id no es único) se saltan los _id que ya están en el destino.
+    """
+    if await _collection_type(db, LEGACY_COLLECTION) is None:
+        return 0
+    legacy, target = db[LEGACY_COLLECTION], db[TELEMETRY_COLLECTION]
+    timeseries = await _collection_type(db, TELEMETRY_COLLECTION) == "timeseries"
+    moved = rejected = 0
+    try:
+        while True:
+            batch = await legacy.find({}).sort("_id", ASCENDING).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            ids = [d["_id"] for d in batch]
+            tenants = await _tenants_by_eui(db["devices"], batch)
+            docs, bad = [], []
+            for d in batch:
+                eui = str(d.get("device_eui") or "")
+                try:
+                    doc = to_document(dict(d), tenant_id=tenants.get(eui) or tenants.get(eui.upper()),
+                                      topic=d.get("topic"))
+                except Exception as e:
+                    # un doc roto no puede frenar la migración en cada arranque
+                    print(f"⚠️  Migración: doc {d['_id']} apartado en {REJECTED_COLLECTION}: {e!r}")
+                    bad.append(d)
+                    continue
+                doc["_id"] = d["_id"]  # conserva el id original
+                docs.append(doc)
+            if bad:
+                try:
+                    await db[REJECTED_COLLECTION].insert_many(bad, ordered=False)
+                except BulkWriteError as e:
+                    if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                        raise
+                rejected += len(bad)
+            if timeseries and docs:
+                done = await _already_migrated(target, docs)
+                docs = [d for d in docs if d["_id"] not in done]
+            if docs:
+                try:
+                    await target.insert_many(docs, ordered=False)
+                except BulkWriteError as e:
+                    errors = e.details.get("writeErrors", [])
+                    if any(err.get("code") != 11000 for err in errors):
+                        raise
+                    docs = docs[: len(docs) - len(errors)]  # solo para el conteo
+            await legacy.delete_many({"_id": {"$in": ids}})
+            moved += len(docs)
+            await asyncio.sleep(0)  # no acaparar el loop
+        await legacy.drop()
+        print(f"[BOOT] migración de telemetría completa: {moved} docs ({rejected} apartados)")
+    except PyMongoError as e:
+        print(f"[BOOT] migración de telemetría interrumpida tras {moved} docs: {e}")
+    return moved
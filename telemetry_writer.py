@@ -0,0 +1,174 @@
+# telemetry_writer.py
+# Escritura por micro-lotes de uplinks en Mongo (Motor).
+#
+# - put() encola el documento; si la cola está llena, put() espera → backpressure
+#   natural sobre el consumidor MQTT (memoria acotada a max_pending docs).
+# - Un task de fondo vacía la cola con insert_many(ordered=False) cuando junta
+#   max_batch docs o pasan max_delay segundos desde el primer doc del lote.
+# - close() drena la cola y hace el último flush (garantía al apagar).
+# - Un doc que no se puede codificar a BSON (int > 8 bytes, claves inválidas...) se
+#   aísla partiendo el lote por la mitad: solo ese doc se descarta (stats["invalid"]).
+#   Si aun así el task de fondo muere, put() y close() lo detectan en vez de esperar
+#   para siempre en una cola que ya nadie lee.
+# - after_flush: callbacks async que reciben los docs efectivamente insertados
+#   (p.ej. rollups.RollupMaterializer.apply).
+#
+# ENV:
+#   MQTT_BATCH_SIZE     docs por insert_many (default 500)
+#   MQTT_BATCH_MS       espera máxima para completar un lote, en ms (default 200)
+#   MQTT_MAX_PENDING    docs máximos en memoria antes de frenar al consumidor (default 10000)
+import asyncio, os, time
+
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, PyMongoError
+
+MQTT_BATCH_SIZE = int(os.getenv("MQTT_BATCH_SIZE", "500"))
+MQTT_BATCH_MS = int(os.getenv("MQTT_BATCH_MS", "200"))
+MQTT_MAX_PENDING = int(os.getenv("MQTT_MAX_PENDING", "10000"))
+
+_FLUSH_RETRIES = 3
+_STOP = object()
+# errores de codificación BSON en el cliente (no son PyMongoError)
+_ENCODE_ERRORS = (InvalidDocument, OverflowError)
+
+
+class BatchWriter:
+    def __init__(self, collection, max_batch: int = MQTT_BATCH_SIZE,
+                 max_delay: float = MQTT_BATCH_MS / 1000, max_pending: int = MQTT_MAX_PENDING,
+                 after_flush: list | None = None):
+        self.collection = collection
+        self.after_flush = after_flush or []
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(self.max_batch, max_pending))
+        self._task: asyncio.Task | None = None
+        self.stats = {"inserted": 0, "batches": 0, "write_errors": 0, "dropped": 0, "invalid": 0}
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def _check_alive(self):
+        if self._task is not None and self._task.done():
+            exc = "cancelado" if self._task.cancelled() else repr(self._task.exception())
+            raise RuntimeError(f"BatchWriter detenido: {exc}")
+
+    async def _put(self, item):
+        """queue.put que no se queda colgado si el task de fondo muere mientras espera."""
+        if self._task is None or not self._queue.full():
+            await self._queue.put(item)
+            return
+        putter = asyncio.ensure_future(self._queue.put(item))
+        await asyncio.wait({putter, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if not putter.done():
+            putter.cancel()
+            self._check_alive()
+
+    async def put(self, doc: dict):
+        self._check_alive()
+        await self._put(doc)
+
+    async def close(self):
+        """Drena lo pendiente, hace el flush final y detiene el task."""
+        if self._task is None:
+            return
+        try:
+            self._check_alive()
+            await self._put(_STOP)
+            await self._task
+        except RuntimeError as e:
+            # el task murió: flush final desde aquí con lo que quedó en la cola
+            print(f"🔴 {e}; vaciando {self._queue.qsize()} docs pendientes")
+            rest = [d for d in (self._queue.get_nowait() for _ in range(self._queue.qsize())) if d is not _STOP]
+            for i in range(0, len(rest), self.max_batch):
+                await self._safe_flush(rest[i:i + self.max_batch])
+        self._task = None
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    doc = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if doc is _STOP:
+                    stop = True
+                    break
+                batch.append(doc)
+            await self._safe_flush(batch)
+            if stop:
+                # close(): drena lo que quede sin esperar el deadline
+                rest = []
+                while not self._queue.empty():
+                    doc = self._queue.get_nowait()
+                    if doc is not _STOP:
+                        rest.append(doc)
+                for i in range(0, len(rest), self.max_batch):
+                    await self._safe_flush(rest[i:i + self.max_batch])
+                return
+
+    async def _safe_flush(self, batch: list[dict]):
+        # un error inesperado descarta el lote, nunca el task de fondo
+        try:
+            await self._flush(batch)
+        except Exception as e:
+            self.stats["dropped"] += len(batch)
+            print(f"🔴 Lote descartado por error inesperado ({len(batch)} docs): {e!r}")
+
+    async def _flush(self, batch: list[dict]):
+        for attempt in range(1, _FLUSH_RETRIES + 1):
+            try:
+                res = await self.collection.insert_many(batch, ordered=False)
+                self.stats["inserted"] += len(res.inserted_ids)
+                self.stats["batches"] += 1
+                await self._after_flush(batch)
+                return
+            except BulkWriteError as e:
+                # ordered=False: el resto del lote sí se insertó
+                details = e.details or {}
+                failed = {err.get("index") for err in details.get("writeErrors", [])}
+                self.stats["inserted"] += details.get("nInserted", 0)
+                self.stats["write_errors"] += len(failed)
+                self.stats["batches"] += 1
+                print(f"⚠️  Lote con {len(failed)} errores de escritura")
+                await self._after_flush([d for i, d in enumerate(batch) if i not in failed])
+                return
+            except _ENCODE_ERRORS as e:
+                await self._flush_isolating(batch, e)
+                return
+            except PyMongoError as e:
+                print(f"🔴 Error al guardar lote ({len(batch)} docs, intento {attempt}): {e}")
+                await asyncio.sleep(0.5 * attempt)
+        self.stats["dropped"] += len(batch)
+        print(f"🔴 Lote descartado tras {_FLUSH_RETRIES} intentos: {len(batch)} docs")
+
+    async def _flush_isolating(self, batch: list[dict], error: Exception):
+        """Bisección: reintenta cada mitad hasta dejar solo el/los docs que no codifican."""
+        if len(batch) == 1:
+            self.stats["invalid"] += 1
+            doc = batch[0]
+            meta = doc.get("meta") or {}
+            print(f"⚠️  Uplink descartado, no codificable a BSON (device {meta.get('device_eui')}): {error!r}")
+            return
+        mid = len(batch) // 2
+        await self._flush(batch[:mid])
+        await self._flush(batch[mid:])
+
+    async def _after_flush(self, docs: list[dict]):
+        for hook in self.after_flush:
+            try:
+                await hook(docs)
+            except Exception as e:
+                print(f"🔴 after_flush {getattr(hook, '__qualname__', hook)}: {e}")
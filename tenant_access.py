@@ -0,0 +1,137 @@
+# tenant_access.py
+# Autorización por tenant: (uid, tenant_id) → doc del tenant, cacheado en memoria.
+#
+# Casi todos los endpoints por tenant validan propiedad con
+#   tenants_collection.find_one({"_id": oid, "owner_uid": uid})
+# Aquí se resuelve una vez y se recuerda TENANT_CACHE_TTL_S segundos.
+# Solo se cachean aciertos (un tenant recién creado se ve al instante);
+# crear/actualizar/borrar un tenant invalida su entrada (invalidate_tenant).
+#
+# Uso en FastAPI:
+#   @app.get("/tenants/{tenant_id}/x")
+#   async def x(tenant: dict = Depends(owned_tenant)): ...
+# tenant_id sale del path o, si no está en el path, de la query.
+# Las rutas por dispositivo (/devices/{dev_eui}/...) usan owned_device: el tenant
+# dueño se resuelve desde la colección devices.
+#
+# ENV:
+#   TENANT_CACHE_TTL_S   vida de una entrada (default 30, 0 = sin caché)
+#   TENANT_CACHE_SIZE    entradas máximas (default 10000)
+import os, time
+from collections import OrderedDict
+
+from bson import ObjectId
+from fastapi import HTTPException, Request
+
+from db import tenants_collection, devices_collection
+
+TENANT_CACHE_TTL_S = float(os.getenv("TENANT_CACHE_TTL_S", "30"))
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "10000"))
+
+NOT_FOUND_DETAIL = "Tenant no encontrado o no autorizado"
+DEVICE_NOT_FOUND_DETAIL = "Dispositivo no encontrado o no autorizado"
+
+
+class TenantCache:
+    def __init__(self, ttl: float = TENANT_CACHE_TTL_S, max_size: int = TENANT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: OrderedDict[tuple[str, str], tuple[dict, float]] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, uid: str, tenant_id: str) -> dict | None:
+        item = self._items.get((uid, tenant_id))
+        if item is None or item[1] <= time.monotonic():
+            self.stats["misses"] += 1
+            return None
+        self._items.move_to_end((uid, tenant_id))
+        self.stats["hits"] += 1
+        return item[0]
+
+    def put(self, uid: str, tenant_id: str, tenant: dict):
+        if self.ttl <= 0:
+            return
+        self._items[(uid, tenant_id)] = (tenant, time.monotonic() + self.ttl)
+        self._items.move_to_end((uid, tenant_id))
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, tenant_id: str | None = None, uid: str | None = None):
+        """Borra las entradas de un tenant y/o de un usuario (sin args: todo)."""
+        if tenant_id is None and uid is None:
+            self._items.clear()
+            return
+        for key in [k for k in self._items
+                    if (tenant_id is None or k[1] == tenant_id) and (uid is None or k[0] == uid)]:
+            del self._items[key]
+
+
+tenant_cache = TenantCache()
+
+
+def invalidate_tenant(tenant_id) -> None:
+    tenant_cache.invalidate(tenant_id=str(tenant_id))
+
+
+async def get_owned_tenant(uid: str, tenant_id: str) -> dict | None:
+    """Doc del tenant si existe y pertenece a uid; None si no. ValueError si el id es inválido."""
+    tenant = tenant_cache.get(uid, tenant_id)
+    if tenant is not None:
+        return tenant
+    try:
+        oid = ObjectId(tenant_id)
+    except Exception:
+        raise ValueError("tenant_id inválido")
+    tenant = await tenants_collection.find_one({"_id": oid, "owner_uid": uid})
+    if tenant:
+        tenant_cache.put(uid, tenant_id, tenant)
+    return tenant
+
+
+async def require_tenant(user: dict | None, tenant_id: str, detail: str = NOT_FOUND_DETAIL,
+                         allow_deleting: bool = False) -> dict:
+    """
+    Como get_owned_tenant, pero con los HTTPException de los endpoints (401/400/404).
+    Un tenant con borrado en curso (status "deleting") da 409 salvo allow_deleting.
+    """
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    try:
+        tenant = await get_owned_tenant(user["uid"], tenant_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not tenant:
+        raise HTTPException(status_code=404, detail=detail)
+    if tenant.get("status") == "deleting" and not allow_deleting:
+        raise HTTPException(status_code=409, detail="Tenant en proceso de borrado")
+    return tenant
+
+
+async def owned_tenant(tenant_id: str, request: Request) -> dict:
+    """Dependencia FastAPI: tenant del usuario autenticado, o 401/400/404."""
+    return await require_tenant(getattr(request.state, "user", None), tenant_id)
+
+
+async def require_device_tenant(user: dict | None, dev_eui: str) -> dict:
+    """
+    Tenant dueño del dispositivo dev_eui si pertenece al usuario (401/404/409 como require_tenant).
+    Un mismo dev_eui puede estar registrado en varios tenants: vale cualquiera del usuario.
+    """
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    eui = (dev_eui or "").strip()
+    cursor = devices_collection.find({"dev_eui": {"$in": list({eui, eui.upper()})}}, {"tenant_id": 1})
+    async for doc in cursor:
+        tenant_id = str(doc.get("tenant_id") or "")
+        try:
+            tenant = await get_owned_tenant(user["uid"], tenant_id)
+        except ValueError:
+            continue
+        if tenant:
+            return await require_tenant(user, tenant_id, detail=DEVICE_NOT_FOUND_DETAIL)
+    raise HTTPException(status_code=404, detail=DEVICE_NOT_FOUND_DETAIL)
+
+
+async def owned_device(dev_eui: str, request: Request) -> dict:
+    """Dependencia FastAPI: tenant dueño de dev_eui para el usuario autenticado, o 401/404."""
+    return await require_device_tenant(getattr(request.state, "user", None), dev_eui)
@@ -0,0 +1,478 @@
+# tracing.py
+# Trazas ligeras compatibles con OpenTelemetry, sin dependencias (solo stdlib + grpc).
+#
+# - IDs y propagación W3C Trace Context ("traceparent": 00-<trace_id>-<span_id>-<flags>).
+# - Span actual en un contextvar: atraviesa awaits, run_in_threadpool de Starlette y el
+#   executor de Motor (que copia el contexto), así Mongo/gRPC cuelgan del span de la ruta.
+# - Exportadores: memory (ring buffer, para benchmarks/pruebas offline) o file (una línea
+#   OTLP/JSON {"resourceSpans": [...]} por lote: la lee el receiver otlpjsonfile del
+#   OpenTelemetry Collector).
+#
+# Instrumentación:
+#   TracingMiddleware           span SERVER por request (nombre "<METHOD> <template de ruta>")
+#   mongo_trace_listeners()     span CLIENT por comando Mongo dentro de una traza (CommandListener, en db.py)
+#   rpc_trace_interceptors() /  span CLIENT por RPC a ChirpStack + metadata "traceparent"
+#   aio_rpc_trace_interceptors()
+#   trace_methods(prefix)       span INTERNAL por método de (Async)ChirpstackGRPCClient
+#   sidecar_runner.run_sidecar  span CLIENT por invocación; el contexto viaja al sidecar en
+#                               el JSON del worker ("traceparent") o en el env TRACEPARENT
+#                               (modo un-proceso-por-llamada). El sidecar devuelve sus spans
+#                               en la respuesta y se exportan aquí (sidecars/serve.py).
+#
+# ENV:
+#   TRACING_EXPORTER          none | memory | file (default none = sin trazas, coste ~0)
+#   TRACING_FILE              archivo del exportador file (default traces.jsonl)
+#   TRACING_SAMPLE_RATE       fracción de trazas raíz muestreadas (default 1.0)
+#   TRACING_MEMORY_MAX_SPANS  capacidad del exportador memory (default 10000)
+#   TRACING_SERVICE_NAME      service.name del recurso (default iotaas)
+#   TRACEPARENT               contexto padre en sidecars lanzados como proceso de un solo uso
+import atexit, functools, inspect, json, os, random, re, threading, time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple
+
+import grpc
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "1.0"))
+TRACING_MEMORY_MAX_SPANS = int(os.getenv("TRACING_MEMORY_MAX_SPANS", "10000"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "iotaas")
+TRACING_ENABLED = TRACING_EXPORTER in ("memory", "file")
+
+# SpanKind de OTLP
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+# Status.code de OTLP
+_STATUS_UNSET, _STATUS_OK, _STATUS_ERROR = 0, 1, 2
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool = True
+
+
+def parse_traceparent(value: str | None) -> SpanContext | None:
+    m = _TRACEPARENT_RE.match((value or "").strip().lower())
+    if not m or m.group(1) == "0" * 32 or m.group(2) == "0" * 16:
+        return None
+    return SpanContext(m.group(1), m.group(2), bool(int(m.group(3), 16) & 1))
+
+
+def _attr_value(v) -> dict:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+# ────────────────────────────────────────────────
+# 🧵 Spans
+# ────────────────────────────────────────────────
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "status_code", "status_message")
+    sampled = True
+
+    def __init__(self, name: str, kind: int, trace_id: str, parent_id: str | None, attributes: dict | None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64) or 1:016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = dict(attributes) if attributes else {}
+        self.status_code = _STATUS_UNSET
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_error(self, message: str = ""):
+        self.status_code = _STATUS_ERROR
+        self.status_message = str(message)[:500]
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self):
+        if self.end_ns:
+            return
+        self.end_ns = time.time_ns()
+        _emit(self.to_otlp())
+
+    def to_otlp(self) -> dict:
+        out = {
+            "traceId": self.trace_id, "spanId": self.span_id, "name": self.name, "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns), "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": k, "value": _attr_value(v)} for k, v in self.attributes.items() if v is not None],
+            "status": {"code": self.status_code},
+        }
+        if self.parent_id:
+            out["parentSpanId"] = self.parent_id
+        if self.status_message:
+            out["status"]["message"] = self.status_message
+        return out
+
+
+class _NoopSpan:
+    """Span no muestreado / tracing apagado: misma interfaz, no registra nada."""
+    sampled = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message=""):
+        pass
+
+    def traceparent(self):
+        return None
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+# Span | SpanContext (padre remoto) | NOOP_SPAN (traza no muestreada) | None
+_current: ContextVar = ContextVar("tracing_current", default=None)
+# lista de spans terminados cuando un sidecar los devuelve al proceso padre
+_collector: ContextVar = ContextVar("tracing_collector", default=None)
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name: str, kind: int = INTERNAL, attributes: dict | None = None, parent=None):
+    """Crea un span hijo de `parent` (o del span actual) sin activarlo. Terminar con .end()."""
+    parent = _current.get() if parent is None else parent
+    if parent is None:
+        if not TRACING_ENABLED or random.random() >= TRACING_SAMPLE_RATE:
+            return NOOP_SPAN
+        return Span(name, kind, f"{random.getrandbits(128) or 1:032x}", None, attributes)
+    if not parent.sampled:
+        return NOOP_SPAN
+    return Span(name, kind, parent.trace_id, parent.span_id, attributes)
+
+
+@contextmanager
+def span(name: str, kind: int = INTERNAL, attributes: dict | None = None, parent=None):
+    """Span activo durante el bloque; las excepciones lo marcan como error."""
+    sp = start_span(name, kind, attributes, parent)
+    token = _current.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current.reset(token)
+        sp.end()
+
+
+def current_traceparent() -> str | None:
+    sp = _current.get()
+    if isinstance(sp, Span):
+        return sp.traceparent()
+    return None
+
+
+# ────────────────────────────────────────────────
+# 📤 Exportadores
+# ────────────────────────────────────────────────
+def _envelope(spans: list[dict]) -> dict:
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACING_SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+    }]}
+
+
+class MemoryExporter:
+    def __init__(self, max_spans: int = TRACING_MEMORY_MAX_SPANS):
+        self._spans: deque = deque(maxlen=max_spans)
+
+    def export(self, span: dict):
+        self._spans.append(span)
+
+    def spans(self, trace_id: str | None = None) -> list[dict]:
+        items = list(self._spans)
+        return [s for s in items if s["traceId"] == trace_id] if trace_id else items
+
+    def clear(self):
+        self._spans.clear()
+
+    def flush(self):
+        pass
+
+
+class FileExporter:
+    """Acumula spans y escribe una línea OTLP/JSON por lote (cada 256 spans o 1 s)."""
+
+    def __init__(self, path: str = TRACING_FILE, max_batch: int = 256, max_delay: float = 1.0):
+        self.path = path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._buf: list[dict] = []
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        with self._lock:
+            self._buf.append(span)
+            if len(self._buf) < self.max_batch and time.monotonic() - self._last < self.max_delay:
+                return
+            batch, self._buf = self._buf, []
+            self._last = time.monotonic()
+            self._write(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self._buf = self._buf, []
+            self._write(batch)
+
+    def _write(self, batch: list[dict]):
+        if not batch:
+            return
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(_envelope(batch), separators=(",", ":")) + "\n")
+        except OSError as e:
+            print(f"⚠️  tracing: no se pudo escribir {self.path}: {e}")
+
+
+EXPORTER = FileExporter() if TRACING_EXPORTER == "file" else MemoryExporter() if TRACING_EXPORTER == "memory" else None
+if EXPORTER is not None:
+    atexit.register(EXPORTER.flush)
+
+
+def _emit(span: dict):
+    collected = _collector.get()
+    if collected is not None:
+        collected.append(span)
+    elif EXPORTER is not None:
+        EXPORTER.export(span)
+
+
+def export_remote(spans: list[dict]):
+    """Spans devueltos por un sidecar: se exportan como si fueran de este proceso."""
+    for s in spans or ():
+        if isinstance(s, dict) and s.get("traceId"):
+            _emit(s)
+
+
+def flush():
+    if EXPORTER is not None:
+        EXPORTER.flush()
+
+
+@contextmanager
+def remote_child(traceparent: str | None, name: str, attributes: dict | None = None):
+    """
+    Lado sidecar: span SERVER hijo del traceparent recibido → (span, lista). Los spans
+    terminados dentro del bloque se juntan en la lista (para enviarlos al padre) en vez
+    de exportarse aquí. Sin traceparent válido no se traza nada.
+    """
+    collected: list[dict] = []
+    parent = parse_traceparent(traceparent)
+    if parent is None:
+        # el API no está trazando esta llamada: nada de trazas raíz propias en el sidecar
+        token = _current.set(NOOP_SPAN)
+        try:
+            yield NOOP_SPAN, collected
+        finally:
+            _current.reset(token)
+        return
+    token = _collector.set(collected)
+    try:
+        with span(name, SERVER, attributes, parent=parent) as sp:
+            yield sp, collected
+    finally:
+        _collector.reset(token)
+
+
+# ────────────────────────────────────────────────
+# 🌐 HTTP
+# ────────────────────────────────────────────────
+class TracingMiddleware:
+    """ASGI puro: span SERVER por request, respetando un traceparent entrante."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = None
+        for key, value in scope.get("headers", ()):
+            if key == b"traceparent":
+                incoming = parse_traceparent(value.decode("latin-1"))
+                break
+
+        method = scope["method"]
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with span(f"{method}", SERVER, {"http.request.method": method, "url.path": scope["path"]},
+                  parent=incoming) as sp:
+            try:
+                await self.app(scope, receive, _send)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route and isinstance(sp, Span):
+                    sp.name = f"{method} {route}"
+                    sp.set_attribute("http.route", route)
+                sp.set_attribute("http.response.status_code", status)
+                if status >= 500:
+                    sp.set_error(f"HTTP {status}")
+
+
+# ────────────────────────────────────────────────
+# 📡 gRPC
+# ────────────────────────────────────────────────
+def _rpc_span(client_call_details):
+    method = client_call_details.method
+    if isinstance(method, bytes):
+        method = method.decode()
+    service, _, name = method.lstrip("/").rpartition("/")
+    return start_span(f"{service}/{name}", CLIENT, {"rpc.system": "grpc", "rpc.service": service, "rpc.method": name})
+
+
+def _finish_rpc(sp, code):
+    if code is None:
+        return sp.end()
+    sp.set_attribute("rpc.grpc.status_code", code.value[0])
+    if code != grpc.StatusCode.OK:
+        sp.set_error(code.name)
+    sp.end()
+
+
+class RpcTraceInterceptor(grpc.UnaryUnaryClientInterceptor):
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        sp = _rpc_span(client_call_details)
+        if not sp.sampled:
+            return continuation(client_call_details, request)
+        metadata = list(client_call_details.metadata or [])
+        metadata.append(("traceparent", sp.traceparent()))
+        outcome = continuation(client_call_details._replace(metadata=metadata), request)
+        _finish_rpc(sp, outcome.code())
+        return outcome
+
+
+class AsyncRpcTraceInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        sp = _rpc_span(client_call_details)
+        if not sp.sampled:
+            return await continuation(client_call_details, request)
+        metadata = grpc.aio.Metadata()
+        if client_call_details.metadata is not None:
+            for key, value in client_call_details.metadata:
+                metadata.add(key, value)
+        metadata.add("traceparent", sp.traceparent())
+        try:
+            call = await continuation(client_call_details._replace(metadata=metadata), request)
+        except BaseException as e:
+            sp.set_error(f"{type(e).__name__}: {e}")
+            sp.end()
+            raise
+        _finish_rpc(sp, await call.code())
+        return call
+
+
+def rpc_trace_interceptors() -> list:
+    return [RpcTraceInterceptor()] if TRACING_ENABLED else []
+
+
+def aio_rpc_trace_interceptors() -> list:
+    return [AsyncRpcTraceInterceptor()] if TRACING_ENABLED else []
+
+
+def trace_methods(prefix: str):
+    """Decorador de clase: span INTERNAL "<prefix>.<método>" en cada método público."""
+
+    def _wrap(fn, name):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def _async(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return _async
+
+        @functools.wraps(fn)
+        def _sync(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return _sync
+
+    def _decorate(cls):
+        if not TRACING_ENABLED:
+            return cls
+        for attr, fn in list(vars(cls).items()):
+            if not attr.startswith("_") and inspect.isfunction(fn):
+                setattr(cls, attr, _wrap(fn, f"{prefix}.{attr}"))
+        return cls
+
+    return _decorate
+
+
+# ────────────────────────────────────────────────
+# 🍃 Mongo
+# ────────────────────────────────────────────────
+_mongo_listener_cls = None
+
+
+def mongo_trace_listeners() -> list:
+    """CommandListener para Motor/pymongo (import perezoso: los sidecars no cargan pymongo)."""
+    global _mongo_listener_cls
+    if not TRACING_ENABLED:
+        return []
+    if _mongo_listener_cls is None:
+        from pymongo import monitoring
+
+        class MongoTraceListener(monitoring.CommandListener):
+            def __init__(self):
+                self._open: dict = {}
+
+            def started(self, event):
+                # solo como hijo de un span muestreado: sin él (ingestor, job worker, getMore
+                # del change stream, arranque) cada comando sería una traza raíz propia
+                parent = _current.get()
+                if parent is None or not parent.sampled:
+                    return
+                name = event.command_name
+                target = event.command.get("collection") if name == "getMore" else event.command.get(name)
+                collection = target if isinstance(target, str) else None
+                sp = start_span(f"{name} {collection}" if collection else name, CLIENT, {
+                    "db.system": "mongodb", "db.namespace": event.database_name,
+                    "db.operation.name": name, "db.collection.name": collection,
+                }, parent=parent)
+                if sp.sampled:
+                    self._open[(event.connection_id, event.request_id)] = sp
+
+            def succeeded(self, event):
+                sp = self._open.pop((event.connection_id, event.request_id), None)
+                if sp is not None:
+                    sp.end()
+
+            def failed(self, event):
+                sp = self._open.pop((event.connection_id, event.request_id), None)
+                if sp is not None:
+                    failure = event.failure or {}
+                    sp.set_error(failure.get("errmsg") or failure.get("codeName") or "failed")
+                    sp.end()
+
+        _mongo_listener_cls = MongoTraceListener
+    return [_mongo_listener_cls()]